@@ -6,42 +6,52 @@ ${MYSQL_CMD} -e "drop database if exists srv"
 ${MYSQL_CMD} -e "create database srv"
 python manage.py init
 
-# IP
-${MYSQL_CMD} srv -e "insert into ip (ip, is_used) values ('192.168.1.101', 1)"
-${MYSQL_CMD} srv -e "insert into ip (ip, is_used) values ('192.168.1.102', 1)"
-${MYSQL_CMD} srv -e "insert into ip (ip, is_used) values ('192.168.1.103', 1)"
-${MYSQL_CMD} srv -e "insert into ip (ip, is_used) values ('192.168.1.111', 1)"
-${MYSQL_CMD} srv -e "insert into ip (ip, is_used) values ('192.168.1.112', 1)"
-${MYSQL_CMD} srv -e "insert into ip (ip, is_used) values ('192.168.1.113', 1)"
-${MYSQL_CMD} srv -e "insert into ip (ip, is_used) values ('192.168.1.121', 1)"
-${MYSQL_CMD} srv -e "insert into ip (ip, is_used) values ('192.168.1.122', 0)"
-
-# role
-${MYSQL_CMD} srv -e "insert into role (role_name) values ('web')"
-${MYSQL_CMD} srv -e "insert into role (role_name) values ('app')"
-${MYSQL_CMD} srv -e "insert into role (role_name) values ('db')"
-${MYSQL_CMD} srv -e "insert into role (role_name) values ('session')"
-${MYSQL_CMD} srv -e "insert into role (role_name) values ('cache')"
-
-# host
-${MYSQL_CMD} srv -e "insert into host (host_name, ip, created_at, updated_at) values ('web01', '192.168.1.101', now(), now())"
-${MYSQL_CMD} srv -e "insert into host (host_name, ip, created_at, updated_at) values ('web02', '192.168.1.102', now(), now())"
-${MYSQL_CMD} srv -e "insert into host (host_name, ip, created_at, updated_at) values ('web03', '192.168.1.103', now(), now())"
-${MYSQL_CMD} srv -e "insert into host (host_name, ip, created_at, updated_at) values ('db01', '192.168.1.111', now(), now())"
-${MYSQL_CMD} srv -e "insert into host (host_name, ip, created_at, updated_at) values ('db02', '192.168.1.112', now(), now())"
-${MYSQL_CMD} srv -e "insert into host (host_name, ip, created_at, updated_at) values ('db03', '192.168.1.113', now(), now())"
-${MYSQL_CMD} srv -e "insert into host (host_name, ip, created_at, updated_at) values ('mem01', '192.168.1.121', now(), now())"
-
-# role_map
-${MYSQL_CMD} srv -e "insert into role_map (host_name, role_name) values ('web01', 'web')"
-${MYSQL_CMD} srv -e "insert into role_map (host_name, role_name) values ('web01', 'app')"
-${MYSQL_CMD} srv -e "insert into role_map (host_name, role_name) values ('web02', 'web')"
-${MYSQL_CMD} srv -e "insert into role_map (host_name, role_name) values ('web02', 'app')"
-${MYSQL_CMD} srv -e "insert into role_map (host_name, role_name) values ('web03', 'web')"
-${MYSQL_CMD} srv -e "insert into role_map (host_name, role_name) values ('web03', 'app')"
-${MYSQL_CMD} srv -e "insert into role_map (host_name, role_name) values ('db01', 'db')"
-${MYSQL_CMD} srv -e "insert into role_map (host_name, role_name) values ('db02', 'db')"
-${MYSQL_CMD} srv -e "insert into role_map (host_name, role_name) values ('db03', 'db')"
-${MYSQL_CMD} srv -e "insert into role_map (host_name, role_name) values ('mem01', 'session')"
-${MYSQL_CMD} srv -e "insert into role_map (host_name, role_name) values ('mem01', 'cache')"
+# one statement per table, in a single transaction
+${MYSQL_CMD} srv <<SQL
+begin;
 
+-- IP
+insert into ip (ip, is_used) values
+    ('192.168.1.101', 1),
+    ('192.168.1.102', 1),
+    ('192.168.1.103', 1),
+    ('192.168.1.111', 1),
+    ('192.168.1.112', 1),
+    ('192.168.1.113', 1),
+    ('192.168.1.121', 1),
+    ('192.168.1.122', 0);
+
+-- role
+insert into role (role_name) values
+    ('web'),
+    ('app'),
+    ('db'),
+    ('session'),
+    ('cache');
+
+-- host
+insert into host (host_name, ip, created_at, updated_at) values
+    ('web01', '192.168.1.101', now(), now()),
+    ('web02', '192.168.1.102', now(), now()),
+    ('web03', '192.168.1.103', now(), now()),
+    ('db01', '192.168.1.111', now(), now()),
+    ('db02', '192.168.1.112', now(), now()),
+    ('db03', '192.168.1.113', now(), now()),
+    ('mem01', '192.168.1.121', now(), now());
+
+-- role_map
+insert into role_map (host_name, role_name) values
+    ('web01', 'web'),
+    ('web01', 'app'),
+    ('web02', 'web'),
+    ('web02', 'app'),
+    ('web03', 'web'),
+    ('web03', 'app'),
+    ('db01', 'db'),
+    ('db02', 'db'),
+    ('db03', 'db'),
+    ('mem01', 'session'),
+    ('mem01', 'cache');
+
+commit;
+SQL
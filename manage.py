@@ -1,10 +1,86 @@
 import sys, os
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import inspect
 from srvadm import db
 from srvadm import app
+from srvadm.models import IP, Revision, ChangeLog
+from srvadm.changes import CHANGELOG_FLOOR
+from srvadm.dns import serve as serve_dns
+from srvadm.server import serve, is_async_worker
+
+def migrate():
+    # bring a database created by an older version up to the current models
+    db.create_all()
+    inspector = inspect(db.engine)
+    columns = [c['name'] for c in inspector.get_columns('ip')]
+    if 'ip_num' not in columns:
+        db.engine.execute('alter table ip add column ip_num int unsigned null')
+
+    # create_all leaves the indexes of existing tables alone
+    for table in db.metadata.sorted_tables:
+        names = [i['name'] for i in inspector.get_indexes(table.name)]
+        for index in table.indexes:
+            if index.name not in names:
+                index.create(db.engine)
+
+    while IP.backfill_ip_num(db.session.execute):
+        db.session.commit()
+    db.session.commit()
+
+def compact():
+    # drop change log entries past retention, oldest first; readers behind
+    # the recorded floor get 410 and resync from the full listings
+    before = datetime.now() - timedelta(days=app.config['CHANGELOG_RETENTION_DAYS'])
+    while True:
+        last_id = ChangeLog.delete_before(db.session.execute, before)
+        if last_id is None:
+            break
+        Revision.store(db.session.execute, CHANGELOG_FLOOR, last_id)
+        db.session.commit()
+    db.session.commit()
+
+def dns(args):
+    parser = argparse.ArgumentParser(prog='manage.py dns')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5353)
+    args = parser.parse_args(args)
+    serve_dns(args.host, args.port)
+
+def aio(args):
+    # aiohttp and aiomysql are only needed here
+    from srvadm.aio import serve as serve_aio
+    parser = argparse.ArgumentParser(prog='manage.py aio')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args(args)
+    serve_aio(args.host, args.port)
+
+def server(args):
+    parser = argparse.ArgumentParser(prog='manage.py serve')
+    parser.add_argument('--bind', default=app.config['SERVER_BIND'])
+    parser.add_argument('--workers', type=int, default=app.config['SERVER_WORKERS'])
+    parser.add_argument('--threads', type=int, default=app.config['SERVER_THREADS'])
+    parser.add_argument('--worker-class', default=app.config['SERVER_WORKER_CLASS'])
+    parser.add_argument('--timeout', type=int, default=app.config['SERVER_TIMEOUT'])
+    args = parser.parse_args(args)
+    if not is_async_worker(args.worker_class):
+        parser.error('--worker-class must be gevent, watchers would hold the workers')
+    serve(args.bind, args.workers, args.threads, args.worker_class, args.timeout)
 
 if __name__ == '__main__':
-    if len(sys.argv) == 2:
+    if len(sys.argv) >= 2 and sys.argv[1] == 'dns':
+        dns(sys.argv[2:])
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'serve':
+        server(sys.argv[2:])
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'aio':
+        aio(sys.argv[2:])
+    elif len(sys.argv) == 2:
         if sys.argv[1] == 'init':
             db.create_all()
+        elif sys.argv[1] == 'migrate':
+            migrate()
+        elif sys.argv[1] == 'compact':
+            compact()
         elif sys.argv[1] == 'run':
             app.run(host='0.0.0.0', port=5000)
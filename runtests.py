@@ -3,8 +3,18 @@ from unittest import (
 )
 
 from srvadm.tests.test_validator import TestValidator
+from srvadm.tests.test_formatter import TestFormatter
+from srvadm.tests.test_cache import TestLRUCache, TestCached
+from srvadm.tests.test_allocator import TestPoolBitmap
+from srvadm.tests.test_dns import TestDNS
+from srvadm.tests.test_watch import TestWatchHub
+from srvadm.tests.test_pool import TestTimedQueuePool
+from srvadm.tests.test_replica import TestReplicaSet
+from srvadm.tests.test_serializer import TestSerializer
+from srvadm.tests.test_compression import TestCompression
+from srvadm.tests.test_singleflight import TestSingleFlight
 from srvadm.tests.test_models import (
-    TestRole, TestIP, TestHost, TestRoleMap
+    TestRole, TestIP, TestHost, TestRoleMap, TestRevision
 )
 from srvadm.tests.test_api import TestApi
 from srvadm.tests.test_api_hosts_output import TestHostsOutput
@@ -16,9 +26,21 @@ def test_all():
         loader.loadTestsFromTestCase(TestIP), \
         loader.loadTestsFromTestCase(TestHost), \
         loader.loadTestsFromTestCase(TestRoleMap), \
+        loader.loadTestsFromTestCase(TestRevision), \
         loader.loadTestsFromTestCase(TestApi), \
         loader.loadTestsFromTestCase(TestHostsOutput), \
         loader.loadTestsFromTestCase(TestValidator), \
+        loader.loadTestsFromTestCase(TestFormatter), \
+        loader.loadTestsFromTestCase(TestLRUCache), \
+        loader.loadTestsFromTestCase(TestCached), \
+        loader.loadTestsFromTestCase(TestPoolBitmap), \
+        loader.loadTestsFromTestCase(TestDNS), \
+        loader.loadTestsFromTestCase(TestWatchHub), \
+        loader.loadTestsFromTestCase(TestTimedQueuePool), \
+        loader.loadTestsFromTestCase(TestReplicaSet), \
+        loader.loadTestsFromTestCase(TestSerializer), \
+        loader.loadTestsFromTestCase(TestCompression), \
+        loader.loadTestsFromTestCase(TestSingleFlight), \
     ]
 
     testsuites = TestSuite(suites)
@@ -1,10 +1,11 @@
 from flask import Flask
-from flask.ext.sqlalchemy import SQLAlchemy
+
+from srvadm.pool import PooledSQLAlchemy
 
 app = Flask(__name__)
 app.config.from_object('srvadm.config')
 
-db = SQLAlchemy(app)
+db = PooledSQLAlchemy(app)
 
 from srvadm import api
 from srvadm import models
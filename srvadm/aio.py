@@ -0,0 +1,399 @@
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from aiohttp import web
+from aiomysql.sa import create_engine
+from sqlalchemy.engine.url import make_url
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from srvadm import app
+from srvadm.models import Role, IP, Host, RoleMap, Pool, Revision
+from srvadm.formatter import formatters, hosts_formatter
+from srvadm.serializer import encode, etag_suffix
+from srvadm.compression import negotiate_encoding, compressed, encoded_etag, etag_variants
+from srvadm.params import (
+    parse_page, next_cursor, parse_is_used, parse_cidr, parse_fields, parse_roles
+)
+from srvadm.api import HOST_FIELDS, host_columns
+from srvadm.decorator import in_current_second
+from srvadm.artifact import TABLES as ARTIFACT_TABLES, ALL_HOSTS
+
+# the read-only GET routes of api.py on asyncio: the same statements and
+# the same response bodies and headers, with waiting requests parked on the
+# event loop instead of holding a thread and a connection each
+
+# bodies of the error handlers of api.py
+MESSAGES = {
+    400: 'Check the format you requested',
+    404: 'Not found',
+    500: 'Could not complete your request. may be duprecated.',
+}
+
+routes = []
+
+class HTTPError(Exception):
+
+    def __init__(self, code):
+        Exception.__init__(self, code)
+        self.code = code
+
+def route(path, *tables):
+    # @app.route + @crossdomain(origin='*') + @conditional(*tables)
+    def decorator(f):
+        async def handler(request):
+            try:
+                async with request.app['engine'].acquire() as conn:
+                    resp = await conditional(request, conn, tables, f)
+                if resp.status in (200, 304):
+                    resp = compress_response(request, resp)
+            except HTTPError as e:
+                resp = json_response(request, dict(message=MESSAGES[e.code]), e.code)
+            except Exception:
+                app.logger.exception('%s failed', request.path)
+                resp = json_response(request, dict(message=MESSAGES[500]), 500)
+            resp.headers['Access-Control-Allow-Origin'] = '*'
+            resp.headers['Access-Control-Max-Age'] = '0'
+            return resp
+
+        routes.append((path, handler))
+        return f
+    return decorator
+
+async def conditional(request, conn, tables, f):
+    revisions = dict((r.name, (r.rev, r.updated_at))
+            for r in await fetchall(conn, Revision.revisions_stmt(tables)))
+    current = dict((t, revisions.get(t, (0, None))[0]) for t in tables)
+    etag = '-'.join('%s.%d' % (t, current[t]) for t in tables) + \
+            etag_suffix(parse_accept_header(request.headers.get('Accept'), MIMEAccept))
+    modified = [updated_at for rev, updated_at in revisions.values()]
+    last_modified = max(modified) if modified else None
+
+    if is_not_modified(request, etag, last_modified):
+        resp = web.Response(status=304)
+        etag = held_etag(request, etag)
+    else:
+        resp = await f(request, conn, current)
+        if resp.status != 200:
+            return resp
+
+    # the tag depends on the encoding negotiated from Accept
+    resp.headers['Vary'] = 'Accept'
+    resp.headers['ETag'] = '"%s"' % etag
+    if last_modified is not None:
+        resp.headers['Last-Modified'] = format_datetime(
+                last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return resp
+
+def if_none_match_tags(request):
+    # strong tags only, as werkzeug compares them
+    return [t.strip() for t in request.headers.get('If-None-Match', '').split(',') if t.strip()]
+
+def held_etag(request, etag):
+    # the form of the tag the client holds, repeated on a 304
+    tags = if_none_match_tags(request)
+    for tag in etag_variants(etag):
+        if '"%s"' % tag in tags:
+            return tag
+    return etag
+
+def is_not_modified(request, etag, last_modified):
+    tags = if_none_match_tags(request)
+    if tags:
+        return '*' in tags or any('"%s"' % tag in tags for tag in etag_variants(etag))
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        return not in_current_second(last_modified) and \
+                last_modified.replace(microsecond=0) <= since
+    return False
+
+def compress_response(request, resp):
+    # as compression.compress_response does for the flask views
+    resp.headers['Vary'] = ', '.join(v for v in (resp.headers.get('Vary'), 'Accept-Encoding') if v)
+    if resp.status == 304 or request.method == 'HEAD':
+        return resp
+    encoding = negotiate_encoding(parse_accept_header(request.headers.get('Accept-Encoding')))
+    if encoding is None or len(resp.body) < app.config['COMPRESS_MIN_SIZE']:
+        return resp
+    etag = resp.headers.get('ETag')
+    resp.body = compressed(resp.body, encoding, etag)
+    if etag is not None:
+        resp.headers['ETag'] = '"%s"' % encoded_etag(etag.strip('"'), encoding)
+    resp.headers['Content-Encoding'] = encoding
+    return resp
+
+async def fetchall(conn, stmt):
+    result = await conn.execute(stmt)
+    return await result.fetchall()
+
+def json_response(request, obj, status=200):
+    # byte for byte what serialize writes for the flask views
+    xhr = request.headers.get('X-Requested-With', '').lower() == 'xmlhttprequest'
+    accept = parse_accept_header(request.headers.get('Accept'), MIMEAccept)
+    body, mimetype = encode(obj, accept, app.debug and not xhr)
+    resp = web.Response(body=body, status=status, content_type=mimetype)
+    resp.headers['Vary'] = 'Accept'
+    return resp
+
+def text_response(body):
+    return web.Response(body=body, content_type='text/html', charset='utf-8')
+
+def formatted(request, fmt, rs):
+    f = formatters.get(fmt)
+    if f is None:
+        return json_response(request, dict(result=list(rs)))
+    return text_response(''.join(f(rs)).encode('utf-8'))
+
+def paged(request, fmt, result, page, cursor):
+    if page['limit'] is None:
+        return formatted(request, fmt, result)
+    if fmt in formatters:
+        resp = formatted(request, fmt, result)
+        if cursor is not None:
+            resp.headers['X-Next-Cursor'] = cursor
+        return resp
+    return json_response(request, dict(result=result, next=cursor))
+
+def args(parse, *values):
+    try:
+        return parse(*values)
+    except ValueError:
+        raise HTTPError(400)
+
+def page_args(request, sorts):
+    return args(parse_page, request.query, sorts, app.config['PAGE_LIMIT_MAX'])
+
+# IP
+async def list_ips(request, conn, is_used):
+    fmt = request.query.get('format')
+    page = page_args(request, ['ip'])
+
+    cidr = args(parse_cidr, request.query.get('cidr'))
+    rows = await fetchall(conn, IP.page_stmt(is_used=is_used, cidr=cidr, **page))
+    result = [r.ip for r in rows]
+    return paged(request, fmt, result, page, next_cursor(page, result))
+
+@route('/api/list/ip', 'ip')
+async def list_ip(request, conn, revisions):
+    return await list_ips(request, conn, args(parse_is_used, request.query.get('is_used')))
+
+@route('/api/list/ip/used', 'ip')
+async def list_ip_used(request, conn, revisions):
+    return await list_ips(request, conn, 1)
+
+@route('/api/list/ip/unused', 'ip')
+async def list_ip_unused(request, conn, revisions):
+    return await list_ips(request, conn, 0)
+
+@route('/api/list/ip/role/{role_name}', 'host', 'role_map')
+async def list_ip_by_role(request, conn, revisions):
+    fmt = request.query.get('format')
+    page = page_args(request, ['host_name', 'ip'])
+
+    stmt = Host.page_stmt(role_name=request.match_info['role_name'], **page)
+    rows = await fetchall(conn, stmt)
+    result = [r.ip for r in rows]
+    return paged(request, fmt, result, page, next_cursor(page, [r[page['sort']] for r in rows]))
+
+@route('/api/ip', 'ip')
+async def all_ip(request, conn, revisions):
+    page = page_args(request, ['ip'])
+
+    stmt = IP.page_stmt(is_used=args(parse_is_used, request.query.get('is_used')),
+            cidr=args(parse_cidr, request.query.get('cidr')), **page)
+    ips = await fetchall(conn, stmt)
+    result = [dict(ip=ip, is_used=is_used) for ip, is_used in ips]
+    return paged(request, None, result, page, next_cursor(page, [r.ip for r in ips]))
+
+@route('/api/ip/{ipaddr}', 'host', 'role_map')
+async def search_by_ip(request, conn, revisions):
+    stmt = Host.with_roles_stmt(ips=[request.match_info['ipaddr']])
+    return host_response(request, Host.fold_roles(await fetchall(conn, stmt)))
+
+# Role
+@route('/api/list/role', 'role')
+async def list_role(request, conn, revisions):
+    fmt = request.query.get('format')
+    page = page_args(request, ['role'])
+
+    result = [r[0] for r in await fetchall(conn, Role.page_stmt(**page))]
+    return paged(request, fmt, result, page, next_cursor(page, result))
+
+@route('/api/role', 'role')
+async def all_role(request, conn, revisions):
+    page = page_args(request, ['role'])
+
+    role_names = [r[0] for r in await fetchall(conn, Role.page_stmt(**page))]
+    result = [dict(role=role_name) for role_name in role_names]
+    return paged(request, None, result, page, next_cursor(page, role_names))
+
+@route('/api/role/{role_name}', 'host', 'role_map')
+async def search_by_role(request, conn, revisions):
+    fields = args(parse_fields, request.query.get('fields'), HOST_FIELDS)
+
+    stmt = Host.page_stmt(role_name=request.match_info['role_name'],
+            columns=host_columns(fields))
+    hosts = await fetchall(conn, stmt)
+    if len(hosts) == 0:
+        raise HTTPError(404)
+
+    result = await shape_hosts(conn, hosts, fields)
+    return json_response(request, dict(result=result))
+
+# Host
+@route('/api/list/host', 'host', 'role_map')
+async def list_host(request, conn, revisions):
+    fmt = request.query.get('format')
+    page = page_args(request, ['host_name', 'ip'])
+
+    stmt = Host.page_stmt(role_name=request.query.get('role'), **page)
+    rows = await fetchall(conn, stmt)
+    result = [r.host_name for r in rows]
+    return paged(request, fmt, result, page, next_cursor(page, [r[page['sort']] for r in rows]))
+
+@route('/api/host/{host_name}', 'host', 'role_map')
+async def search_by_host(request, conn, revisions):
+    stmt = Host.with_roles_stmt(host_names=[request.match_info['host_name']])
+    return host_response(request, Host.fold_roles(await fetchall(conn, stmt)))
+
+@route('/api/host', 'host', 'role_map')
+async def all_host(request, conn, revisions):
+    page = page_args(request, ['host_name', 'ip'])
+    fields = args(parse_fields, request.query.get('fields'), HOST_FIELDS)
+
+    stmt = Host.page_stmt(role_name=request.query.get('role'),
+            columns=host_columns(fields, page['sort']), **page)
+    hosts = await fetchall(conn, stmt)
+    if len(hosts) == 0 and page['after'] is None:
+        raise HTTPError(404)
+
+    result = await shape_hosts(conn, hosts, fields, all_hosts=page['limit'] is None)
+    return paged(request, None, result, page, next_cursor(page, [r[page['sort']] for r in hosts]))
+
+async def shape_hosts(conn, hosts, fields, all_hosts=False):
+    roles = {}
+    if 'role' in fields:
+        host_names = None if all_hosts else [r.host_name for r in hosts]
+        for stmt in RoleMap.role_names_by_host_names_stmts(host_names):
+            RoleMap.fold_role_names(await fetchall(conn, stmt), roles)
+
+    result = []
+    for host in hosts:
+        d = {}
+        for f in fields:
+            d[f] = roles.get(host.host_name, []) if f == 'role' else host[f]
+        result.append(d)
+    return result
+
+def host_response(request, hosts):
+    if not hosts:
+        raise HTTPError(404)
+    host_name, ip, role_names = hosts[0]
+    return json_response(request, dict(result=[dict(host_name=host_name, ip=ip, role=role_names)]))
+
+# Pool
+@route('/api/pool', 'pool')
+async def all_pool(request, conn, revisions):
+    pools = await fetchall(conn, Pool.all_stmt())
+    result = [dict(name=name, cidr=cidr) for name, cidr in pools]
+    return json_response(request, dict(result=result))
+
+# hosts
+@route('/api/hosts', 'host', 'role_map')
+async def search_by_roles(request, conn, revisions):
+    fmt = request.query.get('format')
+    role_names, match_all = args(parse_roles, request.query.getall('role', []),
+            request.query.get('match', 'all'))
+    if not role_names:
+        raise HTTPError(400)
+
+    hosts = await fetchall(conn, Host.by_role_names_stmt(role_names, match_all))
+    if fmt in ('csv', 'space'):
+        return formatted(request, fmt, [r.ip for r in hosts])
+    result = [dict(host_name=host_name, ip=ip) for host_name, ip in hosts]
+    return formatted(request, fmt, result)
+
+class HostsArtifacts(object):
+    # rendered hosts files of the revisions they were read at; this process
+    # does not write, so revisions are the only invalidation needed
+
+    def __init__(self):
+        self.revisions = None
+        self.artifacts = {}
+
+    async def get(self, conn, role_name, revisions):
+        revisions = dict((t, revisions[t]) for t in ARTIFACT_TABLES)
+        if self.revisions != revisions:
+            self.artifacts = {}
+            self.revisions = revisions
+        body = self.artifacts.get(role_name)
+        if body is None:
+            if role_name is ALL_HOSTS:
+                stmt = Host.all_stmt()
+            else:
+                stmt = Host.by_role_name_stmt(role_name)
+            hosts = await fetchall(conn, stmt)
+            body = ''.join(hosts_formatter(hosts)).encode('utf-8')
+            # empty ones are 404s and not kept, see artifact.py
+            if self.revisions == revisions and body:
+                self.artifacts[role_name] = body
+        return body
+
+hosts_artifacts = HostsArtifacts()
+
+@route('/api/hosts_output', 'host', 'role_map')
+async def output_all_hosts(request, conn, revisions):
+    role_names, match_all = args(parse_roles, request.query.getall('role', []),
+            request.query.get('match', 'all'))
+    if len(role_names) > 1:
+        hosts = await fetchall(conn, Host.by_role_names_stmt(role_names, match_all))
+        if len(hosts) == 0:
+            raise HTTPError(404)
+        return formatted(request, 'hosts', hosts)
+    if role_names:
+        return await output_hosts_artifact(conn, role_names[0], revisions)
+    return await output_hosts_artifact(conn, ALL_HOSTS, revisions)
+
+@route('/api/hosts_output/{role_name}', 'host', 'role_map')
+async def output_hosts(request, conn, revisions):
+    return await output_hosts_artifact(conn, request.match_info['role_name'], revisions)
+
+async def output_hosts_artifact(conn, role_name, revisions):
+    body = await hosts_artifacts.get(conn, role_name, revisions)
+    if not body:
+        raise HTTPError(404)
+    return text_response(body)
+
+async def open_engine(application):
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    # autocommit, so every statement sees the latest committed writes
+    application['engine'] = await create_engine(
+        host=url.host or 'localhost',
+        port=url.port or 3306,
+        user=url.username,
+        password=url.password or '',
+        db=url.database,
+        charset=url.query.get('charset', 'utf8'),
+        autocommit=True,
+        minsize=app.config['AIO_POOL_MINSIZE'],
+        maxsize=app.config['AIO_POOL_MAXSIZE'])
+
+async def close_engine(application):
+    application['engine'].close()
+    await application['engine'].wait_closed()
+
+def create_app():
+    application = web.Application()
+    for path, handler in routes:
+        application.router.add_get(path, handler)
+    application.on_startup.append(open_engine)
+    application.on_cleanup.append(close_engine)
+    return application
+
+def serve(host, port):
+    web.run_app(create_app(), host=host, port=port)
@@ -0,0 +1,206 @@
+from threading import Lock
+
+from flask import g
+
+from srvadm import app, db
+from srvadm.models import IP, Pool, Revision, ChangeLog
+from srvadm.validator import ip_to_int, int_to_ip, cidr_range
+from srvadm.changes import on_commit, changelog_entry, CHANGELOG, CHANGELOG_FLOOR
+
+AUTO_IP_PREFIX = 'auto:'
+
+# revisions the free bitmaps are built from
+TABLES = ('ip', 'pool')
+
+class PoolBitmap(object):
+    # one bit per address of the pool, set while the address is free
+
+    def __init__(self, cidr, first, last):
+        self.cidr = cidr
+        self.first = first
+        self.size = last - first + 1
+        self.bits = bytearray((self.size + 7) // 8)
+        self.free = 0
+        # no free address below this offset
+        self.cursor = 0
+
+    def set_free(self, ip_num, free):
+        i = ip_num - self.first
+        if not 0 <= i < self.size:
+            return
+        byte, bit = divmod(i, 8)
+        mask = 1 << bit
+        if free and not self.bits[byte] & mask:
+            self.bits[byte] |= mask
+            self.free += 1
+            self.cursor = min(self.cursor, i)
+        elif not free and self.bits[byte] & mask:
+            self.bits[byte] &= ~mask
+            self.free -= 1
+
+    def next_free(self):
+        byte = self.cursor // 8
+        while byte < len(self.bits) and self.bits[byte] == 0:
+            byte += 1
+        if byte == len(self.bits):
+            self.cursor = self.size
+            return None
+        b = self.bits[byte]
+        i = byte * 8 + (b & -b).bit_length() - 1
+        self.cursor = i
+        return self.first + i
+
+class PoolNotFound(Exception):
+    pass
+
+class PoolExhausted(Exception):
+    pass
+
+class Allocator(object):
+
+    def __init__(self):
+        self.revisions = None
+        # change log id the bitmaps are current as of, and the changelog
+        # revision it was read at
+        self.last_id = None
+        self.changelog_rev = None
+        self.pools = {}
+        self.lock = Lock()
+
+    def clear(self):
+        with self.lock:
+            self.pools = {}
+            self.revisions = None
+            self.last_id = None
+            self.changelog_rev = None
+
+    def load(self, revisions):
+        # the revision before the id: a commit in between makes it look
+        # stale, never current
+        changelog_rev = self.select_changelog_rev()
+        last_id = ChangeLog.select_last_id(db.session.execute)
+        pools = {}
+        for name, cidr in Pool.select_all(db.session.execute):
+            pool = PoolBitmap(cidr, *cidr_range(cidr))
+            ips = IP.select_in_subnet(db.session.execute, cidr)
+            for ip in ips:
+                if ip.is_used == 0:
+                    pool.set_free(ip_to_int(ip.ip), True)
+            pools[name] = pool
+        self.pools = pools
+        self.revisions = revisions
+        self.last_id = last_id
+        self.changelog_rev = changelog_rev
+
+    def select_changelog_rev(self):
+        revisions = Revision.select_revisions(db.session.execute, [CHANGELOG])
+        return revisions.get(CHANGELOG, (0, None))[0]
+
+    def catch_up(self, revisions):
+        # apply what other processes wrote since last_id from the change
+        # log; False when only a full load will do
+        floor = Revision.select_revisions(db.session.execute, [CHANGELOG_FLOOR])
+        if self.last_id is None or self.last_id < floor.get(CHANGELOG_FLOOR, (0, None))[0]:
+            return False
+        changelog_rev = self.select_changelog_rev()
+        limit = app.config['CHANGES_LIMIT']
+        while True:
+            rows = ChangeLog.select_since(db.session.execute, self.last_id, limit)
+            for entry in [changelog_entry(r) for r in rows]:
+                if entry['table'] == 'pool':
+                    return False
+                if entry['table'] == 'ip':
+                    self.apply(entry['key'], entry['data'])
+            if rows:
+                self.last_id = rows[-1].id
+            if len(rows) < limit:
+                break
+        self.revisions = revisions
+        self.changelog_rev = changelog_rev
+        return True
+
+    def apply(self, ipaddr, data):
+        for pool in self.pools.values():
+            pool.set_free(ip_to_int(ipaddr), False)
+            if data:
+                pool.set_free(ip_to_int(data['ip']), data['is_used'] == 0)
+
+    def allocate(self, name):
+        revisions = Revision.select_revisions(db.session.execute, TABLES)
+        revisions = dict((t, revisions.get(t, (0, None))[0]) for t in TABLES)
+        while True:
+            with self.lock:
+                if self.revisions != revisions and not self.catch_up(revisions):
+                    self.load(revisions)
+                pool = self.pools.get(name)
+                if pool is None:
+                    raise PoolNotFound("pool not found")
+                ip_num = pool.next_free()
+                if ip_num is None:
+                    raise PoolExhausted("pool exhausted")
+                # taken out of the bitmap, so other threads move on while
+                # this one claims it
+                pool.set_free(ip_num, False)
+            ipaddr = int_to_ip(ip_num)
+            # the bitmap may lag behind writes of other processes
+            if IP.claim(db.session.execute, ipaddr):
+                break
+
+        if not hasattr(g, 'allocated'):
+            g.allocated = []
+        g.allocated.append(ipaddr)
+        return ipaddr
+
+    def release(self, ipaddrs):
+        with self.lock:
+            for ipaddr in ipaddrs:
+                for pool in self.pools.values():
+                    pool.set_free(ip_to_int(ipaddr), True)
+
+    def stats(self):
+        with self.lock:
+            return [dict(name=name, cidr=pool.cidr, free=pool.free)
+                    for name, pool in sorted(self.pools.items())]
+
+    def update(self, changes, revisions, last_change_id=None):
+        with self.lock:
+            if self.revisions is None:
+                return
+            current = dict(self.revisions)
+            for t in TABLES:
+                if t not in revisions:
+                    continue
+                if current[t] != revisions[t] - 1:
+                    # someone else wrote in between; the next allocation
+                    # catches up from the change log
+                    return
+                current[t] = revisions[t]
+
+            for c in changes:
+                if c.table == 'pool':
+                    self.revisions = None
+                    return
+                if c.table == 'ip':
+                    self.apply(c.key, c.data)
+            self.revisions = current
+
+            # the rows just applied are not replayed by the next catch up,
+            # unless another writer logged since last_id
+            if last_change_id is not None and self.changelog_rev is not None \
+                    and revisions.get(CHANGELOG) == self.changelog_rev + 1:
+                self.last_id = last_change_id
+                self.changelog_rev = revisions[CHANGELOG]
+
+allocator = Allocator()
+
+@on_commit
+def update_allocator(changes, revisions):
+    allocator.update(changes, revisions, getattr(g, 'last_change_id', None))
+    g.allocated = []
+
+@app.teardown_request
+def release_uncommitted(exc):
+    # addresses claimed by a request that never committed are free again
+    allocated = getattr(g, 'allocated', None)
+    if allocated:
+        allocator.release(allocated)
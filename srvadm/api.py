@@ -1,81 +1,111 @@
 from flask import (
-    request, jsonify, abort, make_response, current_app
+    request, abort, make_response, current_app, g, Response,
+    stream_with_context
 )
 
 from srvadm import app, db
-from srvadm.models import Role, IP, Host, RoleMap
-from srvadm.validator import is_valid_ip, is_valid_keys
-from srvadm.decorator import crossdomain
+from srvadm.models import Role, IP, Host, RoleMap, Pool, Revision, ChangeLog
+from srvadm.validator import (
+    is_valid_ip, is_valid_keys, is_valid_cidr, cidr_size, cidr_hosts,
+    is_valid_ip_range, ip_to_int, int_to_ip, count_host_names, expand_host_names
+)
+from srvadm.decorator import crossdomain, conditional, coalesced
+from srvadm.singleflight import single_flight
+from srvadm.cache import model_cache
+from srvadm.changes import (
+    record_change, pop_changes, notify, changelog_entry, CHANGELOG, CHANGELOG_FLOOR
+)
+from srvadm.artifact import hosts_artifacts, ALL_HOSTS
+from srvadm.allocator import allocator, PoolNotFound, PoolExhausted, AUTO_IP_PREFIX
+from srvadm.formatter import formatter, formatters
+from srvadm.serializer import serialize
+from srvadm.compression import compressed_cache
+from srvadm.params import (
+    parse_page, next_cursor, parse_is_used, parse_cidr, parse_fields, parse_roles,
+    unique_role_names
+)
+from srvadm.watch import watch_hub, catch_up
+from srvadm.replica import replica_set
 
 from functools import update_wrapper
-from datetime import timedelta
+import json
+import time
+from datetime import timedelta, datetime
 
 # IP
 @app.route('/api/list/ip')
 @crossdomain(origin='*')
+@conditional('ip')
 def list_ip():
     fmt = request.args.get('format')
+    page = page_args(request, ['ip'])
 
-    ips = IP.get_all(db.session.query)
-    result = [r.ip for r in ips]
-    return formatter(fmt, result)
+    rows = IP.select_page(db.session.execute, is_used=is_used_arg(request), cidr=cidr_arg(request), **page)
+    result = [r.ip for r in rows]
+    return paged(fmt, result, page, next_cursor(page, result))
 
 
 @app.route('/api/list/ip/used')
 @crossdomain(origin='*')
+@conditional('ip')
 def list_ip_used():
     fmt = request.args.get('format')
+    page = page_args(request, ['ip'])
 
-    ips = IP.get_used(db.session.query)
-    result = [r.ip for r in ips]
-    return formatter(fmt, result)
+    rows = IP.select_page(db.session.execute, is_used=1, cidr=cidr_arg(request), **page)
+    result = [r.ip for r in rows]
+    return paged(fmt, result, page, next_cursor(page, result))
 
 
 @app.route('/api/list/ip/unused')
 @crossdomain(origin='*')
+@conditional('ip')
 def list_ip_unused():
     fmt = request.args.get('format')
+    page = page_args(request, ['ip'])
 
-    ips = IP.get_unused(db.session.query)
-    result = [r.ip for r in ips]
-    return formatter(fmt, result)
+    rows = IP.select_page(db.session.execute, is_used=0, cidr=cidr_arg(request), **page)
+    result = [r.ip for r in rows]
+    return paged(fmt, result, page, next_cursor(page, result))
 
 
 @app.route('/api/list/ip/role/<string:role_name>')
 @crossdomain(origin='*')
+@conditional('host', 'role_map')
+@coalesced
 def list_ip_by_role(role_name):
     fmt = request.args.get('format')
+    page = page_args(request, ['host_name', 'ip'])
 
-    role_maps = RoleMap.get_by_role_name(db.session.query, role_name)
-    host_names = [role_map.host_name for role_map in role_maps]
-    hosts = Host.get_in_host_names(db.session.query, host_names)
-    result = [r.ip for r in hosts]
-    return formatter(fmt, result)
+    rows = Host.select_page(db.session.execute, role_name=role_name, **page)
+    result = [r.ip for r in rows]
+    return paged(fmt, result, page, next_cursor(page, [r[page['sort']] for r in rows]))
 
 
 # TODO: test
 @app.route('/api/ip')
 @crossdomain(origin='*')
+@conditional('ip')
 def all_ip():
-    result = []
-    ips = IP.get_all(db.session.query)
-    for ip in ips:
-        result.append(dict(ip=ip.ip, is_used=ip.is_used))
-    return jsonify(result=result)
+    page = page_args(request, ['ip'])
+
+    ips = IP.select_page(db.session.execute, is_used=is_used_arg(request),
+            cidr=cidr_arg(request), **page)
+    result = [dict(ip=ip, is_used=is_used) for ip, is_used in ips]
+    return paged(None, result, page, next_cursor(page, [r.ip for r in ips]))
 
 @app.route('/api/ip/<string:ipaddr>')
 @crossdomain(origin='*')
+@conditional('host', 'role_map')
 def search_by_ip(ipaddr):
 
-    host = Host.get_one_by_ip(db.session.query, ipaddr)
+    host = Host.select_one_by_ip(db.session.execute, ipaddr)
     if not host:
         abort(404)
 
-    role_maps = RoleMap.get_by_host_name(db.session.query, host.host_name)
-    role_names = [r.role_name for r in role_maps]
-
-    result = [dict(host_name=host.host_name, ip=host.ip, role=role_names)]
-    return jsonify(result=result)
+    host_name, ip, role_names = host
+    result = [dict(host_name=host_name, ip=ip, role=role_names)]
+    return serialize(result=result)
 
 
 @app.route('/api/ip', methods=['POST'])
@@ -91,10 +121,11 @@ def add_ip():
         check_registerable_ip(ipaddr)
         ip = IP(ip=ipaddr)
         db.session.add(ip)
-        db.session.commit()
+        record_change('ip', 'insert', ipaddr, dict(ip=ipaddr, is_used=0))
+        commit_changes('ip')
     except Exception as e:
         abort(500)
-    return jsonify(result=[dict(message='OK', request='add ip', payload=str(request.json))])
+    return serialize(result=[dict(message='OK', request='add ip', payload=str(request.json))])
 
 
 @app.route('/api/ip/<string:old_ipaddr>', methods=['PUT'])
@@ -111,11 +142,17 @@ def update_ip(old_ipaddr):
         ip = IP.get_one(db.session.query, old_ipaddr)
         if ip.is_used == 1:
             ip.is_used = 1
+            host = Host.get_one_by_ip(db.session.query, old_ipaddr)
+            if host:
+                role_names = [r.role_name for r in host.role]
+                record_change('host', 'update', host.host_name,
+                        dict(host_name=host.host_name, ip=new_ipaddr, role=role_names))
         ip.ip = new_ipaddr
-        db.session.commit()
+        record_change('ip', 'update', old_ipaddr, dict(ip=new_ipaddr, is_used=ip.is_used))
+        commit_changes('ip', 'host')
     except Exception as e:
         abort(500)
-    return jsonify(result=[dict(message='OK', request='update ip', payload=str(request.json))])
+    return serialize(result=[dict(message='OK', request='update ip', payload=str(request.json))])
 
 
 @app.route('/api/ip/<string:ipaddr>', methods=['DELETE'])
@@ -126,12 +163,94 @@ def delete_ip(ipaddr):
         abort(400)
     try:
         delete_unused_ip(ipaddr)
-        db.session.commit()
+        commit_changes('ip')
     except Exception as e:
         print(ipaddr)
         print(e)
         abort(500)
-    return jsonify(result=[dict(message='OK', request='delete ip', payload=str(request.json))])
+    return serialize(result=[dict(message='OK', request='delete ip', payload=str(request.json))])
+
+
+@app.route('/api/ip/bulk', methods=['POST'])
+@crossdomain(origin='*')
+def add_ip_bulk():
+    ipaddrs = bulk_ip_request(request)
+    try:
+        existing = set(r.ip for r in IP.select_in_ips(db.session.execute, ipaddrs))
+        added = [ipaddr for ipaddr in ipaddrs if ipaddr not in existing]
+        IP.insert_many(db.session.execute, added)
+        for ipaddr in added:
+            record_change('ip', 'insert', ipaddr, dict(ip=ipaddr, is_used=0))
+        commit_changes('ip')
+    except Exception as e:
+        abort(500)
+    conflict = [ipaddr for ipaddr in ipaddrs if ipaddr in existing]
+    return serialize(result=[dict(message='OK', request='add ip bulk', added=len(added), conflict=conflict)])
+
+
+@app.route('/api/ip/bulk', methods=['DELETE'])
+@crossdomain(origin='*')
+def delete_ip_bulk():
+    ipaddrs = bulk_ip_request(request)
+    try:
+        rows = IP.select_in_ips(db.session.execute, ipaddrs)
+        deleted = [r.ip for r in rows if r.is_used == 0]
+        used = [r.ip for r in rows if r.is_used == 1]
+        IP.delete_unused_in_ips(db.session.execute, deleted)
+        for ipaddr in deleted:
+            record_change('ip', 'delete', ipaddr)
+        commit_changes('ip')
+    except Exception as e:
+        abort(500)
+    found = set(r.ip for r in rows)
+    not_found = [ipaddr for ipaddr in ipaddrs if ipaddr not in found]
+    return serialize(result=[dict(message='OK', request='delete ip bulk', deleted=len(deleted), used=used, not_found=not_found)])
+
+
+def is_used_arg(req):
+    try:
+        return parse_is_used(req.args.get('is_used'))
+    except ValueError:
+        abort(400)
+
+
+def cidr_arg(req):
+    try:
+        return parse_cidr(req.args.get('cidr'))
+    except ValueError:
+        abort(400)
+
+
+def bulk_ip_request(req):
+    # {"ip": [...], "cidr": [...]} expanded to unique addresses in request order
+    if not is_json_request(req) or not isinstance(req.json, dict):
+        abort(400)
+    ips = req.json.get('ip', [])
+    cidrs = req.json.get('cidr', [])
+    if not isinstance(ips, list) or not isinstance(cidrs, list) or not (ips or cidrs):
+        abort(400)
+
+    ipaddrs = []
+    for ipaddr in ips:
+        if not isinstance(ipaddr, str) or not is_valid_ip(ipaddr):
+            abort(400)
+        ipaddrs.append(ipaddr)
+    for cidr in cidrs:
+        if not isinstance(cidr, str) or not is_valid_cidr(cidr):
+            abort(400)
+        if len(ipaddrs) + cidr_size(cidr) > current_app.config['BULK_IP_LIMIT']:
+            abort(400)
+        ipaddrs.extend(cidr_hosts(cidr))
+
+    seen = set()
+    unique = []
+    for ipaddr in ipaddrs:
+        if ipaddr not in seen:
+            seen.add(ipaddr)
+            unique.append(ipaddr)
+    if len(unique) > current_app.config['BULK_IP_LIMIT']:
+        abort(400)
+    return unique
 
 
 def delete_unused_ip(ipaddr):
@@ -141,46 +260,45 @@ def delete_unused_ip(ipaddr):
             raise
         try:
             db.session.delete(ip)
+            record_change('ip', 'delete', ipaddr)
         except Exception as e:
             raise
 
 # Role
 @app.route('/api/list/role')
 @crossdomain(origin='*')
+@conditional('role')
 def list_role():
     fmt = request.args.get('format')
+    page = page_args(request, ['role'])
 
-    roles = Role.get_all(db.session.query)
-    result = [r.role_name for r in roles]
-    return formatter(fmt, result)
+    result = Role.select_page(db.session.execute, **page)
+    return paged(fmt, result, page, next_cursor(page, result))
 
 @app.route('/api/role', methods=['GET'])
 @crossdomain(origin='*')
+@conditional('role')
 def all_role():
-    result = []
-    roles = Role.get_all(db.session.query)
-    for role in roles:
-        result.append(dict(role=role.role_name))
-    return jsonify(result=result)
+    page = page_args(request, ['role'])
+
+    role_names = Role.select_page(db.session.execute, **page)
+    result = [dict(role=role_name) for role_name in role_names]
+    return paged(None, result, page, next_cursor(page, role_names))
 
 @app.route('/api/role/<string:role_name>', methods=['GET'])
 @crossdomain(origin='*')
+@conditional('host', 'role_map')
+@coalesced
 def search_by_role(role_name):
-    role_maps = RoleMap.get_by_role_name(db.session.query, role_name)
-    host_names = [r.host_name for r in role_maps]
+    fields = fields_arg(request)
 
-    hosts = Host.get_in_host_names(db.session.query, host_names)
+    hosts = Host.select_page(db.session.execute, role_name=role_name,
+            columns=host_columns(fields))
     if len(hosts) == 0:
         abort(404)
 
-    result = []
-    for host in hosts:
-        d = {}
-        d['host_name'] = host.host_name
-        d['ip'] = host.ip
-        d['role'] = [r.role_name for r in host.role]
-        result.append(d)
-    return jsonify(result=result)
+    result = shape_hosts(hosts, fields)
+    return serialize(result=result)
 
 
 @app.route('/api/role', methods=['POST'])
@@ -193,10 +311,11 @@ def add_role():
     try:
         role = Role(role_name=role_name)
         db.session.add(role)
-        db.session.commit()
+        record_change('role', 'insert', role_name, dict(role=role_name))
+        commit_changes('role')
     except Exception as e:
         abort(500)
-    return jsonify(result=dict(message='OK', request='add role', payload=str(request.json)))
+    return serialize(result=dict(message='OK', request='add role', payload=str(request.json)))
 
 
 @app.route('/api/role/<string:role_name>', methods=['DELETE'])
@@ -206,10 +325,11 @@ def delete_role(role_name):
         role = Role.get_one(db.session.query, role_name)
         if role:
             db.session.delete(role)
-            db.session.commit()
+            record_change('role', 'delete', role_name)
+            commit_changes('role')
     except Exception as e:
         abort(500)
-    return jsonify(result=dict(message='OK', request='delete role', payload=str(request.json)))
+    return serialize(result=dict(message='OK', request='delete role', payload=str(request.json)))
 
 
 @app.route('/api/role/<string:old_role_name>', methods=['PUT'])
@@ -222,52 +342,60 @@ def update_role(old_role_name):
     try:
         role = Role.get_one(db.session.query, old_role_name)
         role.role_name = new_role_name
-        db.session.commit()
+        record_change('role', 'update', old_role_name, dict(role=new_role_name))
+        commit_changes('role', 'role_map')
     except Exception as e:
         abort(500)
-    return jsonify(result=[dict(message='OK', request='update role', payload=str(request.json))])
+    return serialize(result=[dict(message='OK', request='update role', payload=str(request.json))])
 
 # Host
+HOST_FIELDS = ['host_name', 'ip', 'role']
+
 @app.route('/api/list/host')
 @crossdomain(origin='*')
+@conditional('host', 'role_map')
 def list_host():
     fmt = request.args.get('format')
+    page = page_args(request, ['host_name', 'ip'])
 
-    hosts = Host.get_all(db.session.query)
-    result = [r.host_name for r in hosts]
-    return formatter(fmt, result)
+    rows = Host.select_page(db.session.execute, role_name=request.args.get('role'), **page)
+    result = [r.host_name for r in rows]
+    return paged(fmt, result, page, next_cursor(page, [r[page['sort']] for r in rows]))
 
 
 @app.route('/api/host/<string:host_name>')
 @crossdomain(origin='*')
+@conditional('host', 'role_map')
 def search_by_host(host_name):
-    host = Host.get_one_by_host_name(db.session.query, host_name)
+    host = Host.select_one_by_host_name(db.session.execute, host_name)
     if not host:
         abort(404)
 
-    role_maps = RoleMap.get_by_host_name(db.session.query, host.host_name)
-    role_names = [r.role_name for r in role_maps]
-
-    result = [dict(host_name=host.host_name, ip=host.ip, role=role_names)]
-    return jsonify(result=result)
+    host_name, ip, role_names = host
+    result = [dict(host_name=host_name, ip=ip, role=role_names)]
+    return serialize(result=result)
 
 
 # TODO: test
 @app.route('/api/host')
 @crossdomain(origin='*')
+@conditional('host', 'role_map')
+@coalesced
 def all_host():
-    hosts = Host.get_all(db.session.query)
-    if len(hosts) == 0:
+    page = page_args(request, ['host_name', 'ip'])
+    fields = fields_arg(request)
+
+    hosts = Host.select_page(db.session.execute, role_name=request.args.get('role'),
+            columns=host_columns(fields, page['sort']), **page)
+    if len(hosts) == 0 and page['after'] is None:
         abort(404)
 
-    result = []
-    for host in hosts:
-        d = {}
-        d['host_name'] = host.host_name
-        d['ip'] = host.ip
-        d['role'] = [r.role_name for r in host.role]
-        result.append(d)
-    return jsonify(result=result)
+    # roles of the matched hosts; the whole role map only when every host
+    # was asked for
+    filtered = page['limit'] is not None or page['after'] is not None \
+        or page['q'] or request.args.get('role') is not None
+    result = shape_hosts(hosts, fields, all_hosts=not filtered)
+    return paged(None, result, page, next_cursor(page, [r[page['sort']] for r in hosts]))
 
 
 @app.route('/api/host', methods=['POST'])
@@ -280,12 +408,16 @@ def add_host():
     if not is_valid_keys(req, ['host_name', 'ip', 'role']):
         abort(400)
     try:
-        register_new_host(req['host_name'], req['ip'], req['role'])
-        db.session.commit()
+        ipaddr = register_new_host(req['host_name'], req['ip'], unique_role_names(req['role']))
+        commit_changes('ip', 'host', 'role_map')
+    except PoolNotFound:
+        abort(404)
+    except PoolExhausted:
+        abort(409)
     except Exception as e:
         abort(500)
 
-    return jsonify(result=dict(message='OK', request='add host', payload=str(request.json)))
+    return serialize(result=dict(message='OK', request='add host', ip=ipaddr, payload=str(request.json)))
 
 
 @app.route('/api/host/<string:old_host_name>', methods=['PUT'])
@@ -299,29 +431,51 @@ def update_host(old_host_name):
         abort(400)
 
     try:
-        role_maps = RoleMap.get_by_host_name(db.session.query, old_host_name)
-        for r in role_maps:
-            rm = RoleMap.get_by_host_name_and_role_name(db.session.query, old_host_name, r.role_name)
-            db.session.delete(rm)
-            db.session.flush()
-
         host = Host.get_one_by_host_name(db.session.query, old_host_name)
-        host.host_name = req['host_name']
+        if not host:
+            raise Exception("host not found")
+        host_name = req['host_name']
         old_ip = host.ip
-        host.ip = req['ip']
-        host.role = [RoleMap(role_name=role_name) for role_name in req['role']]
-        db.session.add(host)
-
-        if req['ip'] != old_ip:
-            ip = IP.get_one(db.session.query, req['ip'])
-            ip.is_used = 1
-            ip = IP.get_one(db.session.query, old_ip)
-            ip.is_used = 0
+        ip_changed = req['ip'] != old_ip
+
+        # only the difference between current and requested roles is written
+        current = RoleMap.select_role_names_by_host_name(db.session.execute, old_host_name)
+        requested = unique_role_names(req['role'])
+        to_delete = [r for r in current if r not in requested]
+        to_add = [r for r in requested if r not in current]
+
+        if host_name != old_host_name or ip_changed or to_delete or to_add:
+            if ip_changed:
+                ip = IP.get_one(db.session.query, req['ip'])
+                if not ip or ip.is_used == 1:
+                    raise Exception("ip does not exist or used")
+                ip.is_used = 1
+                record_change('ip', 'update', req['ip'], dict(ip=req['ip'], is_used=1))
+                ip = IP.get_one(db.session.query, old_ip)
+                ip.is_used = 0
+                record_change('ip', 'update', old_ip, dict(ip=old_ip, is_used=0))
+
+            host.host_name = host_name
+            host.ip = req['ip']
+            host.updated_at = datetime.now()
+            # a rename reaches role_map through the foreign key cascade
+            db.session.flush()
 
-        db.session.commit()
+            RoleMap.delete_by_host_name_and_role_names(db.session.execute, host_name, to_delete)
+            RoleMap.insert_many(db.session.execute, [(host_name, r) for r in to_add])
+
+            role_names = [r for r in current if r in requested] + to_add
+            record_change('host', 'update', old_host_name,
+                    dict(host_name=host_name, ip=req['ip'], role=role_names))
+            tables = ['host']
+            if ip_changed:
+                tables.append('ip')
+            if host_name != old_host_name or to_delete or to_add:
+                tables.append('role_map')
+            commit_changes(*tables)
     except Exception as e:
         abort(500)
-    return jsonify(result=[dict(message='OK', request='update host', payload=str(request.json))])
+    return serialize(result=[dict(message='OK', request='update host', payload=str(request.json))])
 
 
 @app.route('/api/host/<string:host_name>', methods=['DELETE'])
@@ -333,20 +487,174 @@ def delete_host(host_name):
             db.session.delete(host)
             ip = IP.get_one(db.session.query, host.ip)
             ip.is_used = 0
-            db.session.commit()
+            record_change('host', 'delete', host_name)
+            record_change('ip', 'update', host.ip, dict(ip=host.ip, is_used=0))
+            commit_changes('ip', 'host', 'role_map')
     except Exception as e:
         abort(500)
-    return jsonify(result=dict(message='OK', request='delete host', payload=str(request.json)))
+    return serialize(result=dict(message='OK', request='delete host', payload=str(request.json)))
+
+@app.route('/api/host/bulk', methods=['POST'])
+@crossdomain(origin='*')
+def add_host_bulk():
+    hosts = bulk_host_request(request)
+    try:
+        result = register_new_hosts(hosts)
+        commit_changes('ip', 'host', 'role_map')
+    except Exception as e:
+        abort(500)
+    return serialize(result=result)
+
+
+def bulk_host_request(req):
+    # {"hosts": [{"host_name", "ip", "role"}, ...]} or a single entry whose
+    # host_name is a pattern like web[01-40] and whose ip is a list, a
+    # first-last range, a cidr or auto:<pool>
+    if not is_json_request(req) or not isinstance(req.json, dict):
+        abort(400)
+    specs = req.json['hosts'] if 'hosts' in req.json else [req.json]
+    if not isinstance(specs, list):
+        abort(400)
+
+    hosts = []
+    for spec in specs:
+        if not isinstance(spec, dict) or not is_valid_keys(spec, ['host_name', 'ip', 'role']):
+            abort(400)
+        if not isinstance(spec['host_name'], str) or not isinstance(spec['role'], list):
+            abort(400)
+        if not all(isinstance(r, str) for r in spec['role']):
+            abort(400)
+        # checked before expanding, web[1-99999999999] is a few bytes
+        if len(hosts) + count_host_names(spec['host_name']) > current_app.config['BULK_HOST_LIMIT']:
+            abort(400)
+        host_names = expand_host_names(spec['host_name'])
+        ipaddrs = expand_bulk_ip(spec['ip'], len(host_names))
+        role_names = unique_role_names(spec['role'])
+        for host_name, ipaddr in zip(host_names, ipaddrs):
+            hosts.append((host_name, ipaddr, role_names))
+
+    if len(hosts) == 0:
+        abort(400)
+    return hosts
+
+
+def expand_bulk_ip(ip, count):
+    if isinstance(ip, list):
+        ipaddrs = ip
+    elif not isinstance(ip, str):
+        abort(400)
+    elif ip.startswith(AUTO_IP_PREFIX):
+        return [ip] * count
+    elif is_valid_ip_range(ip):
+        first, last = [ip_to_int(i) for i in ip.split('-')]
+        ipaddrs = [int_to_ip(n) for n in range(first, min(last, first + count - 1) + 1)]
+    elif is_valid_cidr(ip):
+        if cidr_size(ip) > current_app.config['BULK_IP_LIMIT']:
+            abort(400)
+        ipaddrs = cidr_hosts(ip)
+    else:
+        ipaddrs = [ip]
+
+    if len(ipaddrs) < count:
+        abort(400)
+    for ipaddr in ipaddrs[:count]:
+        if not isinstance(ipaddr, str) or not is_valid_ip(ipaddr):
+            abort(400)
+    return ipaddrs[:count]
+
+
+def fields_arg(req):
+    try:
+        return parse_fields(req.args.get('fields'), HOST_FIELDS)
+    except ValueError:
+        abort(400)
+
+
+def host_columns(fields, sort='host_name'):
+    # the columns to select: the requested ones, the sort key the cursor is
+    # taken from and the host name roles are looked up by
+    return [c for c in ('host_name', 'ip')
+            if c in fields or c == sort or (c == 'host_name' and 'role' in fields)]
+
+
+def shape_hosts(hosts, fields, all_hosts=False):
+    # roles are only fetched when asked for
+    roles = {}
+    if 'role' in fields:
+        host_names = None if all_hosts else [r.host_name for r in hosts]
+        roles = RoleMap.select_role_names_by_host_names(db.session.execute, host_names)
+
+    result = []
+    for host in hosts:
+        d = {}
+        for f in fields:
+            d[f] = roles.get(host.host_name, []) if f == 'role' else host[f]
+        result.append(d)
+    return result
+
+
+def register_new_hosts(hosts):
+    # one lookup per table for the whole batch, then batched claims and inserts
+    host_names = [host_name for host_name, ipaddr, role_names in hosts]
+    ipaddrs = [ipaddr for host_name, ipaddr, role_names in hosts
+            if not ipaddr.startswith(AUTO_IP_PREFIX)]
+    all_role_names = list(set(r for host_name, ipaddr, role_names in hosts for r in role_names))
+
+    existing_hosts = set(Host.select_in_host_names(db.session.execute, host_names))
+    unused_ips = set(r.ip for r in IP.select_in_ips(db.session.execute, ipaddrs, for_update=True)
+            if r.is_used == 0)
+    existing_roles = set(Role.select_in_role_names(db.session.execute, all_role_names))
+
+    result = []
+    accepted = []
+    claim = []
+    for host_name, ipaddr, role_names in hosts:
+        d = dict(host_name=host_name, ip=ipaddr, message='OK')
+        result.append(d)
+        if host_name in existing_hosts:
+            d['message'] = 'host name exists'
+        elif any(r not in existing_roles for r in role_names):
+            d['message'] = 'role not found'
+        elif ipaddr.startswith(AUTO_IP_PREFIX):
+            try:
+                d['ip'] = allocator.allocate(ipaddr[len(AUTO_IP_PREFIX):])
+            except Exception as e:
+                d['message'] = str(e)
+        elif ipaddr not in unused_ips:
+            d['message'] = 'ip does not exist or used'
+        else:
+            unused_ips.discard(ipaddr)
+            claim.append(ipaddr)
+
+        if d['message'] == 'OK':
+            existing_hosts.add(host_name)
+            accepted.append((host_name, d['ip'], role_names))
+
+    if IP.claim_many(db.session.execute, claim) != len(claim):
+        raise Exception("ip claimed by another request")
+    Host.insert_many(db.session.execute, [(host_name, ipaddr) for host_name, ipaddr, role_names in accepted])
+    RoleMap.insert_many(db.session.execute,
+            [(host_name, r) for host_name, ipaddr, role_names in accepted for r in role_names])
+
+    for host_name, ipaddr, role_names in accepted:
+        record_change('ip', 'update', ipaddr, dict(ip=ipaddr, is_used=1))
+        record_change('host', 'insert', host_name,
+                dict(host_name=host_name, ip=ipaddr, role=role_names))
+    return result
 
 # TODO: refactor
 def register_new_host(host_name, ipaddr, role_names):
     try:
-        # is exist unused ip
-        ip = IP.get_one(db.session.query, ipaddr)
-        if not ip or ip.is_used == 1:
-            raise Exception("ip does not exist or used")
-        ip.is_used = 1
-        db.session.flush()
+        if ipaddr.startswith(AUTO_IP_PREFIX):
+            # next free ip of the pool, already claimed
+            ipaddr = allocator.allocate(ipaddr[len(AUTO_IP_PREFIX):])
+        else:
+            # is exist unused ip
+            ip = IP.get_one(db.session.query, ipaddr)
+            if not ip or ip.is_used == 1:
+                raise Exception("ip does not exist or used")
+            ip.is_used = 1
+            db.session.flush()
 
         # is exist role in db
         roles = Role.get_in_role_names(db.session.query, role_names)
@@ -357,65 +665,283 @@ def register_new_host(host_name, ipaddr, role_names):
         host = Host(host_name=host_name, ip=ipaddr)
         host.role = [RoleMap(role_name=role_name) for role_name in role_names]
         db.session.add(host)
+        record_change('ip', 'update', ipaddr, dict(ip=ipaddr, is_used=1))
+        record_change('host', 'insert', host_name,
+                dict(host_name=host_name, ip=ipaddr, role=role_names))
+        return ipaddr
     
     except Exception as e:
         raise e
 
+@app.route('/api/lookup', methods=['POST'])
+@crossdomain(origin='*')
+def lookup():
+    host_names, ipaddrs = lookup_request(request)
+
+    hosts = Host.select_in_host_names_or_ips(db.session.execute, host_names, ipaddrs)
+    by_host_name = dict((r.host_name, r) for r in hosts)
+    by_ip = dict((r.ip, r) for r in hosts)
+    roles = RoleMap.select_role_names_by_host_names(db.session.execute, list(by_host_name))
+
+    def resolve(key, found):
+        host = found.get(key)
+        if host is None:
+            return dict(key=key, message='Not found')
+        return dict(key=key, host_name=host.host_name, ip=host.ip,
+                role=roles.get(host.host_name, []))
+
+    result = dict(host_name=[resolve(host_name, by_host_name) for host_name in host_names],
+            ip=[resolve(ipaddr, by_ip) for ipaddr in ipaddrs])
+    return serialize(result=result)
+
+
+def lookup_request(req):
+    # {"host_name": [...], "ip": [...]}, either may be left out
+    if not is_json_request(req) or not isinstance(req.json, dict):
+        abort(400)
+    host_names = req.json.get('host_name', [])
+    ipaddrs = req.json.get('ip', [])
+    if not isinstance(host_names, list) or not isinstance(ipaddrs, list):
+        abort(400)
+    if not (host_names or ipaddrs):
+        abort(400)
+    if len(host_names) + len(ipaddrs) > current_app.config['LOOKUP_LIMIT']:
+        abort(400)
+    if not all(isinstance(host_name, str) for host_name in host_names):
+        abort(400)
+    if not all(isinstance(ipaddr, str) and is_valid_ip(ipaddr) for ipaddr in ipaddrs):
+        abort(400)
+    return host_names, ipaddrs
+
+# Pool
+@app.route('/api/pool', methods=['GET'])
+@crossdomain(origin='*')
+@conditional('pool')
+def all_pool():
+    pools = Pool.select_all(db.session.execute)
+    result = [dict(name=name, cidr=cidr) for name, cidr in pools]
+    return serialize(result=result)
+
+
+@app.route('/api/pool', methods=['POST'])
+@crossdomain(origin='*')
+def add_pool():
+    if not is_json_request(request) or not is_valid_keys(request.json, ['name', 'cidr']):
+        abort(400)
+    name = request.json['name']
+    cidr = request.json['cidr']
+
+    if not is_valid_cidr(cidr):
+        abort(400)
+    try:
+        pool = Pool(name=name, cidr=cidr)
+        db.session.add(pool)
+        record_change('pool', 'insert', name, dict(name=name, cidr=cidr))
+        commit_changes('pool')
+    except Exception as e:
+        abort(500)
+    return serialize(result=dict(message='OK', request='add pool', payload=str(request.json)))
+
+
+@app.route('/api/pool/<string:name>', methods=['DELETE'])
+@crossdomain(origin='*')
+def delete_pool(name):
+    try:
+        pool = Pool.get_one(db.session.query, name)
+        if pool:
+            db.session.delete(pool)
+            record_change('pool', 'delete', name)
+            commit_changes('pool')
+    except Exception as e:
+        abort(500)
+    return serialize(result=dict(message='OK', request='delete pool', payload=str(request.json)))
+
 # hosts
+@app.route('/api/hosts')
+@crossdomain(origin='*')
+@conditional('host', 'role_map')
+@coalesced
+def search_by_roles():
+    fmt = request.args.get('format')
+    role_names, match_all = roles_arg(request)
+    if not role_names:
+        abort(400)
+
+    hosts = Host.select_by_role_names(db.session.execute, role_names, match_all)
+    if fmt in ('csv', 'space'):
+        return formatter(fmt, [r.ip for r in hosts])
+    result = [dict(host_name=host_name, ip=ip) for host_name, ip in hosts]
+    return formatter(fmt, result)
+
+
+@app.route('/api/hosts_output')
+@crossdomain(origin='*')
+@conditional('host', 'role_map')
+@coalesced
+def output_all_hosts():
+    role_names, match_all = roles_arg(request)
+    if len(role_names) > 1:
+        hosts = Host.select_by_role_names(db.session.execute, role_names, match_all)
+        if len(hosts) == 0:
+            abort(404)
+        return formatter('hosts', hosts)
+    if role_names:
+        return output_hosts_artifact(role_names[0])
+    return output_hosts_artifact(ALL_HOSTS)
+
+
 @app.route('/api/hosts_output/<string:role_name>')
 @crossdomain(origin='*')
+@conditional('host', 'role_map')
+@coalesced
 def output_hosts(role_name):
-    role_maps = RoleMap.get_by_role_name(db.session.query, role_name)
-    host_names = [role_map.host_name for role_map in role_maps]
+    return output_hosts_artifact(role_name)
 
-    hosts = Host.get_in_host_names(db.session.query, host_names)
-    if len(hosts) == 0:
+
+def roles_arg(req):
+    try:
+        return parse_roles(req.args.getlist('role'), req.args.get('match', 'all'))
+    except ValueError:
+        abort(400)
+
+
+def output_hosts_artifact(role_name):
+    host_names, body = hosts_artifacts.get(role_name, g.revisions)
+    if len(host_names) == 0:
         abort(404)
+    return Response(body)
+
+# Changes
+@app.route('/api/changes')
+@crossdomain(origin='*')
+@conditional(CHANGELOG, CHANGELOG_FLOOR)
+def list_changes():
+    since = request.args.get('since', '0')
+    if not since.isdigit():
+        abort(400)
+    since = int(since)
 
-    result = [dict(host_name=host.host_name, ip=host.ip) for host in hosts]
-    return formatter('hosts', result)
+    # the floor is in the etag, a 304 is never sent for a compacted range
+    if since < g.revisions[CHANGELOG_FLOOR]:
+        # entries after since are gone, start over from a full listing
+        abort(410)
+
+    rows = ChangeLog.select_since(db.session.execute, since, current_app.config['CHANGES_LIMIT'])
+    result = [changelog_entry(r) for r in rows]
+    return serialize(result=result, next=rows[-1].id if rows else since)
+
+@app.route('/api/watch')
+@crossdomain(origin='*')
+def watch():
+    # long-poll, or server-sent events when asked for text/event-stream
+    since = request.headers.get('Last-Event-ID', request.args.get('since'))
+    if since is not None:
+        if not since.isdigit():
+            abort(400)
+        since = int(since)
+    role_name = request.args.get('role')
+    timeout = request.args.get('timeout', str(current_app.config['WATCH_TIMEOUT']))
+    if not timeout.isdigit():
+        abort(400)
+    timeout = min(int(timeout), current_app.config['WATCH_TIMEOUT'])
+
+    watch_hub.start()
+    # waiting needs no connection, hand it back to the pool
+    db.session.remove()
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        events = watch_events(since, role_name, max(timeout, 1))
+        return Response(stream_with_context(events), mimetype='text/event-stream')
+
+    waited = wait_changes(since, role_name, timeout)
+    if waited is None:
+        abort(410)
+    result, next_since = waited
+    return serialize(result=result, next=next_since)
+
+
+def wait_changes(since, role_name, timeout):
+    waited = watch_hub.wait(since, role_name, timeout)
+    if waited is None:
+        waited = catch_up(since, role_name)
+    return waited
+
+
+def watch_events(since, role_name, timeout):
+    # an event per change for timeout seconds. the stream then ends, giving
+    # the worker back before it is killed for taking too long; the last id
+    # line makes the client reconnect with Last-Event-ID where it stopped
+    deadline = time.monotonic() + timeout
+    while True:
+        waited = wait_changes(since, role_name, max(deadline - time.monotonic(), 0))
+        if waited is None:
+            yield 'event: gone\ndata: {}\n\n'
+            return
+        result, since = waited
+        for entry in result:
+            yield 'id: %d\ndata: %s\n\n' % (entry['rev'], json.dumps(entry))
+        if time.monotonic() >= deadline:
+            yield 'retry: 1000\nid: %d\n\n' % since
+            return
+
+# Stats
+@app.route('/api/stats')
+@crossdomain(origin='*')
+def stats():
+    pool = db.engine.pool
+    db_pool = pool.stats() if hasattr(pool, 'stats') else None
+    return serialize(result=dict(cache=model_cache.stats(), pool=allocator.stats(), db=db_pool,
+            replica=replica_set.stats(), compression=compressed_cache.stats(),
+            coalesced=single_flight.stats()))
 
 # Common
 @app.errorhandler(405)
 @crossdomain(origin='*')
 def method_not_allowed(e):
-    return jsonify(message='Method not allowed'), 405
+    return serialize(message='Method not allowed'), 405
 
 @app.errorhandler(404)
 @crossdomain(origin='*')
 def not_found(e):
-    return jsonify(message='Not found'), 404
+    return serialize(message='Not found'), 404
+
+@app.errorhandler(410)
+@crossdomain(origin='*')
+def gone(e):
+    return serialize(message='Gone'), 410
 
 @app.errorhandler(400)
 @crossdomain(origin='*')
 def bad_request(e):
-    return jsonify(message='Check the format you requested'), 400
+    return serialize(message='Check the format you requested'), 400
+
+@app.errorhandler(409)
+@crossdomain(origin='*')
+def conflict(e):
+    return serialize(message='No free address left in the pool'), 409
 
 @app.errorhandler(500)
 @crossdomain(origin='*')
 def internal_server_error(e):
-    return jsonify(message='Could not complete your request. may be duprecated.'), 500
-
-def formatter(fmt, rs):
-    if fmt == 'csv':
-        ret = ''
-        for r in rs:
-            ret = "%s%s," % (ret, r)
-        ret = ret[:len(ret)-1]
-        return ret
-    elif fmt == 'space':
-        ret = ''
-        for r in rs:
-            ret = "%s%s " % (ret, r)
-        ret = ret[:len(ret)-1]
-        return ret
-    elif fmt == 'hosts':
-        ret = ''
-        for r in rs:
-            ret = "%s%s\t%s\n" % (ret, r['ip'], r['host_name'])
-        return ret
-    else:
-        return jsonify(result=rs)
+    return serialize(message='Could not complete your request. may be duprecated.'), 500
+
+def page_args(req, sorts):
+    try:
+        return parse_page(req.args, sorts, current_app.config['PAGE_LIMIT_MAX'])
+    except ValueError:
+        abort(400)
+
+def paged(fmt, result, page, cursor):
+    # without a limit the response is the same as before paging existed;
+    # the cursor goes in the envelope, or in a header for text formats
+    if page['limit'] is None:
+        return formatter(fmt, result)
+    if fmt in formatters:
+        response = formatter(fmt, result)
+        if cursor is not None:
+            response.headers['X-Next-Cursor'] = cursor
+        return response
+    return serialize(result=result, next=cursor)
 
 def is_json_request(req):
     try:
@@ -424,6 +950,22 @@ def is_json_request(req):
     except:
         return False
 
+def commit_changes(*tables):
+    changes = pop_changes()
+    # bump in a fixed order so concurrent writers lock revision rows alike.
+    # holding the changelog row until commit makes change log ids commit in
+    # order, so a reader past id N never misses a later commit below N
+    if changes:
+        tables = tables + (CHANGELOG,)
+    revisions = {}
+    for table in sorted(tables):
+        revisions[table] = Revision.bump(db.session.execute, table)
+    ChangeLog.insert_many(db.session.execute, changes)
+    # the changelog row is held, so the highest id is the last one of ours
+    g.last_change_id = ChangeLog.select_last_id(db.session.execute) if changes else None
+    db.session.commit()
+    notify(changes, revisions)
+
 def check_registerable_ip(ipaddr):
     try:
         ip = IP.get_one(db.session.query, ipaddr)
@@ -0,0 +1,111 @@
+from threading import Lock
+
+from srvadm import db
+from srvadm.models import Host, Revision
+from srvadm.pool import read_bind
+from srvadm.formatter import hosts_formatter
+from srvadm.changes import on_commit
+
+# revisions an artifact depends on
+TABLES = ('host', 'role_map')
+
+# key of the artifact listing every host
+ALL_HOSTS = None
+
+class HostsArtifacts(object):
+
+    def __init__(self):
+        self.revisions = None
+        self.artifacts = {}
+        self.lock = Lock()
+
+    def clear(self):
+        with self.lock:
+            self.artifacts.clear()
+            self.revisions = None
+
+    def get(self, role_name, revisions):
+        if read_bind() is not None:
+            # replicas lag the primary and each other; keyed on theirs the
+            # artifacts would be dropped at every switch, so they follow the
+            # primary only
+            revisions = primary_revisions()
+        with self.lock:
+            if self.revisions != revisions:
+                # written by another process, nothing stored is trustworthy
+                self.artifacts.clear()
+                self.revisions = revisions
+            artifact = self.artifacts.get(role_name)
+        if artifact is None:
+            artifact = self.store(role_name, revisions)
+        return artifact
+
+    def store(self, role_name, revisions):
+        artifact = render(role_name)
+        host_names, body = artifact
+        with self.lock:
+            # empty ones answer 404; keeping them would let requests for
+            # made-up roles grow the dict
+            if self.revisions == revisions and host_names:
+                self.artifacts[role_name] = artifact
+        return artifact
+
+    def update(self, changes, revisions):
+        with self.lock:
+            if self.revisions is None:
+                return
+
+            # the stored artifacts stay valid only if this write is the
+            # sole one since they were rendered
+            current = dict(self.revisions)
+            for t in TABLES:
+                if t not in revisions:
+                    continue
+                if current[t] != revisions[t] - 1:
+                    self.artifacts.clear()
+                    self.revisions = None
+                    return
+                current[t] = revisions[t]
+
+            touched = self.touched_roles(changes)
+            for role_name in touched:
+                self.artifacts.pop(role_name, None)
+            self.revisions = current
+
+        for role_name in touched:
+            self.store(role_name, current)
+
+    def touched_roles(self, changes):
+        touched = set()
+        for c in changes:
+            if c.table == 'host':
+                touched.add(ALL_HOSTS)
+                for role_name, (host_names, body) in self.artifacts.items():
+                    if c.key in host_names:
+                        touched.add(role_name)
+                if c.data:
+                    touched.update(c.data['role'])
+            elif c.table == 'role':
+                touched.add(c.key)
+                if c.data:
+                    touched.add(c.data['role'])
+        return touched
+
+def primary_revisions():
+    revisions = Revision.select_revisions(db.primary_execute, TABLES)
+    return dict((t, revisions.get(t, (0, None))[0]) for t in TABLES)
+
+def render(role_name):
+    if role_name is ALL_HOSTS:
+        hosts = Host.select_all(db.primary_execute)
+    else:
+        hosts = Host.select_by_role_name(db.primary_execute, role_name)
+    host_names = frozenset(h.host_name for h in hosts)
+    body = ''.join(hosts_formatter(hosts)).encode('utf-8')
+    return host_names, body
+
+hosts_artifacts = HostsArtifacts()
+
+@on_commit
+def update_hosts_artifacts(changes, revisions):
+    hosts_artifacts.update(changes, revisions)
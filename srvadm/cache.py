@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from functools import update_wrapper
+from threading import Lock
+import time
+
+from flask import g, has_app_context
+
+from srvadm import app
+from srvadm.pool import read_bind
+
+_missing = object()
+
+class LRUCache(object):
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key, _missing)
+            if entry is _missing:
+                self.misses += 1
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return dict(size=len(self.entries), maxsize=self.maxsize, ttl=self.ttl,
+                hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+model_cache = LRUCache(app.config.get('MODEL_CACHE_SIZE', 0),
+        app.config.get('MODEL_CACHE_TTL', 30))
+
+def revisions(execute, namespaces):
+    # the revisions the request already read in @conditional, or the current
+    # ones. revisions are bumped by every worker's writes, so an entry is
+    # never served after a write anywhere
+    current = getattr(g, 'revisions', None) if has_app_context() else None
+    if current is None or any(n not in current for n in namespaces):
+        from srvadm.models import Revision
+        current = dict((n, rev) for n, (rev, updated_at)
+                in Revision.select_revisions(execute, namespaces).items())
+    return tuple(current.get(n, 0) for n in namespaces)
+
+def cached(*namespaces):
+    def decorator(f):
+        def wrapped_function(cls, execute, *args, **kwargs):
+            if not model_cache.maxsize:
+                return f(cls, execute, *args, **kwargs)
+
+            # replica reads may lag, so they never fill the primary's entries
+            key = (cls.__name__, f.__name__, revisions(execute, namespaces),
+                    read_bind(), args, tuple(sorted(kwargs.items())))
+            value = model_cache.get(key, _missing)
+            if value is _missing:
+                value = f(cls, execute, *args, **kwargs)
+                model_cache.set(key, value)
+            return value
+
+        return update_wrapper(wrapped_function, f)
+    return decorator
@@ -0,0 +1,45 @@
+from collections import namedtuple
+import json
+
+from flask import g
+
+from srvadm import app
+
+# a committed write: table name, 'insert'/'update'/'delete', the row key
+# before the write and the row after it (None when deleted)
+Change = namedtuple('Change', ['table', 'op', 'key', 'data'])
+
+# revision row held by writers while they log, and the highest change log
+# id removed by compaction
+CHANGELOG = 'changelog'
+CHANGELOG_FLOOR = 'changelog_floor'
+
+listeners = []
+
+def on_commit(f):
+    listeners.append(f)
+    return f
+
+def record_change(table, op, key, data=None):
+    if not hasattr(g, 'changes'):
+        g.changes = []
+    g.changes.append(Change(table, op, key, data))
+
+def pop_changes():
+    changes = getattr(g, 'changes', [])
+    g.changes = []
+    return changes
+
+def notify(changes, revisions):
+    # the write is already committed; a failing listener must not turn it
+    # into an error response
+    for f in listeners:
+        try:
+            f(changes, revisions)
+        except Exception:
+            app.logger.exception('commit listener %s failed', f.__name__)
+
+def changelog_entry(row):
+    # a change log row as served by /api/changes and /api/watch
+    return dict(rev=row.id, table=row.table_name, op=row.op, key=row.row_key,
+            data=None if row.data is None else json.loads(row.data))
@@ -0,0 +1,165 @@
+from collections import OrderedDict
+import hashlib
+import zlib
+
+from flask import request
+
+from srvadm import app
+from srvadm.cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# fast settings; listings are compressed on every change
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+# encoding -> factory of a compressor with compress(data) and flush(), in
+# order of preference
+compressors = OrderedDict()
+
+def register_compressor(encoding):
+    def decorator(f):
+        compressors[encoding] = f
+        return f
+    return decorator
+
+if zstandard is not None:
+    @register_compressor('zstd')
+    def zstd_compressor():
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+if brotli is not None:
+    class BrotliCompressor(object):
+
+        def __init__(self):
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+        def compress(self, data):
+            return self.compressor.process(data)
+
+        def flush(self):
+            return self.compressor.finish()
+
+    register_compressor('br')(BrotliCompressor)
+
+@register_compressor('gzip')
+def gzip_compressor():
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def negotiate_encoding(accept):
+    # the encoding the client rates highest, ours preferred on a tie; None
+    # for the body as it is
+    best, best_quality = None, 0
+    for encoding in compressors:
+        quality = accept[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress(body, encoding):
+    compressor = compressors[encoding]()
+    return compressor.compress(body) + compressor.flush()
+
+def compress_stream(chunks, encoding, done=None):
+    # done gets the whole compressed body, only once the stream ran to its end
+    compressor = compressors[encoding]()
+    parts = []
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            if data:
+                if done is not None:
+                    parts.append(data)
+                yield data
+        data = compressor.flush()
+        if done is not None:
+            parts.append(data)
+            done(b''.join(parts))
+        yield data
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def encoded_etag(etag, encoding):
+    # the tag of the compressed body, host.3-role_map.2-gzip; a cache holding
+    # one form never takes it for the other
+    return '%s-%s' % (etag, encoding)
+
+def etag_variants(etag):
+    # the tag of the body as it is and of each compressed form of it
+    return [etag] + [encoded_etag(etag, encoding) for encoding in compressors]
+
+compressed_cache = LRUCache(app.config.get('COMPRESS_CACHE_SIZE', 0),
+        app.config.get('COMPRESS_CACHE_TTL', 300))
+
+def compressed(body, encoding, etag):
+    # a body tagged with revisions is served unchanged until the next write,
+    # so each one is compressed once per encoding
+    if etag is None or not compressed_cache.maxsize:
+        return compress(body, encoding)
+    key = (etag, encoding, hashlib.sha1(body).digest())
+    data = compressed_cache.get(key)
+    if data is None:
+        data = compress(body, encoding)
+        compressed_cache.set(key, data)
+    return data
+
+@app.after_request
+def compress_response(resp):
+    if request.method not in ('GET', 'HEAD') or resp.status_code not in (200, 304):
+        return resp
+    if 'Content-Encoding' in resp.headers or resp.mimetype == 'text/event-stream':
+        return resp
+
+    resp.vary.add('Accept-Encoding')
+    etag, weak = resp.get_etag()
+    if resp.status_code == 304:
+        # repeat the form of the tag the client holds
+        for tag in etag_variants(etag) if etag else []:
+            if tag in request.if_none_match:
+                resp.set_etag(tag, weak)
+                break
+        return resp
+    if request.method == 'HEAD':
+        # no body to compress or keep
+        return resp
+
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return resp
+    if resp.is_streamed:
+        # the size is unknown up front, chunks are compressed as they go. a
+        # tagged stream is kept once it ran to its end, and later requests
+        # for it under the same revisions get the kept body
+        key = (etag, encoding, request.full_path)
+        data = compressed_cache.get(key) if etag is not None and compressed_cache.maxsize else None
+        if data is not None:
+            if hasattr(resp.response, 'close'):
+                resp.response.close()
+            resp.set_data(data)
+        else:
+            done = None
+            if etag is not None and compressed_cache.maxsize:
+                done = lambda data: compressed_cache.set(key, data)
+            resp.response = compress_stream(resp.response, encoding, done)
+            resp.headers.pop('Content-Length', None)
+    else:
+        body = resp.get_data()
+        if len(body) < app.config['COMPRESS_MIN_SIZE']:
+            return resp
+        resp.set_data(compressed(body, encoding, etag))
+    if etag is not None:
+        resp.set_etag(encoded_etag(etag, encoding), weak)
+    resp.headers['Content-Encoding'] = encoding
+    return resp
@@ -1,9 +1,16 @@
 from flask import (
-    request, make_response, current_app
+    request, make_response, current_app, g
 )
 
 from functools import update_wrapper
-from datetime import timedelta
+from datetime import timedelta, datetime
+
+from srvadm import db
+from srvadm.models import Revision
+from srvadm.pool import read_bind
+from srvadm.singleflight import single_flight
+from srvadm.compression import etag_variants
+from srvadm.serializer import etag_suffix
 
 def crossdomain(origin=None, methods=None, headers=None,
                 max_age=0, attach_to_all=True,
@@ -45,3 +52,69 @@ def crossdomain(origin=None, methods=None, headers=None,
         f.provide_automatic_options = False
         return update_wrapper(wrapped_function, f)
     return decorator
+
+def conditional(*tables):
+    def decorator(f):
+        def wrapped_function(*args, **kwargs):
+            revisions = Revision.select_revisions(db.session.execute, tables)
+            g.revisions = dict((t, revisions.get(t, (0, None))[0]) for t in tables)
+            etag = '-'.join('%s.%d' % (t, g.revisions[t]) for t in tables) + \
+                    etag_suffix(request.accept_mimetypes)
+            modified = [updated_at for rev, updated_at in revisions.values()]
+            last_modified = max(modified) if modified else None
+
+            if is_not_modified(etag, last_modified):
+                resp = current_app.response_class(status=304)
+            else:
+                resp = make_response(f(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+
+            # the tag depends on the encoding negotiated from Accept
+            resp.vary.add('Accept')
+            resp.set_etag(etag)
+            if last_modified is not None:
+                resp.last_modified = last_modified
+            return resp
+
+        return update_wrapper(wrapped_function, f)
+    return decorator
+
+def is_not_modified(etag, last_modified):
+    # werkzeug's ETags is truthy even when empty, the header tells
+    if 'If-None-Match' in request.headers:
+        # the tag of any encoding of the body
+        return any(tag in request.if_none_match for tag in etag_variants(etag))
+    if request.if_modified_since and last_modified is not None:
+        return not in_current_second(last_modified) and \
+                last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def in_current_second(last_modified):
+    # http dates have whole seconds: a write later in the same second would
+    # carry the same date, so the date is only trusted once the second is over
+    return last_modified.replace(microsecond=0) >= datetime.utcnow().replace(microsecond=0)
+
+def coalesced(f):
+    # identical concurrent requests share one rendering. goes under
+    # @conditional: the key carries the revisions the request read, so it
+    # never joins a rendering older than a write it has seen
+    def wrapped_function(*args, **kwargs):
+        key = (request.path, tuple(sorted(request.args.items(multi=True))),
+                request.headers.get('Accept'), request.is_xhr, read_bind(),
+                tuple(sorted(g.revisions.items())))
+
+        # callables making the response, as each caller needs one of its own.
+        # the body is only read into memory when another request joined
+        def render():
+            resp = make_response(f(*args, **kwargs))
+            return lambda: resp
+
+        def share(make):
+            resp = make()
+            data, status, headers = resp.get_data(), resp.status_code, list(resp.headers.items())
+            return lambda: current_app.response_class(data, status=status, headers=headers)
+
+        return single_flight.do(key, render, share)()
+
+    return update_wrapper(wrapped_function, f)
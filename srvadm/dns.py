@@ -0,0 +1,214 @@
+import socketserver
+import struct
+import threading
+import time
+
+from srvadm import app, db
+from srvadm.models import Host, RoleMap, Revision
+
+# revisions the index is built from
+TABLES = ('host', 'role_map')
+
+TYPE_A = 1
+TYPE_PTR = 12
+TYPE_OPT = 41
+TYPE_ANY = 255
+CLASS_IN = 1
+
+RCODE_NXDOMAIN = 3
+RCODE_NOTIMP = 4
+
+FLAG_QR = 0x8000
+FLAG_AA = 0x0400
+FLAG_TC = 0x0200
+FLAG_RD = 0x0100
+OPCODE_MASK = 0x7800
+
+# pointer to the name of the question, which starts right after the header
+QUESTION_NAME = 0xC00C
+
+# plain udp answers fit in 512 bytes, larger only when the client asks
+# through edns; capped where a datagram stops fragmenting on most paths
+UDP_SIZE = 512
+EDNS_SIZE = 1232
+
+REVERSE_SUFFIX = '.in-addr.arpa'
+ROLE_SUFFIX = '.role'
+
+class DNSIndex(object):
+    # answers from in-memory maps, swapped as a whole on reload so lookups
+    # never wait for the database
+
+    def __init__(self, domain):
+        self.domain = domain.strip('.').lower()
+        self.revisions = None
+        # host name -> ip, reverse name -> host name, role name -> [ip, ...]
+        self.records = ({}, {}, {})
+
+    def build(self, hosts, roles):
+        names = {}
+        pointers = {}
+        role_ips = {}
+        for host_name, ip in hosts:
+            if not ip:
+                continue
+            names[host_name.lower()] = ip
+            reverse = '.'.join(reversed(ip.split('.'))) + REVERSE_SUFFIX
+            pointers[reverse] = self.absolute(host_name)
+            for role_name in roles.get(host_name, []):
+                role_ips.setdefault(role_name.lower(), []).append(ip)
+        self.records = (names, pointers, role_ips)
+
+    def load(self, revisions):
+        hosts = Host.select_all(db.session.execute)
+        roles = RoleMap.select_role_names_by_host_names(db.session.execute)
+        self.build(hosts, roles)
+        self.revisions = revisions
+
+    def refresh(self):
+        try:
+            revisions = Revision.select_revisions(db.session.execute, TABLES)
+            revisions = dict((t, revisions.get(t, (0, None))[0]) for t in TABLES)
+            if revisions != self.revisions:
+                self.load(revisions)
+        finally:
+            # a new transaction per poll, or the snapshot never moves
+            db.session.remove()
+
+    def absolute(self, name):
+        return '%s.%s' % (name, self.domain) if self.domain else name
+
+    def relative(self, name):
+        name = name.rstrip('.').lower()
+        suffix = '.' + self.domain
+        if self.domain and name.endswith(suffix):
+            return name[:-len(suffix)]
+        return name
+
+    def resolve(self, name, qtype):
+        # (rcode, [(type, rdata), ...])
+        names, pointers, role_ips = self.records
+        name = name.rstrip('.').lower()
+        if name.endswith(REVERSE_SUFFIX):
+            target = pointers.get(name)
+            if target is None:
+                return RCODE_NXDOMAIN, []
+            if qtype not in (TYPE_PTR, TYPE_ANY):
+                return 0, []
+            return 0, [(TYPE_PTR, encode_name(target))]
+
+        name = self.relative(name)
+        if name.endswith(ROLE_SUFFIX):
+            ips = role_ips.get(name[:-len(ROLE_SUFFIX)])
+        else:
+            ip = names.get(name)
+            ips = [ip] if ip else None
+        if not ips:
+            return RCODE_NXDOMAIN, []
+        if qtype not in (TYPE_A, TYPE_ANY):
+            return 0, []
+        return 0, [(TYPE_A, encode_ip(ip)) for ip in ips]
+
+def encode_name(name):
+    labels = [l.encode('utf-8') for l in name.split('.') if l]
+    return b''.join(struct.pack('!B', len(l)) + l for l in labels) + b'\0'
+
+def encode_ip(ip):
+    return bytes(int(octet) for octet in ip.split('.'))
+
+def parse_query(data):
+    # (id, flags, name, qtype, question bytes, edns payload size or None)
+    # of a single-question query
+    ident, flags, qdcount, ancount, nscount, arcount = struct.unpack('!HHHHHH', data[:12])
+    if qdcount != 1:
+        raise ValueError('expected one question')
+    offset = 12
+    labels = []
+    while data[offset] != 0:
+        length = data[offset]
+        if length & 0xC0:
+            raise ValueError('compressed question name')
+        labels.append(data[offset + 1:offset + 1 + length].decode('utf-8'))
+        offset += 1 + length
+    qtype, qclass = struct.unpack('!HH', data[offset + 1:offset + 5])
+    end = offset + 5
+    payload = None
+    # an opt record, root name first, carries the client's buffer size in its class
+    if arcount and not ancount and not nscount and data[end:end + 1] == b'\0':
+        rtype, rclass = struct.unpack('!HH', data[end + 1:end + 5])
+        if rtype == TYPE_OPT:
+            payload = rclass
+    return ident, flags, '.'.join(labels), qtype, data[12:end], payload
+
+def build_response(ident, flags, question, rcode, answers, ttl, payload=None):
+    flags = FLAG_QR | FLAG_AA | (flags & (OPCODE_MASK | FLAG_RD)) | rcode
+    opt = b''
+    size = UDP_SIZE
+    if payload is not None:
+        opt = b'\0' + struct.pack('!HHIH', TYPE_OPT, EDNS_SIZE, 0, 0)
+        size = min(max(payload, UDP_SIZE), EDNS_SIZE)
+
+    # whole records only, the client retries over tcp or lives with a subset
+    room = size - 12 - len(question) - len(opt)
+    records = []
+    for rtype, rdata in answers:
+        record = struct.pack('!HHHIH', QUESTION_NAME, rtype, CLASS_IN, ttl, len(rdata)) + rdata
+        if len(record) > room:
+            flags |= FLAG_TC
+            break
+        records.append(record)
+        room -= len(record)
+
+    header = struct.pack('!HHHHHH', ident, flags, 1, len(records), 0, 1 if opt else 0)
+    return header + question + b''.join(records) + opt
+
+def handle_query(index, data, ttl):
+    # the response datagram, or None for anything not worth answering
+    try:
+        ident, flags, name, qtype, question, payload = parse_query(data)
+    except (IndexError, ValueError, struct.error):
+        return None
+    if flags & FLAG_QR:
+        return None
+    if flags & OPCODE_MASK:
+        return build_response(ident, flags, question, RCODE_NOTIMP, [], ttl, payload)
+    rcode, answers = index.resolve(name, qtype)
+    return build_response(ident, flags, question, rcode, answers, ttl, payload)
+
+class DNSHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        data, sock = self.request
+        response = handle_query(self.server.index, data, self.server.ttl)
+        if response is not None:
+            sock.sendto(response, self.client_address)
+
+class DNSServer(socketserver.UDPServer):
+    allow_reuse_address = True
+
+    def __init__(self, address, index, ttl):
+        socketserver.UDPServer.__init__(self, address, DNSHandler)
+        self.index = index
+        self.ttl = ttl
+
+def refresh_forever(index, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                index.refresh()
+            except Exception:
+                app.logger.exception('dns index refresh failed')
+
+def serve(host, port):
+    index = DNSIndex(app.config['DNS_DOMAIN'])
+    with app.app_context():
+        index.refresh()
+
+    refresher = threading.Thread(target=refresh_forever,
+            args=(index, app.config['DNS_REFRESH_INTERVAL']))
+    refresher.daemon = True
+    refresher.start()
+
+    server = DNSServer((host, port), index, app.config['DNS_TTL'])
+    server.serve_forever()
@@ -0,0 +1,51 @@
+from flask import Response, stream_with_context
+
+from srvadm.serializer import serialize
+
+# number of rows joined into one chunk of a streamed response
+CHUNK_ROWS = 1000
+
+formatters = {}
+
+def register_formatter(name):
+    def decorator(f):
+        formatters[name] = f
+        return f
+    return decorator
+
+def formatter(fmt, rs):
+    f = formatters.get(fmt)
+    if f is None:
+        return serialize(result=list(rs))
+    return Response(stream_with_context(chunked(f(rs))))
+
+def chunked(lines, size=CHUNK_ROWS):
+    buf = []
+    for line in lines:
+        buf.append(line)
+        if len(buf) >= size:
+            yield ''.join(buf)
+            buf = []
+    if buf:
+        yield ''.join(buf)
+
+def joined(rs, sep):
+    it = iter(rs)
+    for r in it:
+        yield '%s' % (r,)
+        break
+    for r in it:
+        yield '%s%s' % (sep, r)
+
+@register_formatter('csv')
+def csv_formatter(rs):
+    return joined(rs, ',')
+
+@register_formatter('space')
+def space_formatter(rs):
+    return joined(rs, ' ')
+
+@register_formatter('hosts')
+def hosts_formatter(rs):
+    for r in rs:
+        yield '%s\t%s\n' % (r['ip'], r['host_name'])
@@ -1,14 +1,48 @@
-from sqlalchemy import Column, Index, ForeignKey
-from sqlalchemy.orm import relation, backref
+from sqlalchemy import Column, Index, ForeignKey, select, bindparam, func, distinct, text
+from sqlalchemy.orm import relation, backref, validates
 from sqlalchemy.dialects.mysql import (
     INTEGER,
     TINYINT,
     VARCHAR,
     DATETIME,
+    TEXT,
 )
 from datetime import datetime
+import json
+from itertools import groupby
 
 from srvadm import db
+from srvadm.cache import cached
+from srvadm.validator import ip_to_int, cidr_range
+
+# rows per multi-row statement or IN list
+BATCH_SIZE = 1000
+
+# column defaults. sqlalchemy passes the execution context to builtins it
+# cannot inspect, which datetime.now takes for a tzinfo
+def _now():
+    return datetime.now()
+
+def _utcnow():
+    return datetime.utcnow()
+
+def chunks(seq, size=BATCH_SIZE):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+def keyset(stmt, column, after=None, limit=None, desc=False):
+    # rows strictly past the cursor in index order, so a page costs the
+    # same wherever it is in the table
+    if after is not None:
+        stmt = stmt.where(column < after if desc else column > after)
+    stmt = stmt.order_by(column.desc() if desc else column)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+def startswith(column, prefix):
+    escaped = prefix.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+    return column.like(escaped + '%', escape='!')
 
 class Role(db.Model):
     __tablename__ = 'role'
@@ -33,6 +67,28 @@ class Role(db.Model):
     def get_in_role_names(cls, query, role_names):
         return query(cls).filter(cls.role_name.in_(role_names)).all()
 
+    @classmethod
+    def select_in_role_names(cls, execute, role_names):
+        t = cls.__table__
+        result = []
+        for chunk in chunks(role_names):
+            stmt = select([t.c.role_name]).where(t.c.role_name.in_(chunk))
+            result.extend(r[0] for r in execute(stmt))
+        return result
+
+    @classmethod
+    def page_stmt(cls, after=None, limit=None, desc=False, q=None):
+        t = cls.__table__
+        stmt = select([t.c.role_name])
+        if q:
+            stmt = stmt.where(startswith(t.c.role_name, q))
+        return keyset(stmt, t.c.role_name, after, limit, desc)
+
+    @classmethod
+    @cached('role')
+    def select_page(cls, execute, **kwargs):
+        return [r[0] for r in execute(cls.page_stmt(**kwargs))]
+
 
 class IP(db.Model):
     __tablename__ = 'ip'
@@ -47,6 +103,14 @@ class IP(db.Model):
     is_used = Column('is_used', TINYINT(unsigned=True),
         server_default='0',
         nullable=False)
+    # numeric form of ip for ordering and range scans
+    ip_num = Column('ip_num', INTEGER(unsigned=True),
+        nullable=True)
+
+    @validates('ip')
+    def validate_ip(self, key, ipaddr):
+        self.ip_num = ip_to_int(ipaddr)
+        return ipaddr
 
     @classmethod
     def get_all(cls, query):
@@ -62,7 +126,92 @@ class IP(db.Model):
 
     @classmethod
     def get_one(cls, query, ipaddr):
-        return query(cls).filter(cls.ip == ipaddr).first()
+        # served from the session identity map when already loaded
+        return query(cls).get(ipaddr)
+
+    @classmethod
+    def select_in_ips(cls, execute, ipaddrs, for_update=False):
+        t = cls.__table__
+        rows = []
+        for chunk in chunks(ipaddrs):
+            stmt = select([t.c.ip, t.c.is_used]).where(t.c.ip.in_(chunk))
+            if for_update:
+                stmt = stmt.with_for_update()
+            rows.extend(execute(stmt).fetchall())
+        return rows
+
+    @classmethod
+    def insert_many(cls, execute, ipaddrs):
+        t = cls.__table__
+        for chunk in chunks(ipaddrs):
+            execute(t.insert().values([dict(ip=ip, ip_num=ip_to_int(ip)) for ip in chunk]))
+
+    @classmethod
+    def delete_unused_in_ips(cls, execute, ipaddrs):
+        t = cls.__table__
+        for chunk in chunks(ipaddrs):
+            execute(t.delete().where(t.c.ip.in_(chunk)).where(t.c.is_used == 0))
+
+    @classmethod
+    def page_stmt(cls, after=None, limit=None, desc=False, q=None, is_used=None, cidr=None):
+        t = cls.__table__
+        stmt = select([t.c.ip, t.c.is_used])
+        if q:
+            stmt = stmt.where(startswith(t.c.ip, q))
+        if is_used is not None:
+            stmt = stmt.where(t.c.is_used == is_used)
+        if cidr is not None:
+            stmt = stmt.where(t.c.ip_num.between(*cidr_range(cidr)))
+        if after is not None:
+            after = ip_to_int(after)
+        return keyset(stmt, t.c.ip_num, after, limit, desc)
+
+    @classmethod
+    def select_page(cls, execute, **kwargs):
+        return execute(cls.page_stmt(**kwargs)).fetchall()
+
+    @classmethod
+    def select_in_range(cls, execute, first, last):
+        t = cls.__table__
+        stmt = select([t.c.ip, t.c.is_used])\
+            .where(t.c.ip_num.between(ip_to_int(first), ip_to_int(last)))\
+            .order_by(t.c.ip_num)
+        return execute(stmt).fetchall()
+
+    @classmethod
+    def select_in_subnet(cls, execute, cidr):
+        t = cls.__table__
+        stmt = select([t.c.ip, t.c.is_used])\
+            .where(t.c.ip_num.between(*cidr_range(cidr)))\
+            .order_by(t.c.ip_num)
+        return execute(stmt).fetchall()
+
+    @classmethod
+    def claim(cls, execute, ipaddr):
+        # mark an unused ip as used; false when someone else got it first
+        t = cls.__table__
+        stmt = t.update().where(t.c.ip == ipaddr).where(t.c.is_used == 0).values(is_used=1)
+        return execute(stmt).rowcount == 1
+
+    @classmethod
+    def claim_many(cls, execute, ipaddrs):
+        t = cls.__table__
+        claimed = 0
+        for chunk in chunks(ipaddrs):
+            stmt = t.update().where(t.c.ip.in_(chunk)).where(t.c.is_used == 0).values(is_used=1)
+            claimed += execute(stmt).rowcount
+        return claimed
+
+    @classmethod
+    def backfill_ip_num(cls, execute):
+        t = cls.__table__
+        stmt = select([t.c.ip]).where(t.c.ip_num == None).limit(BATCH_SIZE)
+        ipaddrs = [r[0] for r in execute(stmt)]
+        if ipaddrs:
+            update = t.update().where(t.c.ip == bindparam('b_ip'))\
+                .values(ip_num=bindparam('b_ip_num'))
+            execute(update, [dict(b_ip=ip, b_ip_num=ip_to_int(ip)) for ip in ipaddrs])
+        return len(ipaddrs)
 
 
 class Host(db.Model):
@@ -81,12 +230,14 @@ class Host(db.Model):
     ip = Column('ip', VARCHAR(length=64),
         ForeignKey('ip.ip', onupdate='cascade'))
     created_at = Column('created_at', DATETIME,
-        default=datetime.now(),
+        default=_now,
         nullable=False)
     updated_at = Column('updated_at', DATETIME,
-        default=datetime.now(),
+        default=_now,
+        onupdate=_now,
         nullable=False)
-    role = relation('RoleMap', backref='host', cascade='all, delete', uselist=True)
+    role = relation('RoleMap', backref='host', cascade='all, delete', uselist=True,
+        order_by='RoleMap.id')
 
     @classmethod
     def get_all(cls, query):
@@ -104,7 +255,148 @@ class Host(db.Model):
     def get_in_host_names(cls, query, host_names):
         return query(cls).filter(cls.host_name.in_(host_names)).all()
 
+    @classmethod
+    def all_stmt(cls):
+        t = cls.__table__
+        return select([t.c.host_name, t.c.ip]).order_by(t.c.host_name)
+
+    @classmethod
+    def select_all(cls, execute):
+        return execute(cls.all_stmt()).fetchall()
+
+    @classmethod
+    def select_in_host_names(cls, execute, host_names):
+        t = cls.__table__
+        result = []
+        for chunk in chunks(host_names):
+            stmt = select([t.c.host_name]).where(t.c.host_name.in_(chunk))
+            result.extend(r[0] for r in execute(stmt))
+        return result
+
+    @classmethod
+    def insert_many(cls, execute, hosts):
+        t = cls.__table__
+        now = datetime.now()
+        for chunk in chunks(hosts):
+            rows = [dict(host_name=host_name, ip=ip, created_at=now, updated_at=now)
+                    for host_name, ip in chunk]
+            execute(t.insert().values(rows))
+
+    @classmethod
+    def select_in_host_names_or_ips(cls, execute, host_names, ips):
+        # rows of (host_name, ip) matching either list
+        t = cls.__table__
+        stmt = select([t.c.host_name, t.c.ip])
+        rows = []
+        for chunk in chunks(host_names):
+            rows.extend(execute(stmt.where(t.c.host_name.in_(chunk))).fetchall())
+        for chunk in chunks(ips):
+            rows.extend(execute(stmt.where(t.c.ip.in_(chunk))).fetchall())
+        return rows
+
+    @classmethod
+    def by_role_name_stmt(cls, role_name):
+        h = cls.__table__
+        rm = RoleMap.__table__
+        return select([h.c.host_name, h.c.ip])\
+            .select_from(h.join(rm, rm.c.host_name == h.c.host_name))\
+            .where(rm.c.role_name == role_name)\
+            .order_by(h.c.host_name)
+
+    @classmethod
+    def select_by_role_name(cls, execute, role_name):
+        return execute(cls.by_role_name_stmt(role_name)).fetchall()
+
+    @classmethod
+    def by_role_names_stmt(cls, role_names, match_all=True):
+        # hosts having every one (or any) of the roles, grouped in role_map
+        h = cls.__table__
+        rm = RoleMap.__table__
+        members = select([rm.c.host_name])\
+            .where(rm.c.role_name.in_(role_names))\
+            .group_by(rm.c.host_name)
+        if match_all:
+            members = members.having(func.count(distinct(rm.c.role_name)) == len(set(role_names)))
+        members = members.alias('members')
+        return select([h.c.host_name, h.c.ip])\
+            .select_from(h.join(members, members.c.host_name == h.c.host_name))\
+            .order_by(h.c.host_name)
+
+    @classmethod
+    def select_by_role_names(cls, execute, role_names, match_all=True):
+        return execute(cls.by_role_names_stmt(role_names, match_all)).fetchall()
+
+    @classmethod
+    def page_stmt(cls, sort='host_name', after=None, limit=None, desc=False,
+            q=None, role_name=None, columns=('host_name', 'ip')):
+        # rows of the given host columns ordered by host_name or by numeric ip
+        h = cls.__table__
+        from_ = h
+        if sort == 'ip':
+            ip = IP.__table__
+            from_ = from_.join(ip, ip.c.ip == h.c.ip)
+            column = ip.c.ip_num
+            if after is not None:
+                after = ip_to_int(after)
+        else:
+            column = h.c.host_name
+        if role_name is not None:
+            rm = RoleMap.__table__
+            from_ = from_.join(rm, rm.c.host_name == h.c.host_name)
+
+        stmt = select([h.c[c] for c in columns]).select_from(from_)
+        if role_name is not None:
+            stmt = stmt.where(rm.c.role_name == role_name)
+        if q:
+            stmt = stmt.where(startswith(h.c.host_name, q))
+        return keyset(stmt, column, after, limit, desc)
+
+    @classmethod
+    def select_page(cls, execute, **kwargs):
+        return execute(cls.page_stmt(**kwargs)).fetchall()
+
+    @classmethod
+    def with_roles_stmt(cls, host_names=None, ips=None):
+        # one row per (host, role) ordered by host
+        h = cls.__table__
+        rm = RoleMap.__table__
+        stmt = select([h.c.host_name, h.c.ip, rm.c.role_name])\
+            .select_from(h.outerjoin(rm, rm.c.host_name == h.c.host_name))\
+            .order_by(h.c.host_name, rm.c.id)
+        if host_names is not None:
+            stmt = stmt.where(h.c.host_name.in_(host_names))
+        if ips is not None:
+            stmt = stmt.where(h.c.ip.in_(ips))
+        return stmt
+
+    @classmethod
+    def fold_roles(cls, rows):
+        # rows of with_roles_stmt as (host_name, ip, [role_name, ...]) tuples
+        result = []
+        for (host_name, ip), group in groupby(rows, lambda r: (r[0], r[1])):
+            role_names = [r[2] for r in group if r[2] is not None]
+            result.append((host_name, ip, role_names))
+        return result
+
+    @classmethod
+    def select_with_roles(cls, execute, host_names=None, ips=None):
+        return cls.fold_roles(execute(cls.with_roles_stmt(host_names, ips)))
+
+    @classmethod
+    @cached('host', 'role_map')
+    def select_one_by_host_name(cls, execute, host_name):
+        hosts = cls.select_with_roles(execute, host_names=[host_name])
+        return hosts[0] if hosts else None
+
+    @classmethod
+    @cached('host', 'role_map')
+    def select_one_by_ip(cls, execute, ip):
+        hosts = cls.select_with_roles(execute, ips=[ip])
+        return hosts[0] if hosts else None
+
 Index('idx_hostName', Host.host_name)
+Index('idx_ipNum', IP.ip_num, unique=True)
+Index('idx_isUsed_ipNum', IP.is_used, IP.ip_num)
 
 class RoleMap(db.Model):
     __tablename__ = 'role_map'
@@ -139,3 +431,186 @@ class RoleMap(db.Model):
     def get_by_host_name_and_role_name(cls, query, host_name, role_name):
         return query(cls).filter(cls.host_name == host_name).filter(cls.role_name == role_name).first()
 
+    @classmethod
+    def select_role_names_by_host_name(cls, execute, host_name):
+        t = cls.__table__
+        stmt = select([t.c.role_name]).where(t.c.host_name == host_name).order_by(t.c.id)
+        return [r[0] for r in execute(stmt)]
+
+    @classmethod
+    def role_names_by_host_names_stmts(cls, host_names=None):
+        t = cls.__table__
+        stmt = select([t.c.host_name, t.c.role_name]).order_by(t.c.id)
+        if host_names is None:
+            return [stmt]
+        return [stmt.where(t.c.host_name.in_(chunk)) for chunk in chunks(host_names)]
+
+    @classmethod
+    def fold_role_names(cls, rows, result=None):
+        result = {} if result is None else result
+        for host_name, role_name in rows:
+            result.setdefault(host_name, []).append(role_name)
+        return result
+
+    @classmethod
+    def select_role_names_by_host_names(cls, execute, host_names=None):
+        # {host_name: [role_name, ...]} for the given hosts, or for all of them
+        result = {}
+        for stmt in cls.role_names_by_host_names_stmts(host_names):
+            cls.fold_role_names(execute(stmt), result)
+        return result
+
+    @classmethod
+    def delete_by_host_name_and_role_names(cls, execute, host_name, role_names):
+        t = cls.__table__
+        if role_names:
+            execute(t.delete().where(t.c.host_name == host_name).where(t.c.role_name.in_(role_names)))
+
+    @classmethod
+    def insert_many(cls, execute, role_maps):
+        t = cls.__table__
+        for chunk in chunks(role_maps):
+            rows = [dict(host_name=host_name, role_name=role_name)
+                    for host_name, role_name in chunk]
+            execute(t.insert().values(rows))
+
+Index('idx_roleName_hostName', RoleMap.role_name, RoleMap.host_name)
+
+class Pool(db.Model):
+    __tablename__ = 'pool'
+    __table_args__ = {
+        'mysql_engine':'InnoDB',
+        'mysql_charset':'utf8',
+    }
+
+    name = Column('name', VARCHAR(length=64),
+        primary_key=True,
+        autoincrement=False)
+    cidr = Column('cidr', VARCHAR(length=64),
+        nullable=False)
+
+    @classmethod
+    def get_one(cls, query, name):
+        return query(cls).get(name)
+
+    @classmethod
+    def all_stmt(cls):
+        t = cls.__table__
+        return select([t.c.name, t.c.cidr]).order_by(t.c.name)
+
+    @classmethod
+    def select_all(cls, execute):
+        return execute(cls.all_stmt()).fetchall()
+
+
+class Revision(db.Model):
+    __tablename__ = 'revision'
+    __table_args__ = {
+        'mysql_engine':'InnoDB',
+        'mysql_charset':'utf8',
+    }
+
+    name = Column('name', VARCHAR(length=64),
+        primary_key=True,
+        autoincrement=False)
+    rev = Column('rev', INTEGER(unsigned=True),
+        server_default='0',
+        nullable=False)
+    updated_at = Column('updated_at', DATETIME,
+        default=_utcnow,
+        nullable=False)
+
+    @classmethod
+    def revisions_stmt(cls, names):
+        t = cls.__table__
+        return select([t.c.name, t.c.rev, t.c.updated_at]).where(t.c.name.in_(names))
+
+    @classmethod
+    def select_all(cls, execute):
+        t = cls.__table__
+        stmt = select([t.c.name, t.c.rev, t.c.updated_at])
+        return dict((r.name, (r.rev, r.updated_at)) for r in execute(stmt))
+
+    @classmethod
+    def select_revisions(cls, execute, names):
+        return dict((r.name, (r.rev, r.updated_at)) for r in execute(cls.revisions_stmt(names)))
+
+    @classmethod
+    def bump(cls, execute, name):
+        # one statement, so workers bumping a new name at once don't race
+        # to insert it
+        t = cls.__table__
+        execute(text('insert into revision (name, rev, updated_at) values (:name, 1, :now) '
+                'on duplicate key update rev = rev + 1, updated_at = values(updated_at)'),
+                dict(name=name, now=datetime.utcnow()))
+        # the row stays locked until commit, so this is our own increment
+        return execute(select([t.c.rev]).where(t.c.name == name)).scalar()
+
+    @classmethod
+    def store(cls, execute, name, rev):
+        execute(text('insert into revision (name, rev, updated_at) values (:name, :rev, :now) '
+                'on duplicate key update rev = values(rev), updated_at = values(updated_at)'),
+                dict(name=name, rev=rev, now=datetime.utcnow()))
+
+
+class ChangeLog(db.Model):
+    # every committed change, numbered in commit order
+    __tablename__ = 'changelog'
+    __table_args__ = {
+        'mysql_engine':'InnoDB',
+        'mysql_charset':'utf8',
+    }
+
+    id = Column('id', INTEGER(unsigned=True),
+        primary_key=True,
+        autoincrement=True)
+    table_name = Column('table_name', VARCHAR(length=64),
+        nullable=False)
+    op = Column('op', VARCHAR(length=8),
+        nullable=False)
+    row_key = Column('row_key', VARCHAR(length=64),
+        nullable=False)
+    data = Column('data', TEXT,
+        nullable=True)
+    created_at = Column('created_at', DATETIME,
+        default=_now,
+        nullable=False)
+
+    @classmethod
+    def insert_many(cls, execute, changes):
+        t = cls.__table__
+        now = datetime.now()
+        for chunk in chunks(changes):
+            rows = [dict(table_name=c.table, op=c.op, row_key=c.key, created_at=now,
+                    data=None if c.data is None else json.dumps(c.data))
+                    for c in chunk]
+            execute(t.insert().values(rows))
+
+    @classmethod
+    def select_since(cls, execute, since, limit):
+        t = cls.__table__
+        stmt = select([t.c.id, t.c.table_name, t.c.op, t.c.row_key, t.c.data])\
+            .where(t.c.id > since)\
+            .order_by(t.c.id)\
+            .limit(limit)
+        return execute(stmt).fetchall()
+
+    @classmethod
+    def select_last_id(cls, execute):
+        t = cls.__table__
+        return execute(select([func.max(t.c.id)])).scalar() or 0
+
+    @classmethod
+    def delete_before(cls, execute, created_at):
+        # one batch of the oldest entries; the last id deleted, or None
+        t = cls.__table__
+        stmt = select([t.c.id]).where(t.c.created_at < created_at)\
+            .order_by(t.c.id)\
+            .limit(BATCH_SIZE)
+        ids = [r[0] for r in execute(stmt)]
+        if not ids:
+            return None
+        execute(t.delete().where(t.c.id.in_(ids)))
+        return ids[-1]
+
+Index('idx_createdAt', ChangeLog.created_at)
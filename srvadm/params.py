@@ -0,0 +1,73 @@
+from srvadm.validator import is_valid_ip, is_valid_cidr
+
+# query string parsing shared by the flask and the asyncio views; a bad
+# value raises ValueError, which the views answer with 400
+
+def parse_page(args, sorts, limit_max):
+    # ?limit=&after=&q=&sort=[-]key for the listing endpoints; sorts names the
+    # keys a listing can be ordered by, the first one being the default, and
+    # is only passed on to the model when there is a choice
+    limit = args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or not 0 < int(limit) <= limit_max:
+            raise ValueError('limit')
+        limit = int(limit)
+
+    sort = args.get('sort', sorts[0])
+    desc = sort.startswith('-')
+    if desc:
+        sort = sort[1:]
+    if sort not in sorts:
+        raise ValueError('sort')
+
+    after = args.get('after')
+    if after is not None and sort == 'ip' and not is_valid_ip(after):
+        raise ValueError('after')
+
+    page = dict(after=after, limit=limit, desc=desc, q=args.get('q'))
+    if len(sorts) > 1:
+        page['sort'] = sort
+    return page
+
+def next_cursor(page, keys):
+    # a short page is the last one
+    if page['limit'] is not None and len(keys) == page['limit']:
+        return keys[-1]
+    return None
+
+def parse_is_used(is_used):
+    if is_used is None:
+        return None
+    if is_used not in ('0', '1'):
+        raise ValueError('is_used')
+    return int(is_used)
+
+def parse_cidr(cidr):
+    if cidr is not None and not is_valid_cidr(cidr):
+        raise ValueError('cidr')
+    return cidr
+
+def parse_fields(fields, allowed):
+    # ?fields=host_name,ip limits the keys of each host, all of them by default
+    if fields is None:
+        return allowed
+    fields = fields.split(',')
+    if any(f not in allowed for f in fields):
+        raise ValueError('fields')
+    return fields
+
+def unique_role_names(values):
+    # each role once, in the order given; role_map has one row per host and
+    # role
+    role_names = []
+    for role_name in values:
+        if role_name not in role_names:
+            role_names.append(role_name)
+    return role_names
+
+def parse_roles(values, match):
+    # ?role=web&role=app&match=all|any
+    role_names = unique_role_names(values)
+    if match not in ('all', 'any'):
+        raise ValueError('match')
+    return role_names, match == 'all'
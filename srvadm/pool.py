@@ -0,0 +1,109 @@
+from functools import partial
+from threading import Lock
+import time
+
+from flask import g, has_app_context
+from flask.ext.sqlalchemy import SQLAlchemy, _SignallingSession
+from sqlalchemy import create_engine, event, exc, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import UpdateBase
+
+class TimedQueuePool(QueuePool):
+    # QueuePool keeping account of how long checkouts take, opening new
+    # connections included, and of how many stale connections were replaced
+
+    # test each connection on checkout, set from SQLALCHEMY_POOL_PRE_PING
+    pre_ping = True
+
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.stats_lock = Lock()
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.stale = 0
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return QueuePool._do_get(self)
+        finally:
+            waited = time.monotonic() - start
+            with self.stats_lock:
+                self.waits += 1
+                self.wait_time += waited
+                self.max_wait = max(self.max_wait, waited)
+
+    def stats(self):
+        return dict(size=self.size(), checked_in=self.checkedin(),
+                checked_out=self.checkedout(), overflow=max(self.overflow(), 0),
+                waits=self.waits, wait_time=round(self.wait_time, 6),
+                max_wait=round(self.max_wait, 6), stale=self.stale)
+
+@event.listens_for(TimedQueuePool, 'checkout')
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    # a connection the server has closed (wait_timeout, restart) is thrown
+    # away here and the pool hands out a fresh one instead of the request
+    # failing on it. _pool is private to sqlalchemy, which requirements.txt
+    # pins to 0.9.0 for it
+    pool = connection_proxy._pool
+    if not pool.pre_ping:
+        return
+    try:
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+    except Exception:
+        with pool.stats_lock:
+            pool.stale += 1
+        raise exc.DisconnectionError()
+
+def read_bind():
+    # the replica engine reads of the current request are routed to, if any
+    if not has_app_context():
+        return None
+    return getattr(g, 'read_bind', None)
+
+class RoutingSession(_SignallingSession):
+    # reads go to the replica chosen for the request; flushes and insert,
+    # update and delete statements always go to the primary. flask-sqlalchemy
+    # has no public session class to extend, so this relies on its private
+    # _SignallingSession and create_scoped_session as of the 1.0 pinned in
+    # requirements.txt; recheck both on upgrading
+
+    def get_bind(self, mapper=None, clause=None):
+        bind = read_bind()
+        if bind is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return bind
+        return _SignallingSession.get_bind(self, mapper, clause)
+
+class PooledSQLAlchemy(SQLAlchemy):
+
+    def create_scoped_session(self, options=None):
+        options = dict(options or {})
+        scopefunc = options.pop('scopefunc', None)
+        return orm.scoped_session(partial(RoutingSession, self, **options), scopefunc=scopefunc)
+
+    def primary_execute(self, clause, params=None, **kwargs):
+        # session.execute on the primary, for reads that must not follow
+        # the replica the request was routed to
+        return self.session.execute(clause, params, bind=self.engine, **kwargs)
+
+    def create_replica_engine(self, app, uri):
+        # pooled like the primary
+        info = make_url(uri)
+        options = {'convert_unicode': True}
+        self.apply_pool_defaults(app, options)
+        self.apply_driver_hacks(app, info, options)
+        return create_engine(info, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        if info.drivername.startswith('sqlite'):
+            # sqlite gets no queue pool, whose settings create_engine rejects
+            for key in ('pool_size', 'pool_timeout', 'max_overflow'):
+                options.pop(key, None)
+        else:
+            TimedQueuePool.pre_ping = app.config.get('SQLALCHEMY_POOL_PRE_PING', True)
+            options.setdefault('poolclass', TimedQueuePool)
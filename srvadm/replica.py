@@ -0,0 +1,166 @@
+from datetime import datetime
+from threading import Lock, Thread
+import time
+
+from flask import g, request, abort, after_this_request, has_request_context
+from sqlalchemy.engine.url import make_url
+
+from srvadm import app, db
+from srvadm.models import Revision
+from srvadm.changes import on_commit
+
+# set on the responses of writes; reads carrying it go to the primary
+PRIMARY_COOKIE = 'srvadm_primary'
+
+def replication_lag(primary, replica, now):
+    # seconds the replica is at least behind: the age of the newest write
+    # of each table it has not applied yet
+    lag = 0.0
+    for name, (rev, updated_at) in primary.items():
+        if replica.get(name, (0, None))[0] < rev:
+            lag = max(lag, (now - updated_at).total_seconds())
+    return lag
+
+class Replica(object):
+
+    def __init__(self, uri, engine):
+        url = make_url(uri)
+        self.name = '%s/%s' % (url.host or url.drivername, url.database)
+        self.engine = engine
+        # None until checked and while unreachable
+        self.lag = None
+        self.reads = 0
+
+    def stats(self):
+        return dict(name=self.name, lag=self.lag, reads=self.reads)
+
+class ReplicaSet(object):
+    # replicas of SQLALCHEMY_REPLICA_URIS, checked against the revisions of
+    # the primary every REPLICA_CHECK_INTERVAL seconds by a thread of each
+    # process; requests only read the last result
+
+    def __init__(self):
+        self.uris = []
+        self.replicas = []
+        self.checked_at = None
+        self.next = 0
+        self.fallbacks = 0
+        self.lock = Lock()
+        self.thread = None
+
+    def clear(self):
+        with self.lock:
+            self.dispose()
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+        self.uris = []
+        self.replicas = []
+        self.checked_at = None
+        self.fallbacks = 0
+
+    def configure(self):
+        uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+        with self.lock:
+            if uris != self.uris:
+                self.dispose()
+                self.uris = list(uris)
+                self.replicas = [Replica(uri, db.create_replica_engine(app, uri)) for uri in uris]
+            return bool(self.replicas)
+
+    def start(self):
+        if not self.configure():
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with app.app_context():
+                try:
+                    self.check(db.engine)
+                except Exception:
+                    app.logger.exception('primary revisions check failed')
+            time.sleep(app.config['REPLICA_CHECK_INTERVAL'])
+
+    def check(self, primary):
+        primary = Revision.select_all(primary.execute)
+        now = datetime.utcnow()
+        for replica in self.replicas:
+            try:
+                replica.lag = replication_lag(primary,
+                        Revision.select_all(replica.engine.execute), now)
+            except Exception:
+                app.logger.exception('replica %s check failed', replica.name)
+                replica.lag = None
+        self.checked_at = time.monotonic()
+
+    def choose(self, max_lag):
+        # a replica within max_lag seconds, round robin, or None to read from
+        # the primary. a replica may have fallen further behind since the last
+        # check, so its age counts too and a stuck checker sends reads back
+        # to the primary
+        with self.lock:
+            if self.checked_at is None:
+                healthy = []
+            else:
+                age = time.monotonic() - self.checked_at
+                healthy = [r for r in self.replicas if r.lag is not None and r.lag + age <= max_lag]
+            if not healthy:
+                self.fallbacks += 1
+                return None
+            self.next += 1
+            replica = healthy[self.next % len(healthy)]
+            replica.reads += 1
+        return replica
+
+    def stats(self):
+        with self.lock:
+            return dict(replicas=[r.stats() for r in self.replicas], fallbacks=self.fallbacks)
+
+replica_set = ReplicaSet()
+
+@app.before_first_request
+def start_replica_checks():
+    # in each worker after the fork, engines and the thread are not shared
+    replica_set.start()
+
+@app.before_request
+def route_reads():
+    # ?read_from= or X-Read-From: primary|replica overrides the choice;
+    # otherwise GET requests go to a replica unless the client wrote lately
+    g.read_bind = None
+    if request.method not in ('GET', 'HEAD') or not replica_set.replicas:
+        return
+    read_from = request.headers.get('X-Read-From', request.args.get('read_from'))
+    if read_from not in (None, 'primary', 'replica'):
+        abort(400)
+    if read_from == 'primary':
+        return
+    if read_from is None and request.cookies.get(PRIMARY_COOKIE):
+        return
+    replica = replica_set.choose(app.config['REPLICA_MAX_LAG'])
+    if replica is not None:
+        g.read_bind = replica.engine
+
+@app.after_request
+def report_read_source(resp):
+    if request.method in ('GET', 'HEAD') and replica_set.replicas:
+        resp.headers['X-Read-From'] = 'primary' if getattr(g, 'read_bind', None) is None else 'replica'
+    return resp
+
+@on_commit
+def read_own_writes(changes, revisions):
+    # the writer reads from the primary until replicas had time to catch up
+    if not replica_set.replicas or not has_request_context():
+        return
+
+    @after_this_request
+    def set_primary_cookie(resp):
+        resp.set_cookie(PRIMARY_COOKIE, '1', max_age=app.config['REPLICA_READ_YOUR_WRITES'])
+        return resp
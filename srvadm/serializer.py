@@ -0,0 +1,96 @@
+import json
+from datetime import datetime, timezone
+
+from flask import request, current_app
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+JSON_MIMETYPE = 'application/json'
+
+# mimetype -> encoder of the binary encodings installed
+encoders = {}
+
+def register_encoder(*mimetypes):
+    def decorator(f):
+        for mimetype in mimetypes:
+            encoders[mimetype] = f
+        return f
+    return decorator
+
+def default(o):
+    # what flask's encoder makes of the types json has no notion of
+    if isinstance(o, datetime):
+        return http_date(o)
+    raise TypeError('%r is not JSON serializable' % (o,))
+
+def dumps_json(obj, pretty=False):
+    # keys sorted as jsonify sorts them; indented only when pretty
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option)
+    if pretty:
+        return json.dumps(obj, indent=2, sort_keys=True, default=default).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), sort_keys=True, default=default).encode('utf-8')
+
+if msgpack is not None:
+    @register_encoder('application/msgpack', 'application/x-msgpack')
+    def msgpack_encoder(obj):
+        return msgpack.packb(obj, use_bin_type=True, default=default)
+
+if cbor2 is not None:
+    @register_encoder('application/cbor')
+    def cbor_encoder(obj):
+        return cbor2.dumps(obj, timezone=timezone.utc)
+
+def negotiate(accept):
+    # a binary encoding only when the client names it and rates it no lower
+    # than json; everyone else, */* included, keeps getting json
+    qualities = dict(accept)
+    best, best_quality = None, accept[JSON_MIMETYPE]
+    for mimetype in encoders:
+        quality = qualities.get(mimetype, 0)
+        if quality and (quality > best_quality or (best is None and quality == best_quality)):
+            best, best_quality = mimetype, quality
+    return best
+
+def etag_suffix(accept):
+    # the binary encoding negotiated, so its etag is never taken for the
+    # json one's: host.3-msgpack; json tags are left as they were
+    mimetype = negotiate(accept)
+    if mimetype is None:
+        return ''
+    subtype = mimetype.partition('/')[2]
+    if subtype.startswith('x-'):
+        subtype = subtype[len('x-'):]
+    return '-' + subtype
+
+def encode(obj, accept, pretty=False):
+    # (body, mimetype)
+    mimetype = negotiate(accept)
+    if mimetype is None:
+        return dumps_json(obj, pretty), JSON_MIMETYPE
+    return encoders[mimetype](obj), mimetype
+
+def serialize(*args, **kwargs):
+    # jsonify in the encoding the client accepts, compact unless debugging
+    pretty = current_app.debug and not request.is_xhr
+    body, mimetype = encode(dict(*args, **kwargs), request.accept_mimetypes, pretty)
+    resp = current_app.response_class(body, mimetype=mimetype)
+    resp.vary.add('Accept')
+    return resp
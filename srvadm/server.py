@@ -0,0 +1,48 @@
+from gunicorn.app.base import BaseApplication
+
+from srvadm import app, db
+
+class Server(BaseApplication):
+    # gunicorn with the options given here instead of a command line
+
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        BaseApplication.__init__(self)
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+def post_fork(server, worker):
+    # connections opened while preloading belong to the master and must not
+    # be shared by the workers; each worker opens its own
+    db.engine.dispose()
+
+def is_async_worker(worker_class):
+    # /api/watch parks each watcher up to WATCH_TIMEOUT seconds; on a gevent
+    # worker that is a greenlet, on any other a thread or a whole worker,
+    # and a handful of idle watchers would stall the api
+    return worker_class.startswith('gevent')
+
+def serve(bind, workers, threads, worker_class, timeout):
+    if not is_async_worker(worker_class):
+        raise ValueError('worker class %s would be held by watchers, use gevent' % worker_class)
+    app.debug = False
+    options = dict(
+        bind=bind,
+        workers=workers,
+        threads=threads,
+        worker_class=worker_class,
+        timeout=timeout,
+        graceful_timeout=app.config['SERVER_GRACEFUL_TIMEOUT'],
+        keepalive=app.config['SERVER_KEEPALIVE'],
+        # gevent patches threading after the fork; locks made by a preloaded
+        # app would be the unpatched ones
+        preload_app=False,
+        post_fork=post_fork,
+    )
+    Server(app, options).run()
@@ -0,0 +1,73 @@
+from threading import Event, Lock
+
+from werkzeug.exceptions import HTTPException
+
+class Flight(object):
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+class SingleFlight(object):
+    # runs one computation per key at a time; callers arriving while it runs
+    # wait for it and get its result instead of computing it again
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def do(self, key, f, share=None):
+        # share turns the result into one every caller can use; it is only
+        # called when another caller joined, the leader alone keeps f's own
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.leaders += 1
+            else:
+                flight.followers += 1
+                self.coalesced += 1
+
+        if leader:
+            try:
+                result = f()
+                with self.lock:
+                    # nobody joins once it is out of flights
+                    del self.flights[key]
+                if flight.followers and share is not None:
+                    result = share(result)
+                flight.result = result
+            except BaseException as e:
+                # the process may be going down, followers still get told
+                flight.error = e
+                raise
+            finally:
+                with self.lock:
+                    if self.flights.get(key) is flight:
+                        del self.flights[key]
+                flight.done.set()
+            return result
+
+        flight.done.wait()
+        if isinstance(flight.error, HTTPException):
+            # abort(404) and the like are answers too
+            raise flight.error
+        if flight.error is not None:
+            # the leader broke, try on our own rather than fail with it
+            with self.lock:
+                self.failed += 1
+            return f()
+        return flight.result
+
+    def stats(self):
+        with self.lock:
+            return dict(leaders=self.leaders, coalesced=self.coalesced,
+                    failed=self.failed, in_flight=len(self.flights))
+
+single_flight = SingleFlight()
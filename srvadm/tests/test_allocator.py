@@ -0,0 +1,69 @@
+import sys, os
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../../'))
+
+from srvadm.allocator import PoolBitmap, Allocator
+from srvadm.changes import Change
+from srvadm.validator import ip_to_int, int_to_ip, cidr_range
+import unittest
+
+class TestPoolBitmap(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = PoolBitmap('192.168.1.0/24', *cidr_range('192.168.1.0/24'))
+        for ipaddr in ['192.168.1.20', '192.168.1.9', '192.168.1.100']:
+            self.pool.set_free(ip_to_int(ipaddr), True)
+
+    def allocate(self):
+        ip_num = self.pool.next_free()
+        if ip_num is None:
+            return None
+        self.pool.set_free(ip_num, False)
+        return int_to_ip(ip_num)
+
+    def test_next_free_in_order(self):
+        actual = [self.allocate() for i in range(4)]
+        self.assertListEqual(['192.168.1.9', '192.168.1.20', '192.168.1.100', None], actual)
+        self.assertEqual(0, self.pool.free)
+
+    def test_release_moves_cursor_back(self):
+        self.allocate()
+        self.allocate()
+        self.pool.set_free(ip_to_int('192.168.1.9'), True)
+        self.assertEqual('192.168.1.9', self.allocate())
+
+    def test_out_of_range(self):
+        self.pool.set_free(ip_to_int('192.168.2.1'), True)
+        self.assertEqual(3, self.pool.free)
+
+    def test_set_free_twice(self):
+        self.pool.set_free(ip_to_int('192.168.1.9'), True)
+        self.assertEqual(3, self.pool.free)
+
+class TestAllocatorUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.allocator = Allocator()
+        pool = PoolBitmap('192.168.1.0/24', *cidr_range('192.168.1.0/24'))
+        pool.set_free(ip_to_int('192.168.1.9'), True)
+        self.allocator.pools = dict(rack1=pool)
+        self.allocator.revisions = dict(ip=3, pool=1)
+        self.allocator.last_id = 10
+        self.allocator.changelog_rev = 5
+        self.changes = [Change('ip', 'update', '192.168.1.9', dict(ip='192.168.1.9', is_used=1))]
+
+    def test_own_commit_advances_last_id(self):
+        self.allocator.update(self.changes, dict(ip=4, changelog=6), 12)
+        self.assertEqual(dict(ip=4, pool=1), self.allocator.revisions)
+        self.assertEqual(12, self.allocator.last_id)
+        self.assertEqual(6, self.allocator.changelog_rev)
+        self.assertEqual(0, self.allocator.pools['rack1'].free)
+
+    def test_other_writer_in_between_keeps_last_id(self):
+        self.allocator.update(self.changes, dict(ip=4, changelog=7), 12)
+        self.assertEqual(dict(ip=4, pool=1), self.allocator.revisions)
+        self.assertEqual(10, self.allocator.last_id)
+        self.assertEqual(5, self.allocator.changelog_rev)
+
+
+if __name__ == '__main__':
+    unittest.main()
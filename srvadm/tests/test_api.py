@@ -3,9 +3,20 @@ sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../
 
 import unittest
 import json
+import gzip
+import time
+import socket
+import subprocess
+from threading import Thread
+from urllib.request import urlopen
 from datetime import datetime
 
-from srvadm.models import Role, IP, Host, RoleMap
+from srvadm.models import Role, IP, Host, RoleMap, Revision, ChangeLog
+from srvadm.artifact import hosts_artifacts
+from srvadm.allocator import allocator
+from srvadm.watch import watch_hub
+from srvadm.compression import compressed_cache
+from srvadm.server import serve
 from srvadm import app, db
 
 TEST_DB = 'srv_test'
@@ -22,6 +33,10 @@ class TestApiBase(unittest.TestCase):
         db.engine.execute(CREATE_TEST_DB)
         db.engine.execute(USE_TEST_DB)
         db.create_all()
+        # fixtures are inserted behind the revision counters
+        hosts_artifacts.clear()
+        allocator.clear()
+        watch_hub.clear()
         app.config['TESTING'] = True
         self.app = app.test_client()
 
@@ -261,6 +276,25 @@ class TestApi(TestApiBase):
         actual = j.decode(res.data.decode())
         self.assertDictEqual(expected, actual)
 
+    def test_search_by_role_fields(self):
+        expected = dict(result=[dict(ip="192.168.1.111"), dict(ip="192.168.1.112"),
+                dict(ip="192.168.1.113")])
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        uri = '/api/role/%s?fields=ip' % ('db')
+
+        res = self.app.get(uri)
+        actual = json.loads(res.data.decode())
+        self.assertDictEqual(expected, actual)
+
+    def test_search_by_role_bad_fields(self):
+        uri = '/api/role/%s?fields=ip,os' % ('db')
+
+        res = self.app.get(uri)
+        assert '400' in str(res.status_code)
+
     def test_add_role(self):
         headers = [('Content-Type', 'application/json')]
         data = dict(role="hoge")
@@ -666,6 +700,618 @@ class TestApi(TestApiBase):
         assert 'application/json' in str(res.headers['Content-Type'])
         assert 'Could not complete your request. may be duprecated.' in res.data.decode()
 
+    def test_all_ip(self):
+        expected = dict(result=[dict(ip='192.168.1.100', is_used=1),\
+                dict(ip='192.168.1.101', is_used=1), dict(ip='192.168.1.102', is_used=1),\
+                dict(ip='192.168.1.103', is_used=1), dict(ip='192.168.1.111', is_used=1),\
+                dict(ip='192.168.1.112', is_used=1), dict(ip='192.168.1.113', is_used=1),\
+                dict(ip='192.168.1.121', is_used=1), dict(ip='192.168.1.122', is_used=0)])
+        self.create_test_ip_data()
+        uri = '/api/ip'
+
+        res = self.app.get(uri)
+        j = json.JSONDecoder()
+        actual = j.decode(res.data.decode())
+        self.assertDictEqual(expected, actual)
+
+    def test_all_host(self):
+        l = []
+        l.append(dict(host_name="db01", ip="192.168.1.111", role=['db']))
+        l.append(dict(host_name="db02", ip="192.168.1.112", role=['db']))
+        l.append(dict(host_name="db03", ip="192.168.1.113", role=['db']))
+        l.append(dict(host_name="mem01", ip="192.168.1.121", role=['session', 'cache']))
+        l.append(dict(host_name="vip01", ip="192.168.1.100", role=['vip']))
+        l.append(dict(host_name="web01", ip="192.168.1.101", role=['web', 'app']))
+        l.append(dict(host_name="web02", ip="192.168.1.102", role=['web', 'app']))
+        l.append(dict(host_name="web03", ip="192.168.1.103", role=['web', 'app']))
+        expected = dict(result=l)
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        uri = '/api/host'
+
+        res = self.app.get(uri)
+        j = json.JSONDecoder()
+        actual = j.decode(res.data.decode())
+        self.assertDictEqual(expected, actual)
+
+    def test_all_host_fields(self):
+        expected = dict(result=[dict(host_name="mem01", role=['session', 'cache'])],
+                next="192.168.1.121")
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        uri = '/api/host?fields=host_name,role&sort=-ip&limit=1'
+
+        res = self.app.get(uri)
+        actual = json.loads(res.data.decode())
+        self.assertDictEqual(expected, actual)
+
+    def test_all_host_empty(self):
+        uri = '/api/host'
+
+        res = self.app.get(uri)
+        assert '404' in str(res.status_code)
+
+    def test_list_ip_not_modified(self):
+        self.create_test_ip_data()
+        uri = '/api/list/ip'
+
+        res = self.app.get(uri)
+        etag = res.headers['ETag']
+        res = self.app.get(uri, headers=[('If-None-Match', etag)])
+        assert '304' in str(res.status_code)
+        self.assertEqual(etag, res.headers['ETag'])
+
+    def test_list_ip_if_modified_since(self):
+        self.create_test_ip_data()
+        headers = [('Content-Type', 'application/json')]
+        self.app.post('/api/ip', headers=headers, data=json.dumps(dict(ip="192.168.1.130")))
+        uri = '/api/list/ip'
+
+        res = self.app.get(uri)
+        last_modified = res.headers['Last-Modified']
+        # another write could still come within the second of that date
+        res = self.app.get(uri, headers=[('If-Modified-Since', last_modified)])
+        assert '200' in str(res.status_code)
+
+        time.sleep(1.1)
+        res = self.app.get(uri, headers=[('If-Modified-Since', last_modified)])
+        assert '304' in str(res.status_code)
+        res = self.app.get(uri, headers=[('If-Modified-Since', 'Fri, 01 Jan 2100 00:00:00 GMT')])
+        assert '304' in str(res.status_code)
+
+    def test_list_ip_modified_after_write(self):
+        self.create_test_ip_data()
+        headers = [('Content-Type', 'application/json')]
+        uri = '/api/list/ip'
+
+        res = self.app.get(uri)
+        etag = res.headers['ETag']
+        self.app.post('/api/ip', headers=headers, data=json.dumps(dict(ip="192.168.1.114")))
+        res = self.app.get(uri, headers=[('If-None-Match', etag)])
+        assert '200' in str(res.status_code)
+        self.assertNotEqual(etag, res.headers['ETag'])
+        assert '192.168.1.114' in res.data.decode()
+
+    def test_list_host_by_role_modified_after_role_change(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        headers = [('Content-Type', 'application/json')]
+        uri = '/api/list/host?role=web'
+
+        res = self.app.get(uri)
+        etag = res.headers['ETag']
+        self.app.put('/api/role/web', headers=headers, data=json.dumps(dict(role="www")))
+        res = self.app.get(uri, headers=[('If-None-Match', etag)])
+        assert '304' not in str(res.status_code)
+
+    def test_list_ip_csv_gzip(self):
+        self.create_test_ip_data()
+        min_size = app.config['COMPRESS_MIN_SIZE']
+        app.config['COMPRESS_MIN_SIZE'] = 0
+        compressed_cache.clear()
+        headers = [('Accept-Encoding', 'gzip')]
+        uri = '/api/list/ip?format=csv'
+        try:
+            res = self.app.get(uri, headers=headers)
+            self.assertEqual('gzip', res.headers['Content-Encoding'])
+            self.assertEqual('"ip.0-gzip"', res.headers['ETag'])
+            assert '192.168.1.100,' in gzip.decompress(res.data).decode()
+            # the streamed listing is compressed once per revision
+            self.app.get(uri, headers=headers)
+            self.assertEqual(1, len(compressed_cache.entries))
+
+            res = self.app.get(uri, headers=headers + [('If-None-Match', res.headers['ETag'])])
+            assert '304' in str(res.status_code)
+            self.assertEqual('"ip.0-gzip"', res.headers['ETag'])
+            assert 'Accept-Encoding' in res.headers['Vary']
+        finally:
+            app.config['COMPRESS_MIN_SIZE'] = min_size
+            compressed_cache.clear()
+
+    def test_list_ip_head_not_compressed(self):
+        self.create_test_ip_data()
+        compressed_cache.clear()
+
+        res = self.app.head('/api/list/ip?format=csv', headers=[('Accept-Encoding', 'gzip')])
+        assert '200' in str(res.status_code)
+        self.assertNotIn('Content-Encoding', res.headers)
+        assert 'Accept-Encoding' in res.headers['Vary']
+        self.assertEqual(0, len(compressed_cache.entries))
+
+    def test_add_ip_bulk(self):
+        self.create_test_ip_data()
+        headers = [('Content-Type', 'application/json')]
+        data = dict(ip=["192.168.1.101", "192.168.1.130"], cidr=["192.168.2.0/30"])
+        uri = '/api/ip/bulk'
+
+        res = self.app.post(uri, headers=headers, data=json.dumps(data))
+        assert '200' in str(res.status_code)
+        result = json.loads(res.data.decode())['result'][0]
+        self.assertEqual(3, result['added'])
+        self.assertListEqual(['192.168.1.101'], result['conflict'])
+        ips = [r.ip for r in IP.get_unused(db.session.query)]
+        self.assertListEqual(sorted(['192.168.1.122', '192.168.1.130', '192.168.2.1', '192.168.2.2']), sorted(ips))
+
+    def test_add_ip_bulk_bad_format(self):
+        headers = [('Content-Type', 'application/json')]
+        data = dict(ip=["192.168.1.130", "192.168.1.1aa"])
+        uri = '/api/ip/bulk'
+
+        res = self.app.post(uri, headers=headers, data=json.dumps(data))
+        assert '400' in str(res.status_code)
+        self.assertListEqual([], IP.get_all(db.session.query))
+
+    def test_delete_ip_bulk(self):
+        self.create_test_ip_data()
+        headers = [('Content-Type', 'application/json')]
+        data = dict(cidr=["192.168.1.120/30"])
+        uri = '/api/ip/bulk'
+
+        res = self.app.delete(uri, headers=headers, data=json.dumps(data))
+        assert '200' in str(res.status_code)
+        result = json.loads(res.data.decode())['result'][0]
+        self.assertEqual(1, result['deleted'])
+        self.assertListEqual(['192.168.1.121'], result['used'])
+        self.assertIsNone(IP.get_one(db.session.query, '192.168.1.122'))
+
+    def test_list_ip_cidr(self):
+        expected = '192.168.1.121,192.168.1.122'
+        self.create_test_ip_data()
+        uri = '/api/list/ip?format=csv&cidr=192.168.1.120/29'
+
+        res = self.app.get(uri)
+        self.assertEqual(expected, res.data.decode())
+
+    def test_list_ip_bad_cidr(self):
+        self.create_test_ip_data()
+        uri = '/api/list/ip?cidr=192.168.1.120'
+
+        res = self.app.get(uri)
+        assert '400' in str(res.status_code)
+
+    def test_add_host_auto_ip(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        headers = [('Content-Type', 'application/json')]
+        self.app.post('/api/ip/bulk', headers=headers, data=json.dumps(dict(cidr=["192.168.2.0/29"])))
+        self.app.post('/api/pool', headers=headers, data=json.dumps(dict(name="rack2", cidr="192.168.2.0/29")))
+        uri = '/api/host'
+
+        actual = []
+        for host_name in ['mem02', 'mem03']:
+            data = dict(host_name=host_name, ip="auto:rack2", role=["cache"])
+            res = self.app.post(uri, headers=headers, data=json.dumps(data))
+            assert '200' in str(res.status_code)
+            actual.append(json.loads(res.data.decode())['result']['ip'])
+        self.assertListEqual(['192.168.2.1', '192.168.2.2'], actual)
+        self.assertEqual('mem03', Host.get_one_by_ip(db.session.query, '192.168.2.2').host_name)
+
+    def test_add_host_auto_ip_advances_last_id(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        headers = [('Content-Type', 'application/json')]
+        self.app.post('/api/ip/bulk', headers=headers, data=json.dumps(dict(cidr=["192.168.2.0/29"])))
+        self.app.post('/api/pool', headers=headers, data=json.dumps(dict(name="rack2", cidr="192.168.2.0/29")))
+        for host_name in ['mem02', 'mem03']:
+            data = dict(host_name=host_name, ip="auto:rack2", role=["cache"])
+            self.app.post('/api/host', headers=headers, data=json.dumps(data))
+
+        # its own writes are not replayed from the change log
+        self.assertEqual(ChangeLog.select_last_id(db.session.execute), allocator.last_id)
+
+    def test_add_host_auto_ip_exhausted(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        headers = [('Content-Type', 'application/json')]
+        self.app.post('/api/pool', headers=headers, data=json.dumps(dict(name="rack2", cidr="192.168.2.0/29")))
+        data = dict(host_name="mem02", ip="auto:rack2", role=["cache"])
+
+        res = self.app.post('/api/host', headers=headers, data=json.dumps(data))
+        assert '409' in str(res.status_code)
+        self.assertIn('message', json.loads(res.data.decode()))
+
+    def test_add_host_auto_ip_unknown_pool(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        headers = [('Content-Type', 'application/json')]
+        data = dict(host_name="mem02", ip="auto:xx", role=["cache"])
+
+        res = self.app.post('/api/host', headers=headers, data=json.dumps(data))
+        assert '404' in str(res.status_code)
+
+    def test_add_host_auto_ip_after_other_process(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        headers = [('Content-Type', 'application/json')]
+        self.app.post('/api/ip/bulk', headers=headers, data=json.dumps(dict(cidr=["192.168.2.0/29"])))
+        self.app.post('/api/pool', headers=headers, data=json.dumps(dict(name="rack2", cidr="192.168.2.0/29")))
+        data = dict(host_name="mem02", ip="auto:rack2", role=["cache"])
+        self.app.post('/api/host', headers=headers, data=json.dumps(data))
+
+        # another worker takes the next address; this one only hears of it
+        # through the revisions and the change log
+        allocator.revisions = dict(allocator.revisions, ip=0)
+        data = dict(host_name="mem03", ip="192.168.2.2", role=["cache"])
+        self.app.post('/api/host', headers=headers, data=json.dumps(data))
+        allocator.revisions = dict(allocator.revisions, ip=0)
+        last_id = allocator.last_id
+        loaded = allocator.pools['rack2']
+
+        data = dict(host_name="mem04", ip="auto:rack2", role=["cache"])
+        res = self.app.post('/api/host', headers=headers, data=json.dumps(data))
+        self.assertEqual('192.168.2.3', json.loads(res.data.decode())['result']['ip'])
+        self.assertIs(loaded, allocator.pools['rack2'])
+        self.assertTrue(allocator.last_id > last_id)
+
+    def test_add_host_bulk(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        headers = [('Content-Type', 'application/json')]
+        hosts = [dict(host_name="mem02", ip="192.168.1.122", role=["cache"]),\
+                dict(host_name="mem03", ip="192.168.1.101", role=["cache"]),\
+                dict(host_name="mem04", ip="192.168.1.190", role=["cache"]),\
+                dict(host_name="web01", ip="192.168.1.122", role=["web"]),\
+                dict(host_name="mem05", ip="192.168.1.122", role=["xx"])]
+        uri = '/api/host/bulk'
+
+        res = self.app.post(uri, headers=headers, data=json.dumps(dict(hosts=hosts)))
+        assert '200' in str(res.status_code)
+        actual = [r['message'] for r in json.loads(res.data.decode())['result']]
+        self.assertListEqual(['OK', 'ip does not exist or used', 'ip does not exist or used',\
+                'host name exists', 'role not found'], actual)
+        host = Host.get_one_by_host_name(db.session.query, 'mem02')
+        self.assertEqual('192.168.1.122', host.ip)
+        self.assertListEqual(['cache'], [r.role_name for r in host.role])
+        self.assertEqual(1, IP.get_one(db.session.query, '192.168.1.122').is_used)
+
+    def test_add_host_bulk_duplicate_roles(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        headers = [('Content-Type', 'application/json')]
+        hosts = [dict(host_name="mem02", ip="192.168.1.122", role=["cache", "session", "cache"])]
+
+        res = self.app.post('/api/host/bulk', headers=headers, data=json.dumps(dict(hosts=hosts)))
+        assert '200' in str(res.status_code)
+        self.assertListEqual(['cache', 'session'],
+                RoleMap.select_role_names_by_host_name(db.session.execute, 'mem02'))
+
+    def test_add_host_duplicate_roles(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        headers = [('Content-Type', 'application/json')]
+        data = dict(host_name="mem02", ip="192.168.1.122", role=["cache", "cache"])
+
+        res = self.app.post('/api/host', headers=headers, data=json.dumps(data))
+        assert '200' in str(res.status_code)
+        self.assertListEqual(['cache'],
+                RoleMap.select_role_names_by_host_name(db.session.execute, 'mem02'))
+
+    def test_add_host_bulk_pattern(self):
+        self.create_test_role_data()
+        headers = [('Content-Type', 'application/json')]
+        self.app.post('/api/ip/bulk', headers=headers, data=json.dumps(dict(cidr=["192.168.2.0/24"])))
+        data = dict(host_name="web[08-10]", ip="192.168.2.10-192.168.2.12", role=["web", "app"])
+
+        res = self.app.post('/api/host/bulk', headers=headers, data=json.dumps(data))
+        assert '200' in str(res.status_code)
+        hosts = Host.select_with_roles(db.session.execute)
+        self.assertListEqual([('web08', '192.168.2.10', ['web', 'app']),\
+                ('web09', '192.168.2.11', ['web', 'app']),\
+                ('web10', '192.168.2.12', ['web', 'app'])], hosts)
+
+    def test_add_host_bulk_short_range(self):
+        headers = [('Content-Type', 'application/json')]
+        data = dict(host_name="web[01-03]", ip="192.168.2.10-192.168.2.11", role=["web"])
+
+        res = self.app.post('/api/host/bulk', headers=headers, data=json.dumps(data))
+        assert '400' in str(res.status_code)
+
+    def test_add_host_bulk_huge_range(self):
+        headers = [('Content-Type', 'application/json')]
+        data = dict(host_name="web[1-99999999999]", ip="192.168.2.10", role=["web"])
+
+        res = self.app.post('/api/host/bulk', headers=headers, data=json.dumps(data))
+        assert '400' in str(res.status_code)
+
+    def test_add_host_bulk_invalid_role(self):
+        self.create_test_ip_data()
+        headers = [('Content-Type', 'application/json')]
+        data = dict(host_name="web01", ip="192.168.1.121", role=[["web"]])
+
+        res = self.app.post('/api/host/bulk', headers=headers, data=json.dumps(data))
+        assert '400' in str(res.status_code)
+
+    def test_update_host_roles(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        headers = [('Content-Type', 'application/json')]
+        data = dict(host_name="web01", ip="192.168.1.101", role=["web", "cache"])
+        uri = '/api/host/%s' % ('web01')
+
+        res = self.app.put(uri, headers=headers, data=json.dumps(data))
+        assert '200' in str(res.status_code)
+        role_maps = RoleMap.get_by_host_name(db.session.query, 'web01')
+        self.assertListEqual(['web', 'cache'], [r.role_name for r in role_maps])
+        self.assertEqual(1, IP.get_one(db.session.query, '192.168.1.101').is_used)
+
+    def test_update_host_rename(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        headers = [('Content-Type', 'application/json')]
+        data = dict(host_name="web11", ip="192.168.1.122", role=["web", "app"])
+        uri = '/api/host/%s' % ('web01')
+
+        res = self.app.put(uri, headers=headers, data=json.dumps(data))
+        assert '200' in str(res.status_code)
+        role_maps = RoleMap.get_by_host_name(db.session.query, 'web11')
+        self.assertListEqual(['web', 'app'], [r.role_name for r in role_maps])
+        self.assertListEqual([], RoleMap.get_by_host_name(db.session.query, 'web01'))
+        self.assertEqual(0, IP.get_one(db.session.query, '192.168.1.101').is_used)
+        self.assertEqual(1, IP.get_one(db.session.query, '192.168.1.122').is_used)
+
+    def test_update_host_used_ip(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        headers = [('Content-Type', 'application/json')]
+        data = dict(host_name="web01", ip="192.168.1.102", role=["web", "app"])
+        uri = '/api/host/%s' % ('web01')
+
+        res = self.app.put(uri, headers=headers, data=json.dumps(data))
+        assert '500' in str(res.status_code)
+
+    def test_list_ip_paged(self):
+        self.create_test_ip_data()
+        uri = '/api/list/ip?limit=4'
+
+        res = self.app.get(uri)
+        actual = json.loads(res.data.decode())
+        self.assertDictEqual(dict(result=['192.168.1.100', '192.168.1.101', '192.168.1.102',
+                '192.168.1.103'], next='192.168.1.103'), actual)
+
+        res = self.app.get(uri + '&after=' + actual['next'])
+        actual = json.loads(res.data.decode())
+        self.assertDictEqual(dict(result=['192.168.1.111', '192.168.1.112', '192.168.1.113',
+                '192.168.1.121'], next='192.168.1.121'), actual)
+
+        res = self.app.get(uri + '&after=' + actual['next'])
+        actual = json.loads(res.data.decode())
+        self.assertDictEqual(dict(result=['192.168.1.122'], next=None), actual)
+
+    def test_list_ip_paged_text(self):
+        self.create_test_ip_data()
+        uri = '/api/list/ip?limit=2&sort=-ip&format=csv'
+
+        res = self.app.get(uri)
+        self.assertEqual('192.168.1.122,192.168.1.121', res.data.decode())
+        self.assertEqual('192.168.1.121', res.headers['X-Next-Cursor'])
+
+    def test_all_ip_filtered(self):
+        self.create_test_ip_data()
+        uri = '/api/ip?is_used=0'
+
+        res = self.app.get(uri)
+        actual = json.loads(res.data.decode())
+        self.assertDictEqual(dict(result=[dict(ip='192.168.1.122', is_used=0)]), actual)
+
+    def test_all_host_paged(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        uri = '/api/host?limit=2&role=web&sort=-host_name'
+
+        res = self.app.get(uri)
+        actual = json.loads(res.data.decode())
+        expected = dict(result=[dict(host_name="web03", ip="192.168.1.103", role=['web', 'app']),
+                dict(host_name="web02", ip="192.168.1.102", role=['web', 'app'])], next='web02')
+        self.assertDictEqual(expected, actual)
+
+        res = self.app.get(uri + '&after=web02')
+        actual = json.loads(res.data.decode())
+        expected = dict(result=[dict(host_name="web01", ip="192.168.1.101", role=['web', 'app'])],
+                next=None)
+        self.assertDictEqual(expected, actual)
+
+    def test_all_host_role_roles_of_matched_only(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        looked_up = []
+        select = RoleMap.select_role_names_by_host_names
+        def recording(execute, host_names):
+            looked_up.append(host_names)
+            return select(execute, host_names)
+        RoleMap.select_role_names_by_host_names = recording
+        try:
+            res = self.app.get('/api/host?role=web&q=web0')
+        finally:
+            RoleMap.select_role_names_by_host_names = select
+
+        actual = json.loads(res.data.decode())
+        self.assertEqual(['web01', 'web02', 'web03'], [h['host_name'] for h in actual['result']])
+        self.assertEqual([['web01', 'web02', 'web03']], looked_up)
+
+    def test_list_host_prefix(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        uri = '/api/list/host?q=db&sort=ip'
+
+        res = self.app.get(uri)
+        actual = json.loads(res.data.decode())
+        self.assertDictEqual(dict(result=['db01', 'db02', 'db03']), actual)
+
+    def test_list_bad_page_args(self):
+        for uri in ['/api/list/ip?limit=0', '/api/list/ip?limit=x', '/api/list/ip?after=x',
+                '/api/list/ip?sort=host_name', '/api/ip?is_used=2']:
+            res = self.app.get(uri)
+            assert '400' in str(res.status_code)
+
+    def test_lookup(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        headers = [('Content-Type', 'application/json')]
+        data = dict(host_name=["web01", "web99"], ip=["192.168.1.121", "192.168.1.122"])
+        uri = '/api/lookup'
+
+        res = self.app.post(uri, headers=headers, data=json.dumps(data))
+        assert '200' in str(res.status_code)
+        expected = dict(result=dict(
+            host_name=[dict(key="web01", host_name="web01", ip="192.168.1.101", role=['web', 'app']),
+                dict(key="web99", message='Not found')],
+            ip=[dict(key="192.168.1.121", host_name="mem01", ip="192.168.1.121", role=['session', 'cache']),
+                dict(key="192.168.1.122", message='Not found')]))
+        self.assertDictEqual(expected, json.loads(res.data.decode()))
+
+    def test_lookup_bad_format(self):
+        headers = [('Content-Type', 'application/json')]
+        uri = '/api/lookup'
+
+        for data in [dict(), dict(ip="192.168.1.101"), dict(ip=["192.168.1.1aa"])]:
+            res = self.app.post(uri, headers=headers, data=json.dumps(data))
+            assert '400' in str(res.status_code)
+
+    def test_changes(self):
+        self.create_test_ip_data()
+        headers = [('Content-Type', 'application/json')]
+        self.app.post('/api/ip', headers=headers, data=json.dumps(dict(ip="192.168.1.130")))
+        self.app.delete('/api/ip/192.168.1.122')
+
+        res = self.app.get('/api/changes')
+        expected = dict(result=[
+            dict(rev=1, table='ip', op='insert', key='192.168.1.130', data=dict(ip='192.168.1.130', is_used=0)),
+            dict(rev=2, table='ip', op='delete', key='192.168.1.122', data=None)], next=2)
+        self.assertDictEqual(expected, json.loads(res.data.decode()))
+
+        res = self.app.get('/api/changes?since=2')
+        self.assertDictEqual(dict(result=[], next=2), json.loads(res.data.decode()))
+
+    def test_changes_compacted(self):
+        Revision.store(db.session.execute, 'changelog_floor', 5)
+        db.session.commit()
+
+        res = self.app.get('/api/changes?since=4')
+        assert '410' in str(res.status_code)
+        res = self.app.get('/api/changes?since=5')
+        assert '200' in str(res.status_code)
+        res = self.app.get('/api/changes?since=x')
+        assert '400' in str(res.status_code)
+
+    def test_changes_compacted_after_etag(self):
+        res = self.app.get('/api/changes?since=4')
+        etag = res.headers['ETag']
+        Revision.store(db.session.execute, 'changelog_floor', 5)
+        db.session.commit()
+
+        res = self.app.get('/api/changes?since=4', headers=[('If-None-Match', etag)])
+        assert '410' in str(res.status_code)
+
+    def test_watch(self):
+        self.create_test_ip_data()
+        headers = [('Content-Type', 'application/json')]
+        self.app.post('/api/ip', headers=headers, data=json.dumps(dict(ip="192.168.1.130")))
+
+        res = self.app.get('/api/watch?since=0&timeout=0')
+        actual = json.loads(res.data.decode())
+        self.assertEqual(['192.168.1.130'], [e['key'] for e in actual['result']])
+        self.assertEqual(1, actual['next'])
+
+        res = self.app.get('/api/watch?since=1&timeout=0&role=web')
+        self.assertDictEqual(dict(result=[], next=1), json.loads(res.data.decode()))
+
+    def test_watch_events_end_at_timeout(self):
+        # a watcher hands its worker back before the worker would be killed
+        self.assertTrue(app.config['WATCH_TIMEOUT'] < app.config['SERVER_TIMEOUT'])
+        self.create_test_ip_data()
+        headers = [('Content-Type', 'application/json')]
+        self.app.post('/api/ip', headers=headers, data=json.dumps(dict(ip="192.168.1.130")))
+
+        started = time.time()
+        res = self.app.get('/api/watch?since=0&timeout=1', headers=[('Accept', 'text/event-stream')])
+        body = res.data.decode()
+        self.assertTrue(time.time() - started < 5)
+        assert 'id: 1\ndata: ' in body
+        self.assertTrue(body.endswith('retry: 1000\nid: 1\n\n'))
+
+    def test_watchers_do_not_hold_all_workers(self):
+        # a real server with one worker: idle watchers outnumber it and a
+        # regular request is still answered while they wait
+        self.create_test_ip_data()
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        base = 'http://127.0.0.1:%d' % sock.getsockname()[1]
+        sock.close()
+        env = dict(os.environ, SRVADM_DATABASE_URI='mysql+pymysql://root:@localhost/%s?charset=utf8' % TEST_DB)
+        manage = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../manage.py')
+        server = subprocess.Popen([sys.executable, manage, 'serve', '--workers', '1',
+                '--bind', base[len('http://'):]], env=env)
+        try:
+            for i in range(100):
+                try:
+                    urlopen(base + '/api/list/ip', timeout=1).read()
+                    break
+                except (IOError, OSError):
+                    time.sleep(0.1)
+
+            watchers = [Thread(target=lambda: urlopen(base + '/api/watch?timeout=10', timeout=20).read())
+                    for i in range(3)]
+            for t in watchers:
+                t.start()
+            time.sleep(1)
+
+            started = time.time()
+            res = urlopen(base + '/api/list/ip', timeout=5)
+            self.assertEqual(200, res.status)
+            self.assertTrue(time.time() - started < 2)
+            self.assertTrue(all(t.is_alive() for t in watchers))
+            for t in watchers:
+                t.join(20)
+        finally:
+            server.terminate()
+            server.wait()
+
+    def test_serve_refuses_sync_workers(self):
+        self.assertRaises(ValueError, serve, '127.0.0.1:0', 1, 1, 'sync', 30)
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -2,8 +2,10 @@ import sys, os
 sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../../'))
 
 import unittest
+import json
 
 from srvadm import app
+from srvadm.artifact import hosts_artifacts
 from srvadm.tests.test_api import TestApiBase
 
 class TestHostsOutput(TestApiBase):
@@ -45,6 +47,89 @@ class TestHostsOutput(TestApiBase):
         print(res.data.decode())
         assert 'Not found' not in res.data.decode()
 
+    def test_web_hosts_output(self):
+        expected = "192.168.1.101\tweb01\n192.168.1.102\tweb02\n192.168.1.103\tweb03\n"
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        res = self.app.get('/api/hosts_output/web')
+        self.assertEqual(expected, res.data.decode())
+
+    def test_hosts_output_after_add_host(self):
+        expected = "192.168.1.121\tmem01\n192.168.1.122\tmem02\n"
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        headers = [('Content-Type', 'application/json')]
+        data = dict(host_name="mem02", ip="192.168.1.122", role=["cache"])
+        self.app.get('/api/hosts_output/cache')
+        self.app.post('/api/host', headers=headers, data=json.dumps(data))
+        res = self.app.get('/api/hosts_output/cache')
+        self.assertEqual(expected, res.data.decode())
+
+    def test_hosts_output_after_delete_host(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        self.app.get('/api/hosts_output/vip')
+        self.app.delete('/api/host/vip01')
+        res = self.app.get('/api/hosts_output/vip')
+        assert '404' in str(res.status_code)
+
+    def test_all_hosts(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        res = self.app.get('/api/hosts_output')
+        lines = res.data.decode().splitlines()
+        self.assertEqual(8, len(lines))
+        self.assertEqual("192.168.1.111\tdb01", lines[0])
+
+    def test_unknown_role_hosts(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        res = self.app.get('/api/hosts_output/xx')
+        assert '404' in str(res.status_code)
+        self.assertNotIn('xx', hosts_artifacts.artifacts)
+
+    def test_hosts_output_all_roles(self):
+        expected = "192.168.1.121\tmem01\n"
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        res = self.app.get('/api/hosts_output?role=session&role=cache')
+        self.assertEqual(expected, res.data.decode())
+
+    def test_hosts_any_role(self):
+        expected = dict(result=[dict(host_name="mem01", ip="192.168.1.121"),
+                dict(host_name="vip01", ip="192.168.1.100")])
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        res = self.app.get('/api/hosts?role=vip&role=cache&match=any')
+        self.assertDictEqual(expected, json.loads(res.data.decode()))
+
+    def test_hosts_all_roles(self):
+        self.create_test_ip_data()
+        self.create_test_role_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        res = self.app.get('/api/hosts?role=web&role=app&format=csv')
+        self.assertEqual("192.168.1.101,192.168.1.102,192.168.1.103", res.data.decode())
+        res = self.app.get('/api/hosts?role=web&role=db')
+        self.assertDictEqual(dict(result=[]), json.loads(res.data.decode()))
+
+    def test_hosts_bad_match(self):
+        res = self.app.get('/api/hosts?role=web&match=some')
+        assert '400' in str(res.status_code)
+
 if __name__ == '__main__':
     unittest.main()
 
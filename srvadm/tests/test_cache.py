@@ -0,0 +1,79 @@
+import sys, os
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../../'))
+
+from srvadm.cache import LRUCache, model_cache, cached
+from srvadm import app
+from flask import g
+import unittest
+import time
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(2, 60)
+
+    def test_get_set(self):
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('b'), None)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_cache_none(self):
+        missing = object()
+        self.cache.set('a', None)
+        self.assertEqual(self.cache.get('a', missing), None)
+
+    def test_evict_least_recently_used(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('b'), None)
+        self.assertEqual(self.cache.get('c'), 3)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_ttl(self):
+        self.cache.ttl = 0.01
+        self.cache.set('a', 1)
+        time.sleep(0.02)
+        self.assertEqual(self.cache.get('a'), None)
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+
+class TestCached(unittest.TestCase):
+
+    def setUp(self):
+        self.maxsize = model_cache.maxsize
+        model_cache.maxsize = 10
+        model_cache.clear()
+        self.calls = 0
+
+        test = self
+        class Model(object):
+            @classmethod
+            @cached('host')
+            def select(cls, execute, name):
+                test.calls += 1
+                return name
+        self.model = Model
+
+    def tearDown(self):
+        model_cache.maxsize = self.maxsize
+        model_cache.clear()
+
+    def test_keyed_on_revisions(self):
+        with app.test_request_context('/'):
+            g.revisions = dict(host=1)
+            self.assertEqual('web01', self.model.select(None, 'web01'))
+            self.assertEqual('web01', self.model.select(None, 'web01'))
+            self.assertEqual(1, self.calls)
+        with app.test_request_context('/'):
+            # written by another worker since
+            g.revisions = dict(host=2)
+            self.model.select(None, 'web01')
+            self.assertEqual(2, self.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
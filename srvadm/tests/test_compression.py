@@ -0,0 +1,75 @@
+import sys, os
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../../'))
+
+from srvadm.compression import (
+    negotiate_encoding, compress, compress_stream, compressed, compressed_cache,
+    encoded_etag, etag_variants
+)
+from werkzeug.http import parse_accept_header
+import unittest
+import gzip
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = compressed_cache.maxsize
+        compressed_cache.maxsize = 2
+        compressed_cache.clear()
+        compressed_cache.hits = 0
+
+    def tearDown(self):
+        compressed_cache.maxsize = self.cache
+        compressed_cache.clear()
+
+    def test_negotiate_encoding(self):
+        self.assertIsNone(negotiate_encoding(parse_accept_header(None)))
+        self.assertIsNone(negotiate_encoding(parse_accept_header('identity')))
+        self.assertIsNone(negotiate_encoding(parse_accept_header('gzip;q=0')))
+        self.assertEqual('gzip', negotiate_encoding(parse_accept_header('gzip')))
+        self.assertEqual('gzip', negotiate_encoding(parse_accept_header('deflate, gzip;q=0.5')))
+        self.assertIsNotNone(negotiate_encoding(parse_accept_header('*')))
+
+    def test_compress(self):
+        body = b'192.168.1.1\tweb01\n' * 1000
+        data = compress(body, 'gzip')
+        self.assertTrue(len(data) < len(body))
+        self.assertEqual(body, gzip.decompress(data))
+
+    def test_compress_stream(self):
+        chunks = ['192.168.1.%d,' % i for i in range(256)]
+        data = b''.join(compress_stream(iter(chunks), 'gzip'))
+        self.assertEqual(''.join(chunks).encode('utf-8'), gzip.decompress(data))
+
+    def test_compress_stream_done(self):
+        kept = []
+        chunks = ['192.168.1.%d,' % i for i in range(256)]
+        data = b''.join(compress_stream(iter(chunks), 'gzip', kept.append))
+        self.assertEqual([data], kept)
+        # a stream left early is not kept
+        kept = []
+        stream = compress_stream(iter(chunks), 'gzip', kept.append)
+        next(stream)
+        stream.close()
+        self.assertEqual([], kept)
+
+    def test_compressed_once(self):
+        body = b'web01 ' * 1000
+        data = compressed(body, 'gzip', '"host.1"')
+        self.assertIs(data, compressed(body, 'gzip', '"host.1"'))
+        self.assertEqual(1, compressed_cache.hits)
+        # a different body under the same revisions is another entry
+        other = compressed(b'web02 ' * 1000, 'gzip', '"host.1"')
+        self.assertEqual(b'web02 ' * 1000, gzip.decompress(other))
+        # untagged bodies are not kept
+        compressed(body, 'gzip', None)
+        self.assertEqual(2, len(compressed_cache.entries))
+
+    def test_encoded_etag(self):
+        self.assertEqual('host.3-role_map.2-gzip', encoded_etag('host.3-role_map.2', 'gzip'))
+        variants = etag_variants('host.3')
+        self.assertEqual('host.3', variants[0])
+        self.assertIn('host.3-gzip', variants)
+
+
+if __name__ == '__main__':
+    unittest.main()
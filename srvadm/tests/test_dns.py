@@ -0,0 +1,87 @@
+import sys, os
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../../'))
+
+from srvadm.dns import (
+    DNSIndex, handle_query, encode_name, TYPE_A, TYPE_PTR, TYPE_OPT, RCODE_NXDOMAIN
+)
+import unittest
+import struct
+
+class TestDNS(unittest.TestCase):
+
+    def setUp(self):
+        self.index = DNSIndex('internal')
+        hosts = [('web01', '192.168.1.101'), ('web02', '192.168.1.102'), ('db01', '192.168.1.111')]
+        roles = {'web01': ['web', 'app'], 'web02': ['web'], 'db01': ['db']}
+        for i in range(50):
+            hosts.append(('batch%02d' % i, '192.168.2.%d' % i))
+            roles['batch%02d' % i] = ['batch']
+        # no address yet
+        hosts.append(('new01', None))
+        roles['new01'] = ['web']
+        self.index.build(hosts, roles)
+
+    def send(self, name, qtype, payload=None):
+        data = struct.pack('!HHHHHH', 1234, 0x0100, 1, 0, 0, 1 if payload else 0) +\
+                encode_name(name) + struct.pack('!HH', qtype, 1)
+        if payload:
+            data += b'\0' + struct.pack('!HHIH', TYPE_OPT, payload, 0, 0)
+        return data, handle_query(self.index, data, 5)
+
+    def query(self, name, qtype, payload=None):
+        data, response = self.send(name, qtype, payload)
+        ident, flags, qdcount, ancount = struct.unpack('!HHHH', response[:8])
+        self.assertEqual(1234, ident)
+        # answers follow the echoed question, rdata last in each record
+        offset = len(encode_name(name)) + 16
+        answers = []
+        for i in range(ancount):
+            rtype, rclass, ttl, length = struct.unpack('!HHIH', response[offset + 2:offset + 12])
+            answers.append((rtype, response[offset + 12:offset + 12 + length]))
+            offset += 12 + length
+        return flags & 0x000F, answers
+
+    def test_a(self):
+        self.assertEqual((0, [(TYPE_A, bytes([192, 168, 1, 101]))]), self.query('web01.internal.', TYPE_A))
+        self.assertEqual((0, [(TYPE_A, bytes([192, 168, 1, 111]))]), self.query('DB01', TYPE_A))
+
+    def test_role(self):
+        rcode, answers = self.query('web.role.internal', TYPE_A)
+        self.assertEqual([bytes([192, 168, 1, 101]), bytes([192, 168, 1, 102])], [a[1] for a in answers])
+
+    def test_role_truncated(self):
+        data, response = self.send('batch.role.internal', TYPE_A)
+        flags, qdcount, ancount = struct.unpack('!HHH', response[2:8])
+        self.assertTrue(flags & 0x0200)
+        self.assertTrue(len(response) <= 512)
+        self.assertTrue(0 < ancount < 50)
+
+    def test_role_edns(self):
+        data, response = self.send('batch.role.internal', TYPE_A, 4096)
+        flags, qdcount, ancount, nscount, arcount = struct.unpack('!HHHHH', response[2:12])
+        self.assertFalse(flags & 0x0200)
+        self.assertEqual((50, 1), (ancount, arcount))
+        self.assertEqual(50, len(self.query('batch.role.internal', TYPE_A, 4096)[1]))
+
+    def test_null_ip_skipped(self):
+        self.assertEqual((RCODE_NXDOMAIN, []), self.query('new01.internal', TYPE_A))
+        rcode, answers = self.query('web.role.internal', TYPE_A)
+        self.assertEqual(2, len(answers))
+
+    def test_ptr(self):
+        expected = (0, [(TYPE_PTR, encode_name('web02.internal'))])
+        self.assertEqual(expected, self.query('102.1.168.192.in-addr.arpa', TYPE_PTR))
+
+    def test_nxdomain(self):
+        self.assertEqual((RCODE_NXDOMAIN, []), self.query('web99.internal', TYPE_A))
+        self.assertEqual((RCODE_NXDOMAIN, []), self.query('99.1.168.192.in-addr.arpa', TYPE_PTR))
+
+    def test_no_data(self):
+        self.assertEqual((0, []), self.query('web01.internal', TYPE_PTR))
+
+    def test_malformed(self):
+        self.assertEqual(None, handle_query(self.index, b'\x00\x01', 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
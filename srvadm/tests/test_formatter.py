@@ -0,0 +1,44 @@
+import sys, os
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../../'))
+
+from srvadm import formatter
+import unittest
+
+class TestFormatter(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = [{'role': 'web', 'ip': '192.168.1.101', 'host_name': 'web01'}, {'role': 'web', 'ip': '192.168.1.102', 'host_name': 'web02'}, {'role': 'web', 'ip': '192.168.1.102', 'host_name': 'web03'}]
+        self.ips = [r['ip'] for r in self.rs]
+        self.exp_hosts = "192.168.1.101\tweb01\n192.168.1.102\tweb02\n192.168.1.102\tweb03\n"
+        self.exp_csv = "192.168.1.101,192.168.1.102,192.168.1.102"
+        self.exp_space = "192.168.1.101 192.168.1.102 192.168.1.102"
+
+    def render(self, fmt, rs, size=formatter.CHUNK_ROWS):
+        f = formatter.formatters[fmt]
+        return ''.join(formatter.chunked(f(rs), size))
+
+    def test_csv(self):
+        self.assertEqual(self.render('csv', self.ips), self.exp_csv)
+
+    def test_space(self):
+        self.assertEqual(self.render('space', self.ips), self.exp_space)
+
+    def test_hosts(self):
+        self.assertEqual(self.render('hosts', self.rs), self.exp_hosts)
+
+    def test_empty(self):
+        self.assertEqual(self.render('csv', []), '')
+        self.assertEqual(self.render('space', []), '')
+        self.assertEqual(self.render('hosts', []), '')
+
+    def test_generator_input(self):
+        self.assertEqual(self.render('csv', iter(self.ips)), self.exp_csv)
+
+    def test_chunked(self):
+        chunks = list(formatter.chunked(formatter.csv_formatter(self.ips), 2))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(''.join(chunks), self.exp_csv)
+
+
+if __name__ == '__main__':
+    unittest.main()
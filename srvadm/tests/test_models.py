@@ -4,7 +4,7 @@ sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../
 import unittest
 from datetime import datetime
 
-from srvadm.models import Role, IP, Host, RoleMap
+from srvadm.models import Role, IP, Host, RoleMap, Revision
 from srvadm import app, db
 
 TEST_DB = 'srv_test'
@@ -151,6 +151,42 @@ class TestIP(TestModelsBase):
         actual = ip
         self.assertEqual(expected, actual)
 
+    def test_select_page_unused(self):
+        expected = ['192.168.1.122']
+        self.create_test_ip_data()
+        actual = [r.ip for r in IP.select_page(db.session.execute, is_used=0)]
+        self.assertListEqual(expected, actual)
+
+    def test_select_page_numeric_order(self):
+        expected = ['192.168.1.9', '192.168.1.20', '192.168.1.100']
+        for ipaddr in ['192.168.1.100', '192.168.1.20', '192.168.1.9']:
+            db.session.add(IP(ip=ipaddr))
+        db.session.commit()
+        actual = [r.ip for r in IP.select_page(db.session.execute)]
+        self.assertListEqual(expected, actual)
+
+    def test_select_in_subnet(self):
+        expected = ['192.168.1.111', '192.168.1.112', '192.168.1.113']
+        self.create_test_ip_data()
+        ips = IP.select_in_subnet(db.session.execute, '192.168.1.108/29')
+        actual = [r.ip for r in ips]
+        self.assertListEqual(expected, actual)
+
+    def test_select_in_range(self):
+        expected = ['192.168.1.103', '192.168.1.111']
+        self.create_test_ip_data()
+        ips = IP.select_in_range(db.session.execute, '192.168.1.103', '192.168.1.111')
+        actual = [r.ip for r in ips]
+        self.assertListEqual(expected, actual)
+
+    def test_update_ip_num(self):
+        self.create_test_ip_data()
+        ip = IP.get_one(db.session.query, '192.168.1.122')
+        ip.ip = '192.168.1.5'
+        db.session.commit()
+        actual = IP.select_in_range(db.session.execute, '192.168.1.0', '192.168.1.99')
+        self.assertListEqual(['192.168.1.5'], [r.ip for r in actual])
+
 
 class TestRoleMap(TestModelsBase):
 
@@ -203,6 +239,14 @@ class TestHost(TestModelsBase):
         actual = [(h.host_name, h.ip) for h in hosts]
         self.assertListEqual(sorted(expected), sorted(actual))
 
+    def test_timestamps_default(self):
+        self.create_test_ip_data()
+        db.session.add(Host(host_name='web11', ip='192.168.1.122'))
+        db.session.commit()
+        host = Host.get_one_by_host_name(db.session.query, 'web11')
+        self.assertIsNotNone(host.created_at)
+        self.assertIsNotNone(host.updated_at)
+
     def test_get_one_by_ip(self):
         expected = ('web01', '192.168.1.101')
         self.create_test_role_data()
@@ -236,6 +280,61 @@ class TestHost(TestModelsBase):
         actual = [(h.host_name, h.ip) for h in hosts]
         self.assertListEqual(sorted(expected), sorted(actual))
 
+    def test_select_with_roles(self):
+        expected = [('mem01', '192.168.1.121', ['session', 'cache']),\
+                ('web01', '192.168.1.101', ['web', 'app'])]
+        self.create_test_role_data()
+        self.create_test_ip_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        hosts = Host.select_with_roles(db.session.execute, host_names=['web01', 'mem01'])
+        self.assertListEqual(expected, hosts)
+
+    def test_select_with_roles_no_role(self):
+        expected = [('db01', '192.168.1.111', [])]
+        self.create_test_role_data()
+        self.create_test_ip_data()
+        self.create_test_host_data()
+        hosts = Host.select_with_roles(db.session.execute, ips=['192.168.1.111'])
+        self.assertListEqual(expected, hosts)
+
+    def test_select_by_role_name(self):
+        expected = [('db01', '192.168.1.111'),\
+                ('db02', '192.168.1.112'),\
+                ('db03', '192.168.1.113')]
+        self.create_test_role_data()
+        self.create_test_ip_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        hosts = Host.select_by_role_name(db.session.execute, 'db')
+        actual = [(h.host_name, h.ip) for h in hosts]
+        self.assertListEqual(expected, actual)
+
+    def test_select_by_role_name_miss(self):
+        self.create_test_role_data()
+        self.create_test_ip_data()
+        self.create_test_host_data()
+        self.create_test_role_map_data()
+        hosts = Host.select_by_role_name(db.session.execute, 'xx')
+        self.assertListEqual([], hosts)
+
+class TestRevision(TestModelsBase):
+
+    def test_bump(self):
+        self.assertEqual(1, Revision.bump(db.session.execute, 'host'))
+        self.assertEqual(2, Revision.bump(db.session.execute, 'host'))
+        db.session.commit()
+        revisions = Revision.select_revisions(db.session.execute, ['host', 'ip'])
+        self.assertEqual(2, revisions['host'][0])
+        self.assertNotIn('ip', revisions)
+
+    def test_store(self):
+        Revision.store(db.session.execute, 'changelog_floor', 5)
+        Revision.store(db.session.execute, 'changelog_floor', 9)
+        db.session.commit()
+        revisions = Revision.select_revisions(db.session.execute, ['changelog_floor'])
+        self.assertEqual(9, revisions['changelog_floor'][0])
+
 if __name__ == '__main__':
     unittest.main()
 
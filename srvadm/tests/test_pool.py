@@ -0,0 +1,40 @@
+import sys, os
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../../'))
+
+from srvadm.pool import TimedQueuePool
+import unittest
+import sqlite3
+
+class TestTimedQueuePool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = TimedQueuePool(lambda: sqlite3.connect(':memory:', check_same_thread=False),
+                pool_size=1, max_overflow=1)
+
+    def test_stats(self):
+        conn1 = self.pool.connect()
+        conn2 = self.pool.connect()
+        stats = self.pool.stats()
+        self.assertEqual(2, stats['checked_out'])
+        self.assertEqual(1, stats['overflow'])
+        self.assertEqual(2, stats['waits'])
+        conn1.close()
+        conn2.close()
+        self.assertEqual(0, self.pool.stats()['checked_out'])
+
+    def test_stale_connection_replaced(self):
+        conn = self.pool.connect()
+        raw = conn.connection
+        conn.close()
+        # dropped by the server while idle in the pool
+        raw.close()
+
+        conn = self.pool.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1')
+        self.assertEqual((1,), cursor.fetchone())
+        self.assertEqual(1, self.pool.stats()['stale'])
+
+
+if __name__ == '__main__':
+    unittest.main()
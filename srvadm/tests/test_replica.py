@@ -0,0 +1,117 @@
+import sys, os
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../../'))
+
+from srvadm.replica import ReplicaSet, replication_lag
+from srvadm.models import Revision
+from srvadm.pool import read_bind
+from srvadm import app, db
+from flask import g
+from sqlalchemy import create_engine
+from datetime import datetime, timedelta
+from threading import Event
+import unittest
+import tempfile
+import shutil
+
+class TestReplicaSet(unittest.TestCase):
+
+    def setUp(self):
+        # a primary and two replicas as sqlite files
+        self.dir = tempfile.mkdtemp()
+        self.uris = ['sqlite:///%s' % os.path.join(self.dir, name)
+                for name in ('replica1.db', 'replica2.db')]
+        primary_uri = 'sqlite:///%s' % os.path.join(self.dir, 'primary.db')
+        self.primary = create_engine(primary_uri)
+        for engine in [self.primary] + [create_engine(uri) for uri in self.uris]:
+            Revision.__table__.create(engine)
+            self.store(engine, 'host', 1, datetime.utcnow())
+
+        self.config = dict(app.config)
+        app.config['SQLALCHEMY_DATABASE_URI'] = primary_uri
+        app.config['SQLALCHEMY_REPLICA_URIS'] = self.uris
+        app.config['REPLICA_CHECK_INTERVAL'] = 3600
+        self.replica_set = ReplicaSet()
+        self.replica_set.configure()
+
+    def tearDown(self):
+        self.replica_set.clear()
+        app.config.clear()
+        app.config.update(self.config)
+        shutil.rmtree(self.dir)
+
+    def store(self, engine, name, rev, updated_at):
+        t = Revision.__table__
+        engine.execute(t.delete().where(t.c.name == name))
+        engine.execute(t.insert().values(name=name, rev=rev, updated_at=updated_at))
+
+    def test_replication_lag(self):
+        now = datetime.utcnow()
+        primary = {'host': (3, now - timedelta(seconds=10)), 'ip': (1, now - timedelta(seconds=60))}
+        self.assertEqual(0, replication_lag(primary, dict(primary), now))
+        self.assertEqual(10, replication_lag(primary, {'host': (2, None), 'ip': (1, None)}, now))
+        self.assertEqual(60, replication_lag(primary, {'host': (3, None)}, now))
+
+    def test_choose_round_robin(self):
+        self.replica_set.check(self.primary)
+        chosen = [self.replica_set.choose(5).name for i in range(4)]
+        self.assertEqual(2, len(set(chosen)))
+        self.assertEqual(chosen[:2], chosen[2:])
+
+    def test_lagging_replica_skipped(self):
+        self.store(self.primary, 'host', 2, datetime.utcnow() - timedelta(seconds=30))
+        self.store(self.replica_set.replicas[0].engine, 'host', 2, datetime.utcnow())
+        self.replica_set.check(self.primary)
+
+        self.assertEqual(0, self.replica_set.replicas[0].lag)
+        self.assertTrue(self.replica_set.replicas[1].lag >= 30)
+        for i in range(3):
+            self.assertIs(self.replica_set.replicas[0], self.replica_set.choose(5))
+
+    def test_fallback_to_primary(self):
+        self.store(self.primary, 'host', 2, datetime.utcnow() - timedelta(seconds=30))
+        self.replica_set.check(self.primary)
+        self.assertIsNone(self.replica_set.choose(5))
+        self.assertEqual(1, self.replica_set.stats()['fallbacks'])
+
+    def test_unreachable_replica_skipped(self):
+        self.replica_set.replicas[1].engine.execute('drop table revision')
+        self.replica_set.check(self.primary)
+        self.assertIsNone(self.replica_set.replicas[1].lag)
+        self.assertIs(self.replica_set.replicas[0], self.replica_set.choose(5))
+
+    def test_choose_does_not_check(self):
+        self.assertIsNone(self.replica_set.choose(5))
+        self.assertIsNone(self.replica_set.checked_at)
+
+    def test_stale_check_falls_back(self):
+        self.replica_set.check(self.primary)
+        self.replica_set.checked_at -= 10
+        self.assertIsNone(self.replica_set.choose(5))
+
+    def test_checked_in_background(self):
+        checked = Event()
+        self.replica_set.check = lambda primary: checked.set()
+        self.replica_set.start()
+        self.assertTrue(checked.wait(5))
+        self.assertTrue(self.replica_set.thread.daemon)
+
+    def test_reads_routed_to_replica(self):
+        self.store(self.replica_set.replicas[0].engine, 'host', 7, datetime.utcnow())
+        with app.test_request_context('/'):
+            g.read_bind = self.replica_set.replicas[0].engine
+            self.assertIs(g.read_bind, read_bind())
+            revisions = Revision.select_revisions(db.session.execute, ['host'])
+            self.assertEqual(7, revisions['host'][0])
+            db.session.remove()
+
+    def test_primary_execute(self):
+        self.store(self.replica_set.replicas[0].engine, 'host', 7, datetime.utcnow())
+        with app.test_request_context('/'):
+            g.read_bind = self.replica_set.replicas[0].engine
+            self.assertEqual(7, Revision.select_revisions(db.session.execute, ['host'])['host'][0])
+            self.assertEqual(1, Revision.select_revisions(db.primary_execute, ['host'])['host'][0])
+            db.session.remove()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import sys, os
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../../'))
+
+from srvadm.serializer import dumps_json, negotiate, encode, encoders, etag_suffix, msgpack
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+import unittest
+import json
+
+def accept(value):
+    return parse_accept_header(value, MIMEAccept)
+
+class TestSerializer(unittest.TestCase):
+
+    def test_dumps_json(self):
+        obj = dict(result=[dict(ip='192.168.1.1', host_name='web01')], next=None)
+        self.assertEqual(b'{"next":null,"result":[{"host_name":"web01","ip":"192.168.1.1"}]}',
+                dumps_json(obj))
+        pretty = dumps_json(obj, pretty=True)
+        self.assertIn(b'\n  "next": null', pretty)
+        self.assertEqual(obj, json.loads(pretty.decode('utf-8')))
+
+    def test_negotiate_json(self):
+        self.assertIsNone(negotiate(accept(None)))
+        self.assertIsNone(negotiate(accept('*/*')))
+        self.assertIsNone(negotiate(accept('application/json')))
+        self.assertIsNone(negotiate(accept('application/cbor;q=0.5, application/json')))
+
+    def test_etag_suffix_json(self):
+        self.assertEqual('', etag_suffix(accept('application/json')))
+        self.assertEqual('', etag_suffix(accept('*/*')))
+
+    @unittest.skipUnless(msgpack, 'msgpack is not installed')
+    def test_etag_suffix_msgpack(self):
+        self.assertEqual('-msgpack', etag_suffix(accept('application/msgpack')))
+        self.assertEqual('-msgpack', etag_suffix(accept('application/x-msgpack')))
+
+    @unittest.skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack(self):
+        self.assertEqual('application/msgpack', negotiate(accept('application/msgpack')))
+        self.assertEqual('application/x-msgpack',
+                negotiate(accept('application/json;q=0.5, application/x-msgpack')))
+
+        obj = dict(result=['web01', 'web02'])
+        body, mimetype = encode(obj, accept('application/msgpack, */*;q=0.1'))
+        self.assertEqual('application/msgpack', mimetype)
+        self.assertEqual(obj, msgpack.unpackb(body, raw=False))
+
+    def test_unknown_encoding(self):
+        self.assertNotIn('application/xml', encoders)
+        body, mimetype = encode(dict(result=[]), accept('application/xml'))
+        self.assertEqual('application/json', mimetype)
+        self.assertEqual(b'{"result":[]}', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import sys, os
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../../'))
+
+from srvadm.singleflight import SingleFlight
+from werkzeug.exceptions import NotFound
+from threading import Event, Thread
+import unittest
+import time
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.started = Event()
+        self.release = Event()
+        self.calls = 0
+
+    def slow(self, result):
+        def f():
+            self.calls += 1
+            self.started.set()
+            self.release.wait(5)
+            if isinstance(result, BaseException):
+                raise result
+            return result
+        return f
+
+    def run_concurrently(self, key, f, n, share=None):
+        results = []
+
+        def call():
+            try:
+                results.append(self.single_flight.do(key, f, share))
+            except BaseException as e:
+                results.append(e)
+
+        threads = [Thread(target=call) for i in range(n)]
+        threads[0].start()
+        self.started.wait(5)
+        for t in threads[1:]:
+            t.start()
+        # followers are waiting once they are counted
+        while self.single_flight.stats()['coalesced'] < n - 1:
+            time.sleep(0.001)
+        self.release.set()
+        for t in threads:
+            t.join(5)
+        return results
+
+    def test_coalesced(self):
+        results = self.run_concurrently('web', self.slow('hosts'), 5)
+        self.assertEqual(['hosts'] * 5, results)
+        self.assertEqual(1, self.calls)
+        stats = self.single_flight.stats()
+        self.assertEqual(1, stats['leaders'])
+        self.assertEqual(4, stats['coalesced'])
+        self.assertEqual(0, stats['in_flight'])
+
+    def test_not_shared_after_done(self):
+        self.release.set()
+        self.assertEqual('hosts', self.single_flight.do('web', self.slow('hosts')))
+        self.assertEqual('hosts', self.single_flight.do('web', self.slow('hosts')))
+        self.assertEqual(2, self.calls)
+        self.assertEqual(0, self.single_flight.stats()['coalesced'])
+
+    def test_http_error_shared(self):
+        results = self.run_concurrently('web', self.slow(NotFound()), 3)
+        self.assertTrue(all(isinstance(r, NotFound) for r in results))
+        self.assertEqual(1, self.calls)
+
+    def test_failed_leader(self):
+        failure = ValueError('lost connection')
+
+        def f():
+            self.calls += 1
+            if self.calls == 1:
+                self.started.set()
+                self.release.wait(5)
+                raise failure
+            return 'hosts'
+
+        results = self.run_concurrently('web', f, 3)
+        self.assertIn(failure, results)
+        self.assertEqual(['hosts', 'hosts'], [r for r in results if r is not failure])
+        self.assertEqual(2, self.single_flight.stats()['failed'])
+
+    def test_shared_only_when_joined(self):
+        shared = []
+
+        def share(result):
+            shared.append(result)
+            return result.upper()
+
+        self.release.set()
+        self.assertEqual('hosts', self.single_flight.do('web', self.slow('hosts'), share))
+        self.assertEqual([], shared)
+
+        self.release.clear()
+        results = self.run_concurrently('web', self.slow('hosts'), 3, share)
+        self.assertEqual(['HOSTS'] * 3, results)
+        self.assertEqual(['hosts'], shared)
+
+    def test_leader_killed(self):
+        # not an Exception, followers must not take None for the result
+        class Killed(BaseException):
+            pass
+        killed = Killed()
+
+        def f():
+            self.calls += 1
+            if self.calls == 1:
+                self.started.set()
+                self.release.wait(5)
+                raise killed
+            return 'hosts'
+
+        results = self.run_concurrently('web', f, 3)
+        self.assertIn(killed, results)
+        self.assertEqual(['hosts', 'hosts'], [r for r in results if r is not killed])
+        self.assertEqual(0, self.single_flight.stats()['in_flight'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,6 +28,34 @@ class TestValidator(unittest.TestCase):
             ret.append(validator.is_valid_ip(ip))
         self.assertEqual(ret, self.exp_invalid_ips)
 
+    def test_is_valid_cidr(self):
+        self.assertTrue(validator.is_valid_cidr('192.168.0.0/22'))
+        self.assertTrue(validator.is_valid_cidr('192.168.1.1/32'))
+        self.assertFalse(validator.is_valid_cidr('192.168.0.0/33'))
+        self.assertFalse(validator.is_valid_cidr('192.168.0.0'))
+        self.assertFalse(validator.is_valid_cidr('192.168.0/24'))
+
+    def test_cidr_hosts(self):
+        self.assertEqual(validator.cidr_hosts('192.168.1.0/30'), ['192.168.1.1', '192.168.1.2'])
+        self.assertEqual(len(validator.cidr_hosts('192.168.0.0/22')), 1022)
+        self.assertEqual(validator.cidr_hosts('192.168.1.5/32'), ['192.168.1.5'])
+
+    def test_expand_host_names(self):
+        self.assertEqual(validator.expand_host_names('web[08-10]'), ['web08', 'web09', 'web10'])
+        self.assertEqual(validator.expand_host_names('db[1-2].dc1'), ['db1.dc1', 'db2.dc1'])
+        self.assertEqual(validator.expand_host_names('web01'), ['web01'])
+
+    def test_count_host_names(self):
+        self.assertEqual(validator.count_host_names('web[08-10]'), 3)
+        self.assertEqual(validator.count_host_names('web01'), 1)
+        self.assertEqual(validator.count_host_names('web[1-99999999999]'), 99999999999)
+        self.assertEqual(validator.count_host_names('web[3-1]'), 0)
+
+    def test_is_valid_ip_range(self):
+        self.assertTrue(validator.is_valid_ip_range('192.168.1.10-192.168.1.49'))
+        self.assertFalse(validator.is_valid_ip_range('192.168.1.49-192.168.1.10'))
+        self.assertFalse(validator.is_valid_ip_range('192.168.1.10'))
+
 
 if __name__ == '__main__':
     unittest.main()
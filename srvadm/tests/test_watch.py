@@ -0,0 +1,51 @@
+import sys, os
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), '../../'))
+
+from srvadm.watch import WatchHub
+import unittest
+
+class TestWatchHub(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = WatchHub(3)
+        self.hub.first_id = self.hub.last_id = 10
+        self.hub.roles = {'web01': ['web', 'app'], 'db01': ['db']}
+
+    def entry(self, rev, table, op, key, data=None):
+        return dict(rev=rev, table=table, op=op, key=key, data=data)
+
+    def test_wait_timeout(self):
+        self.assertEqual(([], 10), self.hub.wait(None, None, 0))
+
+    def test_role_filter(self):
+        self.hub.publish([
+            self.entry(11, 'ip', 'insert', '192.168.1.130', dict(ip='192.168.1.130', is_used=0)),
+            self.entry(12, 'host', 'update', 'web01', dict(host_name='web01', ip='192.168.1.101', role=['app']))])
+        result, next_since = self.hub.wait(10, 'web', 0)
+        self.assertEqual([12], [e['rev'] for e in result])
+        self.assertEqual(12, next_since)
+        self.assertEqual(([], 12), self.hub.wait(10, 'db', 0))
+        self.assertEqual(['app'], self.hub.roles['web01'])
+
+    def test_deleted_host(self):
+        self.hub.publish([self.entry(11, 'host', 'delete', 'db01')])
+        result, next_since = self.hub.wait(10, 'db', 0)
+        self.assertEqual([11], [e['rev'] for e in result])
+        self.assertNotIn('db01', self.hub.roles)
+
+    def test_renamed_role(self):
+        self.hub.publish([self.entry(11, 'role', 'update', 'db', dict(role='mysql'))])
+        self.assertEqual(['mysql'], self.hub.roles['db01'])
+        result, next_since = self.hub.wait(10, 'mysql', 0)
+        self.assertEqual([11], [e['rev'] for e in result])
+
+    def test_behind_buffer(self):
+        self.hub.publish([self.entry(rev, 'ip', 'delete', str(rev)) for rev in range(11, 15)])
+        self.assertEqual(11, self.hub.first_id)
+        self.assertEqual(None, self.hub.wait(10, None, 0))
+        result, next_since = self.hub.wait(11, None, 0)
+        self.assertEqual([12, 13, 14], [e['rev'] for e in result])
+
+
+if __name__ == '__main__':
+    unittest.main()
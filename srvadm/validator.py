@@ -1,4 +1,5 @@
 import re
+import ipaddress
 
 def is_valid_ip(ip):
     valid_ip = '^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$'
@@ -13,3 +14,53 @@ def is_valid_keys(d, keys):
         if key not in d:
             return False
     return True
+
+def is_valid_cidr(cidr):
+    ip, sep, prefix = cidr.partition('/')
+    if sep != '/' or not is_valid_ip(ip):
+        return False
+    return re.match('^([0-9]|[12][0-9]|3[0-2])$', prefix) is not None
+
+def cidr_size(cidr):
+    return ipaddress.ip_network(cidr, strict=False).num_addresses
+
+def cidr_hosts(cidr):
+    network = ipaddress.ip_network(cidr, strict=False)
+    if network.prefixlen >= 31:
+        return [str(ip) for ip in network]
+    return [str(ip) for ip in network.hosts()]
+
+def ip_to_int(ip):
+    return int(ipaddress.IPv4Address(ip))
+
+def int_to_ip(ip_num):
+    return str(ipaddress.IPv4Address(ip_num))
+
+def cidr_range(cidr):
+    network = ipaddress.ip_network(cidr, strict=False)
+    return int(network.network_address), int(network.broadcast_address)
+
+def is_valid_ip_range(ip_range):
+    first, sep, last = ip_range.partition('-')
+    if sep != '-' or not is_valid_ip(first) or not is_valid_ip(last):
+        return False
+    return ip_to_int(first) <= ip_to_int(last)
+
+HOST_NAME_PATTERN = '^([^\[\]]*)\[([0-9]+)-([0-9]+)\]([^\[\]]*)$'
+
+def count_host_names(pattern):
+    # how many names expand_host_names would make, without making them
+    m = re.match(HOST_NAME_PATTERN, pattern)
+    if not m:
+        return 1
+    prefix, first, last, suffix = m.groups()
+    return max(int(last) - int(first) + 1, 0)
+
+def expand_host_names(pattern):
+    # web[01-03] -> web01, web02, web03
+    m = re.match(HOST_NAME_PATTERN, pattern)
+    if not m:
+        return [pattern]
+    prefix, first, last, suffix = m.groups()
+    return ['%s%0*d%s' % (prefix, len(first), i, suffix)
+            for i in range(int(first), int(last) + 1)]
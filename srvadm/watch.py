@@ -0,0 +1,161 @@
+from collections import deque
+from threading import Condition, Event, Lock, Thread
+import time
+
+from srvadm import app, db
+from srvadm.models import ChangeLog, RoleMap, Revision
+from srvadm.changes import on_commit, changelog_entry, CHANGELOG_FLOOR
+
+class WatchHub(object):
+    # one poller per process reads the change log and wakes every waiting
+    # watcher; watchers only ever touch memory while they wait
+
+    def __init__(self, size):
+        # (entry, role names whose membership it may alter), in id order
+        self.entries = deque(maxlen=size)
+        # the buffer holds every entry after first_id up to last_id
+        self.first_id = None
+        self.last_id = None
+        # host name -> role names, as of last_id
+        self.roles = {}
+        self.condition = Condition()
+        self.wakeup = Event()
+        self.thread = None
+        self.lock = Lock()
+
+    def clear(self):
+        with self.condition:
+            self.entries.clear()
+            self.first_id = self.last_id = None
+            self.roles = {}
+
+    def start(self):
+        with self.lock:
+            if self.last_id is not None:
+                return
+            # one transaction, so the roles are those as of last_id. from the
+            # primary, which the poller reads too
+            try:
+                last_id = ChangeLog.select_last_id(db.primary_execute)
+                roles = RoleMap.select_role_names_by_host_names(db.primary_execute)
+            finally:
+                db.session.remove()
+            with self.condition:
+                self.first_id = self.last_id = last_id
+                self.roles = roles
+
+            if self.thread is None:
+                self.thread = Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(app.config['WATCH_POLL_INTERVAL'])
+            self.wakeup.clear()
+            with app.app_context():
+                try:
+                    self.poll()
+                except Exception:
+                    app.logger.exception('watch poll failed')
+
+    def poll(self):
+        if self.last_id is None:
+            return
+        limit = app.config['CHANGES_LIMIT']
+        try:
+            rows = ChangeLog.select_since(db.session.execute, self.last_id, limit)
+        finally:
+            db.session.remove()
+        if len(rows) == limit:
+            self.wakeup.set()
+        self.publish([changelog_entry(r) for r in rows])
+
+    def publish(self, entries):
+        if not entries:
+            return
+        with self.condition:
+            for entry in entries:
+                self.entries.append((entry, self.touched_roles(entry)))
+            if len(self.entries) == self.entries.maxlen:
+                self.first_id = self.entries[0][0]['rev'] - 1
+            self.last_id = entries[-1]['rev']
+            self.condition.notify_all()
+
+    def touched_roles(self, entry):
+        # roles gained or lost by the change, keeping self.roles current
+        data = entry['data']
+        if entry['table'] == 'host':
+            touched = set(self.roles.pop(entry['key'], []))
+            if data:
+                self.roles[data['host_name']] = data['role']
+                touched.update(data['role'])
+            return touched
+        if entry['table'] == 'role':
+            touched = set([entry['key']])
+            if data:
+                touched.add(data['role'])
+                for host_name, role_names in self.roles.items():
+                    if entry['key'] in role_names:
+                        self.roles[host_name] = [data['role'] if r == entry['key'] else r
+                                for r in role_names]
+            return touched
+        return set()
+
+    def wait(self, since, role_name, timeout):
+        # (entries after since concerning role_name, id to continue from),
+        # waiting up to timeout for one; None when since is older than the
+        # buffer and the caller has to read the change log itself
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            if since is None:
+                since = self.last_id
+            while True:
+                if since < self.first_id:
+                    return None
+                found = []
+                for entry, touched in reversed(self.entries):
+                    if entry['rev'] <= since:
+                        break
+                    if role_name is None or role_name in touched:
+                        found.append(entry)
+                if found:
+                    found.reverse()
+                    return found, self.last_id
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], max(since, self.last_id)
+                self.condition.wait(remaining)
+
+def catch_up(since, role_name):
+    # entries older than the buffer come from the change log. memberships
+    # before them are unknown, so any host update or delete is passed on;
+    # None when compaction already removed some of them
+    try:
+        floor = Revision.select_revisions(db.session.execute, [CHANGELOG_FLOOR])
+        if since < floor.get(CHANGELOG_FLOOR, (0, None))[0]:
+            return None
+        rows = ChangeLog.select_since(db.session.execute, since, app.config['CHANGES_LIMIT'])
+    finally:
+        db.session.remove()
+
+    found = []
+    for entry in [changelog_entry(r) for r in rows]:
+        data = entry['data']
+        if role_name is None:
+            found.append(entry)
+        elif entry['table'] == 'host':
+            if entry['op'] != 'insert' or role_name in data['role']:
+                found.append(entry)
+        elif entry['table'] == 'role':
+            if entry['key'] == role_name or (data and data['role'] == role_name):
+                found.append(entry)
+    return found, rows[-1].id if rows else since
+
+watch_hub = WatchHub(app.config.get('WATCH_BUFFER_SIZE', 10000))
+
+@on_commit
+def wake_watch_hub(changes, revisions):
+    # poll right away rather than at the next interval
+    if watch_hub.last_id is not None:
+        watch_hub.wakeup.set()
@@ -1,4 +1,5 @@
 var api = 'http://localhost:8080';
+var pageSize = 500;
 
 angular.module('app', ['ngRoute', 'xeditable', 'ui.bootstrap'])
     .config(function($routeProvider){
@@ -25,19 +26,26 @@ angular.module('app', ['ngRoute', 'xeditable', 'ui.bootstrap'])
  
         $scope.ipaddrs = [];
  
-        // get all
-        AppService.get(url).success(function(res){
-            for(var i = 0; i < res.result.length; i++){
-                if(res.result[i].is_used == 0){
-                    res.result[i].is_used = "No";
-                } else {
-                    res.result[i].is_used = "Yes";
+        // get one page, filtered by the search box
+        $scope.load = function(after){
+            AppService.getPage(url, {q: $scope.searchItem, after: after}).success(function(res){
+                var result = res.result;
+                for(var i = 0; i < result.length; i++){
+                    if(result[i].is_used == 0){
+                        result[i].is_used = "No";
+                    } else {
+                        result[i].is_used = "Yes";
+                    }
                 }
-            }
-            $scope.ipaddrs = res.result;
-        }).error(function(data, status, headers, config){
-            var message = 'Could not get data from api. HTTP status: ' + status;
-            DialogService.showErrorDialog($scope, message);
+                $scope.ipaddrs = after ? $scope.ipaddrs.concat(result) : result;
+                $scope.next = res.next;
+            }).error(function(data, status, headers, config){
+                var message = 'Could not get data from api. HTTP status: ' + status;
+                DialogService.showErrorDialog($scope, message);
+            });
+        };
+        $scope.$watch('searchItem', function(){
+            $scope.load(null);
         });
  
         // add
@@ -88,12 +96,18 @@ angular.module('app', ['ngRoute', 'xeditable', 'ui.bootstrap'])
  
         $scope.roles = [];
  
-        // get all
-        AppService.get(url).success(function(res){
-            $scope.roles = res.result;
-        }).error(function(data, status, headers, config){
-            var message = 'Could not get data from api. HTTP status: ' + status;
-            DialogService.showErrorDialog($scope, message);
+        // get one page, filtered by the search box
+        $scope.load = function(after){
+            AppService.getPage(url, {q: $scope.searchItem, after: after}).success(function(res){
+                $scope.roles = after ? $scope.roles.concat(res.result) : res.result;
+                $scope.next = res.next;
+            }).error(function(data, status, headers, config){
+                var message = 'Could not get data from api. HTTP status: ' + status;
+                DialogService.showErrorDialog($scope, message);
+            });
+        };
+        $scope.$watch('searchItem', function(){
+            $scope.load(null);
         });
  
         // add
@@ -137,7 +151,7 @@ angular.module('app', ['ngRoute', 'xeditable', 'ui.bootstrap'])
             });
         };
  
-    }).controller('HostController', function($scope, AppService, DialogService){
+    }).controller('HostController', function($scope, $routeParams, AppService, DialogService){
 
         var url = api + '/api/host'
 
@@ -145,12 +159,25 @@ angular.module('app', ['ngRoute', 'xeditable', 'ui.bootstrap'])
         $scope.ipaddrs = [];
         $scope.roles = [];
 
-        // get all
-        AppService.get(url).success(function(res){
-            $scope.hosts = res.result;
-        }).error(function(data, status, headers, config){
-            var message = 'Could not get data from api. HTTP status: ' + status;
-            DialogService.showErrorDialog($scope, message);
+        // get one page, filtered by the search box and by #/host?role=
+        $scope.load = function(after){
+            var params = {q: $scope.searchItem, role: $routeParams.role, after: after};
+            AppService.getPage(url, params).success(function(res){
+                $scope.hosts = after ? $scope.hosts.concat(res.result) : res.result;
+                $scope.next = res.next;
+            }).error(function(data, status, headers, config){
+                if (status == 404) {
+                    // nothing matches the filter
+                    $scope.hosts = [];
+                    $scope.next = null;
+                    return;
+                }
+                var message = 'Could not get data from api. HTTP status: ' + status;
+                DialogService.showErrorDialog($scope, message);
+            });
+        };
+        $scope.$watch('searchItem', function(){
+            $scope.load(null);
         });
  
         // add
@@ -197,14 +224,16 @@ angular.module('app', ['ngRoute', 'xeditable', 'ui.bootstrap'])
         };
 
         $scope.loadAvailableIP = function(){
-            AppService.get(api + '/api/list/ip/unused').success(function(res){
-                $scope.ipaddrs = res.result;
+            $scope.ipaddrs = [];
+            AppService.getPages(api + '/api/list/ip/unused', function(result){
+                $scope.ipaddrs = $scope.ipaddrs.concat(result);
             });
         };
     
         $scope.loadRole = function(){
-            AppService.get(api + '/api/list/role').success(function(json){
-                $scope.roles = json.result;
+            $scope.roles = [];
+            AppService.getPages(api + '/api/list/role', function(result){
+                $scope.roles = $scope.roles.concat(result);
             });
         };
 
@@ -214,6 +243,28 @@ angular.module('app', ['ngRoute', 'xeditable', 'ui.bootstrap'])
             get: function(url){
                 return $http.get(url);
             }, 
+            // one page of a listing, the api does the filtering; unset
+            // params are left out of the query
+            getPage: function(url, params){
+                return $http.get(url, {params: angular.extend({limit: pageSize}, params)});
+            },
+            // follows the cursor page by page, handing each page to onPage as
+            // it arrives; errors are reported on the first page only
+            getPages: function(url, onPage){
+                var getPage = function(after){
+                    var params = {limit: pageSize};
+                    if (after) {
+                        params.after = after;
+                    }
+                    return $http.get(url, {params: params}).success(function(res){
+                        onPage(res.result);
+                        if (res.next) {
+                            getPage(res.next);
+                        }
+                    });
+                };
+                return getPage(null);
+            },
             save: function(url, updateTarget, dataPosted){
                 if (updateTarget == ''){
                     return $http.post(url, dataPosted);